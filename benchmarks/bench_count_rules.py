@@ -0,0 +1,108 @@
+"""
+Compares the audiences of drips with ``__count`` rules built with ``Count`` annotations, as done before
+count rules were compiled in correlated subqueries, against ``DripBase.get_queryset``, on a synthetic
+user table with a large related table of sent drips.
+
+Run it from the root of the repository, the data is created in an in-memory database::
+
+    python benchmarks/bench_count_rules.py
+"""
+import functools
+import operator
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "testsettings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import Group  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.db.models import Q  # noqa: E402
+
+from drip.models import Drip, QuerySetRule, SentDrip  # noqa: E402
+from drip.utils import get_user_model  # noqa: E402
+
+USERS = 20000
+SENT_DRIPS = 400000
+
+SCENARIOS = [
+    ("count >= 30", [("sent_drips__count", "gte", "30")]),
+    ("count > 0", [("sent_drips__count", "gt", "0")]),
+    ("count == 0", [("sent_drips__count", "exact", "0")]),
+    ("two counts", [("sent_drips__count", "gte", "30"), ("groups__count", "gte", "2")]),
+]
+
+
+def build_data() -> Drip:
+    User = get_user_model()
+    random.seed(0)
+    User.objects.bulk_create(
+        [User(username="user{i}".format(i=i), email="user{i}@example.com".format(i=i)) for i in range(USERS)],
+        batch_size=2000,
+    )
+    pks = list(User.objects.values_list("pk", flat=True))
+    groups = [Group.objects.create(name="group{i}".format(i=i)) for i in range(4)]
+    Membership = User.groups.through
+    Membership.objects.bulk_create(
+        [Membership(user_id=pk, group_id=group.pk) for pk in pks for group in groups if random.random() < 0.4],
+        batch_size=5000,
+    )
+    drip = Drip.objects.create(name="Benchmark", subject_template="Hi", body_html_template="Hi")
+    # most users received some drips, a few received many and some none
+    weights = [random.paretovariate(1.2) if random.random() < 0.8 else 0 for pk in pks]
+    SentDrip.objects.bulk_create(
+        [
+            SentDrip(drip=drip, user_id=pk, subject="", body="")
+            for pk in random.choices(pks, weights=weights, k=SENT_DRIPS)
+        ],
+        batch_size=5000,
+    )
+    return drip
+
+
+def legacy_queryset(drip: Drip):
+    """The audience as built with a Count annotation for every count rule."""
+    qs = get_user_model().objects.all()
+    filters = []
+    for rule in drip.queryset_rules.all():
+        qs = rule.apply_any_annotation(qs)
+        filters.append(Q(**rule.filter_kwargs()))
+    return qs.filter(functools.reduce(operator.and_, filters)).distinct()
+
+
+def main() -> None:
+    connection.creation.create_test_db(verbosity=0)
+    drip = build_data()
+    print("{users} users, {sent} sent drips".format(users=USERS, sent=SENT_DRIPS))
+
+    for name, rules in SCENARIOS:
+        drip.queryset_rules.all().delete()
+        for field_name, lookup_type, field_value in rules:
+            QuerySetRule.objects.create(
+                drip=drip, field_name=field_name, lookup_type=lookup_type, field_value=field_value
+            )
+
+        def legacy():
+            return sorted(legacy_queryset(drip).values_list("pk", flat=True))
+
+        def compiled():
+            return sorted(drip.drip.get_queryset().values_list("pk", flat=True))
+
+        audience = compiled()
+        assert legacy() == audience
+        timings = [min(timeit.repeat(func, number=1, repeat=3)) for func in (legacy, compiled)]
+        print(
+            "{name:<12} {size:6} users   Count annotation {legacy:7.1f} ms   subqueries {compiled:7.1f} ms".format(
+                name=name, size=len(audience), legacy=timings[0] * 1e3, compiled=timings[1] * 1e3
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
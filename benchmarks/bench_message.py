@@ -0,0 +1,83 @@
+"""
+Compares building the MIME messages of a drip with ``EmailMultiAlternatives``, as done before
+messages shared a ``MessageSkeleton``, against ``DripEmail``: CPU time per message, and memory
+held by the MIME messages of a batch.
+
+Run it from the root of the repository::
+
+    python benchmarks/bench_message.py
+"""
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "testsettings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.mail import EmailMultiAlternatives  # noqa: E402
+
+from drip.mime import DripEmail, MessageSkeleton  # noqa: E402
+from drip.plaintext import html_to_text  # noqa: E402
+
+MESSAGES = 2000
+
+SUBJECT = "Our weekly news"
+FROM_EMAIL = "Drips Newsletter <news@example.com>"
+HTML = "<html><body>{rows}</body></html>".format(
+    rows="".join("<p>Product {row}: our best offer of the week, only for you.</p>".format(row=row) for row in range(80))
+)
+PLAIN = html_to_text(HTML).text
+RECIPIENTS = ["user{i}@example.com".format(i=i) for i in range(MESSAGES)]
+
+
+def build_django_messages():
+    messages = []
+    for to in RECIPIENTS:
+        email = EmailMultiAlternatives(SUBJECT, PLAIN, FROM_EMAIL, [to])
+        email.attach_alternative(HTML, "text/html")
+        messages.append(email.message())
+    return messages
+
+
+def build_drip_messages():
+    skeleton = MessageSkeleton(FROM_EMAIL)
+    messages = []
+    for to in RECIPIENTS:
+        email = DripEmail(SUBJECT, PLAIN, FROM_EMAIL, [to], skeleton=skeleton)
+        email.attach_alternative(HTML, "text/html")
+        messages.append(email.message())
+    return messages
+
+
+def measure_memory(func) -> int:
+    tracemalloc.start()
+    messages = func()  # noqa: F841
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size
+
+
+def main() -> None:
+    assert build_django_messages()[0].as_bytes().count(b"Product 79") == build_drip_messages()[0].as_bytes().count(
+        b"Product 79"
+    )
+
+    for name, func in [("EmailMultiAlternatives", build_django_messages), ("DripEmail", build_drip_messages)]:
+        best = min(timeit.repeat(func, number=1, repeat=5))
+        size = measure_memory(func)
+        print(
+            "{name:<24} {per_message:8.1f} us per message {memory:10.0f} bytes held per message".format(
+                name=name,
+                per_message=best / MESSAGES * 1e6,
+                memory=size / MESSAGES,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
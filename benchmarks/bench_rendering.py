@@ -0,0 +1,76 @@
+"""
+Compares rendering the body of a drip with ``Template.render``, as done before
+templates were split in segments, against ``DripMessage.body``.
+
+Run it from the root of the repository::
+
+    python benchmarks/bench_rendering.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "testsettings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.template import Context, Template  # noqa: E402
+
+from drip.drips import DripBase, DripMessage  # noqa: E402
+from drip.models import Drip  # noqa: E402
+from drip.utils import get_user_model  # noqa: E402
+
+USERS = 2000
+ROWS = 40
+
+ROW = (
+    "<tr><td style='padding: 8px'><img src='{% static 'products/ROW.png' %}'></td>"
+    "<td>{% comment %}product ROW{% endcomment %}Our best offer of the week</td></tr>"
+)
+BODY = (
+    "{% load static %}<html><body>{% spaceless %}<h1>Hi {{ user.first_name }}!</h1>{% endspaceless %}<table>"
+    + "".join(ROW.replace("ROW", str(row)) for row in range(ROWS))
+    + "</table><p>Sent to {{ user.email }}</p><footer>{% now 'Y' %} Drips</footer></body></html>"
+)
+
+
+def build_drip() -> DripBase:
+    drip_model = Drip(name="Benchmark", subject_template="Hi {{ user.first_name }}", body_html_template=BODY)
+    return DripBase(drip_model=drip_model, name="Benchmark", subject_template="", body_template=BODY)
+
+
+def main() -> None:
+    User = get_user_model()
+    users = [
+        User(username="user{i}".format(i=i), first_name="User {i}".format(i=i), email="user{i}@example.com".format(i=i))
+        for i in range(USERS)
+    ]
+    drip = build_drip()
+    template = Template(BODY)
+
+    contexts = [DripMessage(drip, user).build_context() for user in users]
+
+    def template_render():
+        for context_dict in contexts:
+            template.render(Context(context_dict))
+
+    def message_body():
+        for user, context_dict in zip(users, contexts):
+            message = DripMessage(drip, user)
+            # time the render only, building the context costs the same on both sides
+            message._context_dict = context_dict
+            message.body
+
+    for user, context_dict in zip(users[:10], contexts):
+        assert template.render(Context(context_dict)) == DripMessage(drip, user).body
+
+    for name, func in [("Template.render", template_render), ("DripMessage.body", message_body)]:
+        best = min(timeit.repeat(func, number=1, repeat=5))
+        print("{name:<18} {per_message:8.1f} us per message".format(name=name, per_message=best / USERS * 1e6))
+
+
+if __name__ == "__main__":
+    main()
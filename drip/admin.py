@@ -11,7 +11,7 @@ from django.urls import URLPattern, path
 
 from drip.campaigns.admin import CampaignAdmin
 from drip.drips import configured_message_classes, message_class_for
-from drip.models import Campaign, Drip, QuerySetRule, SentDrip
+from drip.models import Campaign, Drip, DripRetry, OutboxMessage, QuerySetRule, SentDrip
 from drip.utils import get_simple_fields, get_user_model
 
 User = get_user_model()
@@ -201,4 +201,22 @@ class SentDripAdmin(admin.ModelAdmin):
 admin.site.register(SentDrip, SentDripAdmin)
 
 
+class DripRetryAdmin(admin.ModelAdmin):
+    list_display = ("drip", "user", "status", "attempts", "next_attempt_at", "last_error")
+    list_filter = ("status", "drip")
+    ordering = ["next_attempt_at"]
+
+
+admin.site.register(DripRetry, DripRetryAdmin)
+
+
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ("sent_drip", "status", "attempts", "next_attempt_at", "last_error")
+    list_filter = ("status",)
+    ordering = ["next_attempt_at"]
+
+
+admin.site.register(OutboxMessage, OutboxMessageAdmin)
+
+
 admin.site.register(Campaign, CampaignAdmin)
@@ -41,7 +41,7 @@ class CampaignAdmin(admin.ModelAdmin):
         new_shifted_drips = OrderedDict()
         for shift in range(-into_past, into_future + 1):
             new_shifted_drips[shift] = {"drips": [], "now_shift_kwargs_days": shift}
-        for drip in campaign.drip_set.all():
+        for drip in campaign.drip_set.prefetch_related("queryset_rules"):
             seen_users: Set[int] = set()
             for shifted_drip in drip.drip.walk(into_past=int(into_past), into_future=int(into_future) + 1):
                 shifted_drip.prune()
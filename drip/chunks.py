@@ -0,0 +1,222 @@
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Optional
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Q
+
+from drip.exclusions import SharedExclusions
+from drip.models import CHUNK_DONE, CHUNK_LEASED, CHUNK_PENDING, Drip, DripChunk
+from drip.utils import get_conditional_now
+
+conditional_now = get_conditional_now()
+
+LOCK_MODE_AUTO = "auto"
+LOCK_MODE_SKIP_LOCKED = "skip_locked"
+LOCK_MODE_CONDITIONAL = "conditional"
+
+
+def get_chunk_settings() -> dict:
+    return getattr(settings, "DRIP_CHUNK_SETTINGS", {})
+
+
+class ChunkLeaser(object):
+    """
+    Splits the audience of the enabled drips in chunks stored in the database,
+    and leases them to the nodes sending drips, so any amount of nodes can send
+    at once without a coordinator.
+
+    Each drip is planned once per ``window`` of seconds, aligned on the hour by default, so nodes
+    started after the others finished do not send the drip again in the same window.
+
+    A lease lasts ``lease`` seconds: chunks of a node that dies are leased again
+    once it expires, taking over the claims it left, so keep it longer than the
+    time needed to send a chunk.
+    Chunks are leased with ``SELECT ... FOR UPDATE SKIP LOCKED`` when the database
+    supports it. Otherwise, as on SQLite, a chunk is leased with an UPDATE
+    conditioned on its current lease, which only one node can win.
+
+    :param chunk_size: Amount of users per chunk
+    :type chunk_size: int
+    :param lease: Seconds a chunk is reserved for its node
+    :type lease: float
+    :param lock_mode: "skip_locked", "conditional" or "auto" to pick the best one for the database
+    :type lock_mode: str
+    :param owner: Name of this node, defaults to its hostname and process id
+    :type owner: Optional[str]
+    :param window: Seconds of the windows in which each drip is planned once, 0 to plan again once sent
+    :type window: float
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = 1000,
+        lease: float = 600,
+        lock_mode: str = LOCK_MODE_AUTO,
+        owner: Optional[str] = None,
+        window: float = 3600,
+    ):
+        self.chunk_size = chunk_size
+        self.lease = lease
+        self.lock_mode = lock_mode
+        self.window = window
+        self.owner = owner or "{host}:{pid}:{id}".format(host=socket.gethostname(), pid=os.getpid(), id=uuid4().hex[:8])
+        self.shared_exclusions = SharedExclusions()
+
+    @classmethod
+    def from_settings(cls, owner: Optional[str] = None) -> "ChunkLeaser":
+        """Builds the leaser from DRIP_CHUNK_SETTINGS."""
+        chunk_settings = get_chunk_settings()
+        return cls(
+            chunk_size=chunk_settings.get("CHUNK_SIZE", 1000),
+            lease=chunk_settings.get("LEASE", 600),
+            lock_mode=chunk_settings.get("LOCK_MODE", LOCK_MODE_AUTO),
+            owner=owner,
+            window=chunk_settings.get("PLAN_WINDOW", 3600),
+        )
+
+    def get_lock_mode(self) -> str:
+        if self.lock_mode != LOCK_MODE_AUTO:
+            return self.lock_mode
+        features = connections[router.db_for_write(DripChunk)].features
+        if features.has_select_for_update_skip_locked:
+            return LOCK_MODE_SKIP_LOCKED
+        return LOCK_MODE_CONDITIONAL
+
+    def plan_drip(self, drip_model: Drip) -> int:
+        """
+        Splits the pruned audience of the drip in chunks, returns the amount of created chunks.
+        Nothing is planned while the drip has unfinished chunks, or chunks planned in the current window,
+        so every node can call it.
+        """
+        with transaction.atomic():
+            # serializes the nodes planning the same drip, where row locks are supported
+            Drip.objects.select_for_update().filter(pk=drip_model.pk).first()
+            if DripChunk.objects.filter(drip=drip_model).exclude(status=CHUNK_DONE).exists():
+                return 0
+            if (
+                self.window
+                and DripChunk.objects.filter(drip=drip_model, created_date__gte=self.get_window_start()).exists()
+            ):
+                return 0
+            DripChunk.objects.filter(drip=drip_model, status=CHUNK_DONE).delete()
+            drip = drip_model.drip
+            drip.prune()
+            chunks = [
+                DripChunk(drip=drip_model, first_pk=str(first_pk), last_pk=str(last_pk))
+                for first_pk, last_pk in drip.get_pk_ranges(self.chunk_size)
+            ]
+            DripChunk.objects.bulk_create(chunks)
+        return len(chunks)
+
+    def get_window_start(self) -> datetime:
+        """Returns the start of the current planning window."""
+        now = conditional_now()
+        return now - timedelta(seconds=now.timestamp() % self.window)
+
+    def plan(self) -> int:
+        """Plans every enabled drip, returns the amount of created chunks."""
+        drip_models = Drip.objects.filter(enabled=True).prefetch_related("queryset_rules")
+        return sum(self.plan_drip(drip_model) for drip_model in drip_models)
+
+    def get_leasable(self, now: datetime):
+        return DripChunk.objects.filter(
+            Q(status=CHUNK_PENDING) | Q(status=CHUNK_LEASED, leased_until__lt=now),
+        ).order_by("pk")
+
+    def lease_skip_locked(self, now: datetime) -> Optional[DripChunk]:
+        with transaction.atomic():
+            chunk = self.get_leasable(now).select_for_update(skip_locked=True).first()
+            if chunk is None:
+                return None
+            chunk.status = CHUNK_LEASED
+            chunk.lease_owner = self.owner
+            chunk.leased_until = now + timedelta(seconds=self.lease)
+            chunk.attempts += 1
+            chunk.save(update_fields=["status", "lease_owner", "leased_until", "attempts"])
+        return chunk
+
+    def lease_conditional(self, now: datetime) -> Optional[DripChunk]:
+        for chunk in self.get_leasable(now)[:10]:
+            leased = DripChunk.objects.filter(
+                pk=chunk.pk,
+                status=chunk.status,
+                lease_owner=chunk.lease_owner,
+                attempts=chunk.attempts,
+            ).update(
+                status=CHUNK_LEASED,
+                lease_owner=self.owner,
+                leased_until=now + timedelta(seconds=self.lease),
+                attempts=chunk.attempts + 1,
+            )
+            if leased:
+                chunk.refresh_from_db()
+                return chunk
+        return None
+
+    def lease_chunk(self) -> Optional[DripChunk]:
+        """Leases the next pending or expired chunk, returns None when there is none left."""
+        now = conditional_now()
+        if self.get_lock_mode() == LOCK_MODE_SKIP_LOCKED:
+            return self.lease_skip_locked(now)
+        while True:
+            chunk = self.lease_conditional(now)
+            # other nodes won all the candidates, look for more
+            if chunk is not None or not self.get_leasable(now).exists():
+                return chunk
+
+    def finish_chunk(self, chunk: DripChunk, count: int) -> None:
+        finished = DripChunk.objects.filter(pk=chunk.pk, lease_owner=self.owner).update(status=CHUNK_DONE, sent=count)
+        if not finished:
+            logging.warning(
+                "Lease of chunk {chunk} of drip {drip} expired while sending it".format(
+                    chunk=chunk.pk,
+                    drip=chunk.drip_id,
+                )
+            )
+
+    def send_chunk(self, chunk: DripChunk, workers: Optional[int] = None) -> int:
+        """
+        Sends the drip to the users of the chunk and marks it as done, returns the count of created SentDrips.
+        A chunk that fails is marked as done too: its users were not sent the drip, so the next plan includes them.
+        """
+        count = 0
+        try:
+            if chunk.drip.enabled:
+                drip = chunk.drip.drip
+                drip.shared_exclusions = self.shared_exclusions
+                if chunk.attempts > 1 and chunk.leased_until is not None:
+                    # the lease of the previous node expired, the claims it left can be taken over
+                    drip.claims_stale_before = chunk.leased_until - timedelta(seconds=self.lease)
+                drip.prune_for_send()
+                drip.limit_to_pk_range(chunk.first_pk, chunk.last_pk)
+                count = drip.send(workers=workers)
+        except Exception as e:
+            logging.error(
+                "Failed to send chunk {chunk} of drip {drip}: {err}".format(
+                    chunk=chunk.pk,
+                    drip=chunk.drip_id,
+                    err=str(e),
+                )
+            )
+        self.finish_chunk(chunk, count)
+        return count
+
+    def work(self, limit: Optional[int] = None, workers: Optional[int] = None) -> int:
+        """
+        Leases and sends chunks until none is left or ``limit`` chunks were sent, returns the sent count.
+        ``workers`` is the amount of threads delivering the messages of each chunk.
+        """
+        count = 0
+        done = 0
+        while limit is None or done < limit:
+            chunk = self.lease_chunk()
+            if chunk is None:
+                break
+            count += self.send_chunk(chunk, workers=workers)
+            done += 1
+        return count
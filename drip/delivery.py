@@ -0,0 +1,380 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.mail.message import sanitize_address
+from django.db import close_old_connections, transaction
+from django.db.models.query import QuerySet
+
+from drip.models import SentDrip
+from drip.ratelimit import RateLimiter
+from drip.utils import queryset_chunks
+
+try:
+    import aiosmtplib
+except ImportError:
+    aiosmtplib = None
+
+if TYPE_CHECKING:
+    from drip.drips import DripMessage
+
+SMTP_EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+
+DeliveryResult = Tuple["DripMessage", int, Optional[Exception]]
+
+
+class SentDripWriter(object):
+    """
+    Persists the SentDrip rows of a drip run.
+
+    Without a ``batch_size`` every row is saved as soon as it is added,
+    so errors are raised to the caller exactly like ``SentDrip.objects.create``.
+    With a ``batch_size`` rows are collected and written with ``bulk_create``,
+    each batch inside its own transaction. A batch that fails to be written
+    is not counted, and every row of it is reported to ``on_error``.
+
+    :param batch_size: Amount of rows written per INSERT, falsy to save rows one by one
+    :type batch_size: Optional[int]
+    :param on_error: Called with the user and the error of every row that failed to be written
+    :type on_error: Optional[Callable[[Any, Exception], None]]
+    """
+
+    def __init__(self, batch_size: Optional[int] = None, on_error: Optional[Callable[[Any, Exception], None]] = None):
+        self.batch_size = batch_size
+        self.on_error = on_error or self.log_failed_write
+        self.count = 0
+        self._pending: List[SentDrip] = []
+
+    @staticmethod
+    def log_failed_write(user: Any, error: Exception) -> None:
+        logging.error("Failed to record a sent drip for user {user}: {err}".format(user=str(user), err=str(error)))
+
+    def add(self, sent_drip: SentDrip) -> None:
+        if not self.batch_size:
+            sent_drip.save()
+            self.count += 1
+            return
+        self._pending.append(sent_drip)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write every pending row in a single transaction."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        try:
+            with transaction.atomic():
+                SentDrip.objects.bulk_create(pending)
+        except Exception as e:
+            for sent_drip in pending:
+                self.on_error(sent_drip.user, e)
+        else:
+            self.count += len(pending)
+
+
+class SharedConnection(object):
+    """
+    Hands out an email backend connection reused for many messages,
+    instead of opening and closing one for every message.
+
+    The connection is opened on first use and reopened every ``chunk_size``
+    messages. Without a ``chunk_size`` a single connection is used until closed.
+
+    :param chunk_size: Amount of messages delivered through each connection
+    :type chunk_size: Optional[int]
+    """
+
+    def __init__(self, chunk_size: Optional[int] = None):
+        self.chunk_size = chunk_size
+        self.connection: Optional[BaseEmailBackend] = None
+        self._used = 0
+
+    def get(self) -> BaseEmailBackend:
+        if self.connection is not None and self.chunk_size and self._used >= self.chunk_size:
+            self.close()
+        if self.connection is None:
+            connection = get_connection()
+            connection.open()
+            self.connection = connection
+        self._used += 1
+        return self.connection
+
+    def close(self) -> None:
+        connection, self.connection = self.connection, None
+        self._used = 0
+        if connection is not None:
+            connection.close()
+
+    def discard(self) -> None:
+        """Drop a connection that may be broken, so the next message opens a new one."""
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class Delivery(object):
+    """
+    Renders and delivers messages one by one in the calling thread.
+
+    Yields a ``(message, sent, error)`` tuple for every message, where ``sent``
+    is the amount of delivered messages and ``error`` the exception raised, if any.
+
+    :param shared_connection: Connection reused for every message, if any
+    :type shared_connection: Optional[SharedConnection]
+    :param rate_limiter: Limiter every message waits for before being delivered, if any
+    :type rate_limiter: Optional[RateLimiter]
+    """
+
+    def __init__(
+        self,
+        shared_connection: Optional[SharedConnection] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
+        self.shared_connection = shared_connection
+        self.rate_limiter = rate_limiter
+
+    def deliver_one(self, message_instance: "DripMessage", shared_connection: Optional[SharedConnection]) -> int:
+        if self.rate_limiter:
+            self.rate_limiter.acquire(message_instance.drip_base.drip_model.pk, message_instance.user.email)
+        try:
+            connection = shared_connection.get() if shared_connection else None
+            return message_instance.send(connection)
+        except Exception:
+            if shared_connection:
+                shared_connection.discard()
+            raise
+
+    def deliver(self, message_instances: Iterable["DripMessage"]) -> Iterator[DeliveryResult]:
+        try:
+            for message_instance in message_instances:
+                try:
+                    yield message_instance, self.deliver_one(message_instance, self.shared_connection), None
+                except Exception as e:
+                    yield message_instance, 0, e
+        finally:
+            if self.shared_connection:
+                self.shared_connection.close()
+
+
+class ThreadedDelivery(Delivery):
+    """
+    Renders and delivers messages on a bounded pool of ``workers`` threads.
+
+    Every thread delivers through its own backend connection and releases
+    its stale database connections around each message. Results are yielded
+    in the calling thread as soon as they are done, so a single writer can
+    record them. At most ``workers * 2`` messages are in flight at once.
+
+    :param workers: Amount of threads
+    :type workers: int
+    :param chunk_size: Amount of messages delivered through each connection
+    :type chunk_size: Optional[int]
+    :param rate_limiter: Limiter every message waits for before being delivered, if any
+    :type rate_limiter: Optional[RateLimiter]
+    """
+
+    def __init__(self, workers: int, chunk_size: Optional[int] = None, rate_limiter: Optional[RateLimiter] = None):
+        super().__init__(rate_limiter=rate_limiter)
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: List[SharedConnection] = []
+
+    def get_thread_connection(self) -> SharedConnection:
+        shared_connection = getattr(self._local, "shared_connection", None)
+        if shared_connection is None:
+            shared_connection = SharedConnection(chunk_size=self.chunk_size)
+            self._local.shared_connection = shared_connection
+            with self._lock:
+                self._connections.append(shared_connection)
+        return shared_connection
+
+    def deliver_in_thread(self, message_instance: "DripMessage") -> DeliveryResult:
+        close_old_connections()
+        try:
+            return message_instance, self.deliver_one(message_instance, self.get_thread_connection()), None
+        except Exception as e:
+            return message_instance, 0, e
+        finally:
+            close_old_connections()
+
+    def deliver(self, message_instances: Iterable["DripMessage"]) -> Iterator[DeliveryResult]:
+        pending: Set[Future] = set()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for message_instance in message_instances:
+                    pending.add(executor.submit(self.deliver_in_thread, message_instance))
+                    if len(pending) >= self.workers * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            yield future.result()
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+        finally:
+            for shared_connection in self._connections:
+                shared_connection.discard()
+
+
+async def aiter_queryset(queryset: QuerySet, chunk_size: int = 2000) -> AsyncIterator[Any]:
+    """
+    Streams the objects of a queryset from async code, without caching them.
+    Uses ``QuerySet.aiterator`` when Django provides it, otherwise the rows are
+    fetched ``chunk_size`` at a time with ``queryset_chunks``.
+    """
+    if hasattr(queryset, "aiterator"):
+        async for obj in queryset.aiterator(chunk_size=chunk_size):
+            yield obj
+        return
+
+    async for obj in aiter_chunks(queryset_chunks(queryset, chunk_size)):
+        yield obj
+
+
+async def aiter_chunks(chunks: Iterator[List[Any]]) -> AsyncIterator[Any]:
+    """
+    Streams the objects of a synchronous iterator of chunks from async code.
+    Every chunk is fetched in the main synchronous thread, so it can use the database.
+    """
+    fetch_chunk = sync_to_async(lambda: next(chunks, []))
+    while True:
+        objs = await fetch_chunk()
+        if not objs:
+            return
+        for obj in objs:
+            yield obj
+
+
+class AsyncDelivery(object):
+    """
+    Renders and delivers messages from asyncio code, keeping up to ``max_in_flight``
+    messages in flight at once.
+
+    When the SMTP email backend is configured and ``aiosmtplib`` is installed,
+    messages are delivered through a pool of asynchronous SMTP clients built from
+    the ``EMAIL_*`` settings, one per in-flight message at most. Otherwise every
+    message is delivered by the configured backend in a worker thread.
+
+    :param max_in_flight: Maximum amount of messages being rendered or delivered at once
+    :type max_in_flight: int
+    :param rate_limiter: Limiter every message waits for before being delivered, if any
+    :type rate_limiter: Optional[RateLimiter]
+    """
+
+    def __init__(self, max_in_flight: int = 100, rate_limiter: Optional[RateLimiter] = None):
+        self.max_in_flight = max_in_flight
+        self.rate_limiter = rate_limiter
+        self.use_smtp_client = aiosmtplib is not None and settings.EMAIL_BACKEND == SMTP_EMAIL_BACKEND
+        self._clients: List[Any] = []
+        self._all_clients: List[Any] = []
+
+    def build_client(self) -> Any:
+        return aiosmtplib.SMTP(
+            hostname=settings.EMAIL_HOST,
+            port=settings.EMAIL_PORT,
+            username=settings.EMAIL_HOST_USER or None,
+            password=settings.EMAIL_HOST_PASSWORD or None,
+            use_tls=settings.EMAIL_USE_SSL,
+            start_tls=settings.EMAIL_USE_TLS,
+            timeout=settings.EMAIL_TIMEOUT,
+        )
+
+    async def acquire_client(self) -> Any:
+        if self._clients:
+            return self._clients.pop()
+        client = self.build_client()
+        await client.connect()
+        self._all_clients.append(client)
+        return client
+
+    def release_client(self, client: Any) -> None:
+        self._clients.append(client)
+
+    async def discard_client(self, client: Any) -> None:
+        self._all_clients.remove(client)
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    async def close(self) -> None:
+        clients, self._all_clients, self._clients = self._all_clients, [], []
+        for client in clients:
+            try:
+                await client.quit()
+            except Exception:
+                client.close()
+
+    async def send_with_client(self, email_message: EmailMessage) -> int:
+        encoding = email_message.encoding or settings.DEFAULT_CHARSET
+        recipients = [sanitize_address(address, encoding) for address in email_message.recipients()]
+        if not recipients:
+            return 0
+        from_email = sanitize_address(email_message.from_email, encoding)
+        message = email_message.message()
+        client = await self.acquire_client()
+        try:
+            await client.sendmail(from_email, recipients, message.as_bytes(linesep="\r\n"))
+        except Exception:
+            await self.discard_client(client)
+            raise
+        self.release_client(client)
+        return 1
+
+    async def deliver_one(self, message_instance: "DripMessage") -> DeliveryResult:
+        try:
+            # Rendering may hit the database, so it runs in the main synchronous thread.
+            email_message = await sync_to_async(lambda: message_instance.message)()
+            if self.rate_limiter:
+                wait = await sync_to_async(self.rate_limiter.reserve, thread_sensitive=False)(
+                    message_instance.drip_base.drip_model.pk,
+                    message_instance.user.email,
+                )
+                await asyncio.sleep(wait)
+            if self.use_smtp_client:
+                result = await self.send_with_client(email_message)
+            else:
+                result = await sync_to_async(message_instance.send, thread_sensitive=False)()
+        except Exception as e:
+            return message_instance, 0, e
+        return message_instance, result, None
+
+    async def deliver(self, message_instances: AsyncIterable["DripMessage"]) -> AsyncIterator[DeliveryResult]:
+        pending: Set[asyncio.Future] = set()
+        try:
+            async for message_instance in message_instances:
+                pending.add(asyncio.ensure_future(self.deliver_one(message_instance)))
+                if len(pending) >= self.max_in_flight:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+            await self.close()
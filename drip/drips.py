@@ -1,31 +1,69 @@
 import functools
 import logging
-import operator
+import threading
 from collections import ChainMap
 from datetime import datetime, timedelta
 from functools import lru_cache
 from importlib import import_module
-from typing import Any, Dict, List, Optional, TypedDict, Union
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, Iterator, List, Optional, Set, Tuple, TypedDict, Union
+from uuid import uuid4
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.core.mail import EmailMessage, EmailMultiAlternatives
-from django.db.models import Q
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db.models import Exists, OuterRef, prefetch_related_objects
 from django.db.models.manager import BaseManager
 from django.db.models.query import QuerySet
 from django.template import Context, Template
-from django.utils.html import strip_tags
-from django.utils.safestring import SafeString
+from django.utils.html import conditional_escape
+from django.utils.safestring import SafeString, mark_safe
 from typing_extensions import TypeAlias
 
+from drip.campaigns.models import UserUnsubscribeCampaign
+from drip.delivery import (
+    AsyncDelivery,
+    Delivery,
+    SentDripWriter,
+    SharedConnection,
+    ThreadedDelivery,
+    aiter_chunks,
+    aiter_queryset,
+)
 from drip.exceptions import MessageClassNotFound
-from drip.models import Drip, SentDrip, UserUnsubscribe
-from drip.tokens import EmailToken
-from drip.utils import build_now_from_timedelta, get_conditional_now, get_user_model, validate_path_existence
+from drip.exclusions import IdSet, SharedExclusions, load_id_set
+from drip.mime import DripEmail, MessageSkeleton
+from drip.models import (
+    RETRY_PENDING,
+    Drip,
+    DripClaim,
+    DripRetry,
+    QuerySetRule,
+    SentDrip,
+    UserUnsubscribe,
+    UserUnsubscribeDrip,
+)
+from drip.outbox import OutboxWriter, get_outbox_settings
+from drip.plaintext import PlainText, get_plain_text, html_to_text
+from drip.ratelimit import RateLimiter
+from drip.rendering import RenderMemo, SegmentedTemplate, is_static_template, prints_names_as_is, template_cache
+from drip.retries import RetryPolicy
+from drip.rules import CompiledRuleSet, rules_cache
+from drip.tokens import EmailToken, UnsubscribeLinks
+from drip.utils import build_now_from_timedelta, get_conditional_now, get_user_model, may_repeat_rows, queryset_chunks
 
 User = get_user_model()
 
 conditional_now = get_conditional_now()
 
+# Hooks of DripBase whose exclusions are replaced by the sets of DRIP_IN_MEMORY_EXCLUSIONS.
+IN_MEMORY_EXCLUSION_HOOKS = (
+    "exclude_sent_drips_users",
+    "exclude_unsubcribed_users_drip",
+    "exclude_unsubcribed_users_campaign",
+    "exclude_unsubcribed_users_general",
+)
+
 
 DEFAULT_DRIP_MESSAGE_CLASS = "drip.drips.DripMessage"
 
@@ -107,14 +145,35 @@ class DripMessage(object):
     :type user: User
     """
 
+    #: Context variables that change for every user, see ``build_context``.
+    #: Templates that read none of them are rendered once for the whole audience.
+    #: Subclasses customizing the context must list their per-user variables here to keep that behavior.
+    user_context_names: Tuple[str, ...] = (
+        "user",
+        "unsubscribe_link_drip",
+        "unsubscribe_link_campaign",
+        "unsubscribe_link",
+    )
+    #: Per-user context variables filled in renders shared by several users, see ``get_render_key``.
+    spliced_context_names: Tuple[str, ...] = (
+        "unsubscribe_link_drip",
+        "unsubscribe_link_campaign",
+        "unsubscribe_link",
+    )
+
     # Ignoring this line because mypy says User is not a valid type
     def __init__(self, drip_base: "DripBase", user: User):  # type: ignore
         self.drip_base = drip_base
         self.user: TypeAlias = user
         self._context: Optional[Context] = None
+        self._context_dict: Optional[Dict[str, Any]] = None
+        self._render_context_dict: Optional[Dict[str, Any]] = None
         self._subject: Optional[SafeString] = None
         self._body: Optional[SafeString] = None
         self._plain: str = ""
+        self._has_html: Optional[bool] = None
+        self._user_token: Optional[Tuple[str, str]] = None
+        self._unsubscribe_links: Dict[str, Optional[str]] = {}
         self._message: Union[EmailMessage, EmailMultiAlternatives, None] = None
 
     @property
@@ -128,34 +187,194 @@ class DripMessage(object):
     @property
     def context(self) -> Context:
         if not self._context:
-            context_dict = self.build_context()
+            context_dict = self.get_context_dict()
             self._context = Context(context_dict)
         return self._context
 
+    def get_context_dict(self) -> Dict[str, Any]:
+        """Returns the context of this message, built once with ``build_context``."""
+        if self._context_dict is None:
+            self._context_dict = self.build_context()
+        return self._context_dict
+
+    def get_render_context_dict(self) -> Dict[str, Any]:
+        """
+        Returns the variables pushed on the shared context to render this message. Unless a subclass
+        customizes the context, its unsubscribe links are callables, which templates only call when
+        they use the link, so links are only built when used.
+        """
+        if self.has_custom_context():
+            return self.get_context_dict()
+        if self._render_context_dict is None:
+            context = {"user": self.user}
+            for name in self.get_unsubscribe_link_names():
+                context[name] = functools.partial(self.get_unsubscribe_link, name)
+            self._render_context_dict = context
+        return self._render_context_dict
+
+    def render(self, template: Union[Template, SegmentedTemplate]) -> SafeString:
+        """
+        Renders a template with the context of this message, pushed on a context
+        reused by every message rendered in the same thread.
+        """
+        if type(self).context is not DripMessage.context:
+            # keep rendering with the context of subclasses that customize it
+            return template.render(self.context)
+        context = self.drip_base.get_shared_context()
+        with context.push(self.get_render_context_dict()):
+            return template.render(context)
+
+    def supports_static_render(self) -> bool:
+        """
+        Whether templates that read none of ``user_context_names`` can be rendered once for every user.
+        Subclasses that customize the context must also override ``user_context_names``.
+        """
+        cls = type(self)
+        declared = any(
+            "user_context_names" in vars(klass)
+            for klass in cls.__mro__
+            if klass is not DripMessage and issubclass(klass, DripMessage)
+        )
+        return not self.has_custom_context() or declared
+
+    def has_custom_context(self) -> bool:
+        """Whether a subclass customizes the context, overriding ``build_context`` or ``context``."""
+        cls = type(self)
+        return cls.build_context is not DripMessage.build_context or cls.context is not DripMessage.context
+
+    def render_static(self, name: str) -> Optional[SafeString]:
+        """Returns the subject or body rendered once for the whole audience, None when it depends on the user."""
+        if not self.supports_static_render():
+            return None
+        return self.drip_base.render_static(name, self.user_context_names, self.render)
+
+    def get_render_key(self) -> Optional[Hashable]:
+        """
+        Opt-in render memoization. Return a hashable value, like the plan of the user, and the subject,
+        body and plain text are rendered once for every distinct value and shared by the users with it.
+        The templates must only read the user data the key accounts for, while the variables of
+        ``spliced_context_names`` are still filled in for each user.
+        By default every message is rendered on its own.
+        """
+        return None
+
+    def get_spliced_values(self) -> Optional[Dict[str, str]]:
+        """Printed values of the spliced variables of this message, None when they can not be spliced."""
+        context_dict = self.get_render_context_dict()
+        values = {}
+        for name in self.spliced_context_names:
+            if name in context_dict:
+                value = context_dict[name]
+                value = str(value() if callable(value) else value)
+                # placeholders are not escaped like the value would be
+                if conditional_escape(value) != value:
+                    return None
+                values[name] = value
+        return values
+
+    def render_placeholders(self, name: str, placeholders: Dict[str, str]) -> str:
+        """Renders the "subject" or "body" with placeholders in place of the spliced variables."""
+        context_dict = self.get_render_context_dict()
+        context_dict = dict(context_dict, **{var: placeholders[var] for var in placeholders if var in context_dict})
+        context = self.drip_base.get_shared_context()
+        with context.push(context_dict):
+            return self.drip_base.get_segmented_template(name).render(context)
+
+    def get_memo_args(self, name: str) -> Optional[Tuple[Hashable, Dict[str, str], Dict[str, str]]]:
+        """
+        Returns the render key, placeholders and spliced values to memoize the "subject", "body"
+        or "plain" text of this message, None when it is not memoized.
+        """
+        if type(self).context is not DripMessage.context:
+            return None
+        key = self.get_render_key()
+        if key is None or not self.drip_base.can_splice(name, self.spliced_context_names):
+            return None
+        values = self.get_spliced_values()
+        if values is None:
+            return None
+        return key, self.drip_base.get_placeholders(self.spliced_context_names), values
+
+    def splice(self, rendered: str, placeholders: Dict[str, str], values: Dict[str, str]) -> str:
+        for var, value in values.items():
+            rendered = rendered.replace(placeholders[var], value)
+        return rendered
+
+    def render_memoized(self, name: str) -> Optional[str]:
+        """
+        Returns the "subject" or "body" memoized for the render key of this message,
+        with its spliced variables filled in. Returns None when it is not memoized.
+        """
+        memo_args = self.get_memo_args(name)
+        if memo_args is None:
+            return None
+        key, placeholders, values = memo_args
+        rendered = self.drip_base.render_memo.get(key, name, lambda: self.render_placeholders(name, placeholders))
+        return self.splice(rendered, placeholders, values)
+
+    def memoized_plain_text(self) -> Optional[PlainText]:
+        """Returns the plain text memoized for the render key of this message, None when it is not memoized."""
+        memo_args = self.get_memo_args("plain")
+        if memo_args is None:
+            return None
+        key, placeholders, values = memo_args
+        memo = self.drip_base.render_memo
+        plain_text = memo.get(
+            key,
+            "plain",
+            lambda: html_to_text(memo.get(key, "body", lambda: self.render_placeholders("body", placeholders))),
+        )
+        return PlainText(self.splice(plain_text.text, placeholders, values), plain_text.has_html)
+
     def build_context(self) -> Dict[str, Any]:
         """
         Build context drip dictionary allowing you easy extension.
         Also it is used to manage unsubscribe links configurations.
         """
         context = {"user": self.user}
+        for name in self.get_unsubscribe_link_names():
+            context[name] = self.get_unsubscribe_link(name)
+        return context
+
+    def get_unsubscribe_link_names(self) -> Tuple[str, ...]:
+        """Names of the unsubscribe links of the context, none when ``DRIP_UNSUBSCRIBE_USERS`` is not enabled."""
         unsubscribe_users = getattr(
             settings,
             "DRIP_UNSUBSCRIBE_USERS",
             False,
         )
         if unsubscribe_users:
-            context["unsubscribe_link_drip"] = self._get_unsubscribe_link_drip()
-            context["unsubscribe_link_campaign"] = self._get_unsubscribe_link_campaign()
-            context["unsubscribe_link"] = self._get_unsubscribe_link()
-        return context
+            return ("unsubscribe_link_drip", "unsubscribe_link_campaign", "unsubscribe_link")
+        return ()
+
+    def get_user_token(self) -> Tuple[str, str]:
+        """Returns the uidb64 and token of the user, computed once for all of its unsubscribe links."""
+        if self._user_token is None:
+            self._user_token = EmailToken(self.user).get_uidb64_token_user_only()
+        return self._user_token
+
+    def get_unsubscribe_link(self, name: str) -> Optional[str]:
+        """
+        Returns the "unsubscribe_link_drip", "unsubscribe_link_campaign" or "unsubscribe_link" of the user,
+        None when its URL is not configured.
+        """
+        if name not in self._unsubscribe_links:
+            uidb64, token = self.get_user_token()
+            self._unsubscribe_links[name] = self.drip_base.get_unsubscribe_links().build(name, uidb64, token)
+        return self._unsubscribe_links[name]
 
     @property
     def subject(self) -> SafeString:
         drip_subject: SafeString
         if not self._subject:
-            drip_subject = Template(
-                self.drip_base.subject_template,
-            ).render(self.context)
+            static_subject = self.render_static("subject")
+            memoized_subject = self.render_memoized("subject") if static_subject is None else None
+            if static_subject is not None:
+                drip_subject = static_subject
+            elif memoized_subject is not None:
+                drip_subject = mark_safe(memoized_subject)
+            else:
+                drip_subject = self.render(self.drip_base.get_segmented_template("subject"))
             self._subject = drip_subject
         else:
             drip_subject = self._subject
@@ -165,9 +384,14 @@ class DripMessage(object):
     def body(self) -> SafeString:
         drip_body: SafeString
         if not self._body:
-            drip_body = Template(
-                self.drip_base.body_template,
-            ).render(self.context)
+            static_body = self.render_static("body")
+            memoized_body = self.render_memoized("body") if static_body is None else None
+            if static_body is not None:
+                drip_body = static_body
+            elif memoized_body is not None:
+                drip_body = mark_safe(memoized_body)
+            else:
+                drip_body = self.render(self.drip_base.get_segmented_template("body"))
             self._body = drip_body
         else:
             drip_body = self._body
@@ -176,9 +400,22 @@ class DripMessage(object):
     @property
     def plain(self) -> str:
         if not self._plain:
-            self._plain = strip_tags(self.body)
+            plain_text = self.memoized_plain_text()
+            if plain_text is None:
+                # bodies shared by many messages, like static ones, are converted once
+                plain_text = get_plain_text(self.body)
+            self._plain, self._has_html = plain_text
         return self._plain
 
+    @property
+    def has_html(self) -> bool:
+        """Whether the body has HTML markup, sent as an alternative to the plain text."""
+        plain = self.plain
+        if self._has_html is None:
+            # plain text set by a subclass, not converted from the body
+            return len(plain) != len(self.body)
+        return self._has_html
+
     def get_from_(self) -> str:
         if self.drip_base.from_email_name:
             from_ = "{name} <{email}>".format(
@@ -194,52 +431,48 @@ class DripMessage(object):
         if not self._message:
             from_ = self.get_from_()
 
-            self._message = EmailMultiAlternatives(
+            self._message = DripEmail(
                 self.subject,
                 self.plain,
                 from_,
                 [self.user.email],
             )
+            self._message.skeleton = self.drip_base.get_message_skeleton(self._message.from_email)
 
-            # check if there are html tags in the rendered template
-            if len(self.plain) != len(self.body):
+            if self.has_html:
                 self._message.attach_alternative(self.body, "text/html")
         return self._message
 
+    def send(self, connection: Optional[BaseEmailBackend] = None) -> int:
+        """
+        Deliver the message and return the amount of sent messages.
+        When a connection is given, the message is delivered with its ``send_messages``,
+        so the connection is not opened and closed again for this message.
+        """
+        if connection is None:
+            return self.message.send()
+        return connection.send_messages([self.message]) or 0
+
     def _get_unsubscribe_link_drip(self) -> Optional[str]:
         """
         Generate url for Unsubscribe Drip with drip and user data and validates existence of this url in project.
         Checking if it was configured by the user.
         """
-        email_token = EmailToken(self.user)
-        drip_uidb64, uidb64, token = email_token.get_uidb64_token(self.drip_base.drip_model.pk)
-        url_args = {"drip_uidb64": drip_uidb64, "uidb64": uidb64, "token": token}
-        unsubscribe_link = validate_path_existence("unsubscribe_drip", url_args)
-        return unsubscribe_link
+        return self.get_unsubscribe_link("unsubscribe_link_drip")
 
     def _get_unsubscribe_link_campaign(self) -> Optional[str]:
         """
         Generate url for Unsubcribe Campaign with campaign and user data and validates existence of this url in project.
         Checking if it was configured by the user.
         """
-        if not self.drip_base.drip_model.campaign:
-            return None
-        email_token = EmailToken(self.user)
-        campaign_uidb64, uidb64, token = email_token.get_uidb64_token(self.drip_base.drip_model.campaign.pk)
-        url_args = {"campaign_uidb64": campaign_uidb64, "uidb64": uidb64, "token": token}
-        unsubscribe_link = validate_path_existence("unsubscribe_campaign", url_args)
-        return unsubscribe_link
+        return self.get_unsubscribe_link("unsubscribe_link_campaign")
 
     def _get_unsubscribe_link(self) -> Optional[str]:
         """
         Generate url for Unsubcribe to app with user data and validates existence of this url in project.
         Checking if it was configured by the user.
         """
-        email_token = EmailToken(self.user)
-        uidb64, token = email_token.get_uidb64_token_user_only()
-        url_args = {"uidb64": uidb64, "token": token}
-        unsubscribe_link = validate_path_existence("unsubscribe_app", url_args)
-        return unsubscribe_link
+        return self.get_unsubscribe_link("unsubscribe_link")
 
 
 class DripBase(object):
@@ -276,6 +509,116 @@ class DripBase(object):
             raise AttributeError("You must define a name.")
 
         self.now_shift_kwargs = kwargs.get("now_shift_kwargs", {})
+        self.rate_limiter: Optional[RateLimiter] = None
+        self.retry_policy: Optional[RetryPolicy] = None
+        self.run_id: str = uuid4().hex
+        self._templates: Dict[str, Template] = {}
+        self._segmented: Dict[str, SegmentedTemplate] = {}
+        self._static_renders: Dict[Tuple[str, Tuple[str, ...]], Optional[SafeString]] = {}
+        self._spliceable: Dict[Tuple[str, Tuple[str, ...]], bool] = {}
+        self._placeholder_prefix = "drip{hex}".format(hex=uuid4().hex)
+        self.render_memo = RenderMemo()
+        self._skeletons: Dict[str, MessageSkeleton] = {}
+        self._unsubscribe_links: Optional[UnsubscribeLinks] = None
+        self._local = threading.local()
+        self.shared_exclusions: Optional[SharedExclusions] = None
+        self._exclusion_sets: Optional[List[IdSet]] = None
+        self._pk_range: Optional[Tuple[Any, Any]] = None
+        # claims made before this time are stale too, set by ChunkLeaser on the chunks it leases again
+        self.claims_stale_before: Optional[datetime] = None
+        self._rules: Optional[List[QuerySetRule]] = None
+
+    #################
+    #   RENDERING   #
+    #################
+
+    def get_template(self, name: str, source: str) -> Template:
+        """
+        Returns the compiled template, parsed once per run. Drips stored in the database
+        also share compiled templates across runs, until the drip is changed.
+        """
+        template = self._templates.get(name)
+        if template is None:
+            key = None
+            if self.drip_model.pk is not None:
+                key = (self.drip_model.pk, self.drip_model.lastchanged, name)
+            template = template_cache.get(key, source)
+            self._templates[name] = template
+        return template
+
+    def get_subject_template(self) -> Template:
+        return self.get_template("subject", self.subject_template)
+
+    def get_body_template(self) -> Template:
+        return self.get_template("body", self.body_template)
+
+    def get_drip_template(self, name: str) -> Template:
+        if name == "subject":
+            return self.get_subject_template()
+        return self.get_body_template()
+
+    def get_segmented_template(self, name: str) -> SegmentedTemplate:
+        """Returns the "subject" or "body" template split in constant and per-user segments, once per run."""
+        segmented = self._segmented.get(name)
+        if segmented is None:
+            segmented = self._segmented[name] = SegmentedTemplate(self.get_drip_template(name))
+        return segmented
+
+    def render_static(
+        self,
+        name: str,
+        user_context_names: Tuple[str, ...],
+        render: Callable[[Template], SafeString],
+    ) -> Optional[SafeString]:
+        """
+        Renders the "subject" or "body" template once for the whole run, when none of its nodes
+        reads a per-user variable of ``user_context_names``. Returns None when it may depend on the user.
+        The template is rendered with ``render``, the one of the first message, so the variables
+        every message shares are still available.
+        """
+        key = (name, user_context_names)
+        if key not in self._static_renders:
+            template = self.get_drip_template(name)
+            rendered = None
+            if is_static_template(template, user_context_names):
+                rendered = render(template)
+            self._static_renders[key] = rendered
+        return self._static_renders[key]
+
+    def can_splice(self, name: str, spliced_names: Tuple[str, ...]) -> bool:
+        """Whether the "subject", "body" or "plain" text only prints the spliced variables as they are."""
+        template_name = "body" if name == "plain" else name
+        key = (template_name, spliced_names)
+        if key not in self._spliceable:
+            self._spliceable[key] = prints_names_as_is(self.get_drip_template(template_name), spliced_names)
+        return self._spliceable[key]
+
+    def get_placeholders(self, spliced_names: Tuple[str, ...]) -> Dict[str, str]:
+        """Placeholders rendered in place of the spliced variables, unique to this run."""
+        return {
+            name: "{prefix}s{index}x".format(prefix=self._placeholder_prefix, index=index)
+            for index, name in enumerate(spliced_names)
+        }
+
+    def get_unsubscribe_links(self) -> UnsubscribeLinks:
+        """Returns the builder of the unsubscribe links of this run, reversing their URLs once."""
+        if self._unsubscribe_links is None:
+            self._unsubscribe_links = UnsubscribeLinks(self.drip_model)
+        return self._unsubscribe_links
+
+    def get_message_skeleton(self, from_email: str) -> MessageSkeleton:
+        """Returns the MIME structure shared by the messages of this run sent from ``from_email``."""
+        skeleton = self._skeletons.get(from_email)
+        if skeleton is None:
+            skeleton = self._skeletons[from_email] = MessageSkeleton(from_email)
+        return skeleton
+
+    def get_shared_context(self) -> Context:
+        """Returns the context every message rendered in this thread pushes its variables on."""
+        context = getattr(self._local, "context", None)
+        if context is None:
+            context = self._local.context = Context()
+        return context
 
     #########################
     #   DATE MANIPULATION   #
@@ -306,6 +649,8 @@ class DripBase(object):
         :return: List of DripBase instances.
         :rtype: List[DripBase]
         """
+        # the shifted drips share the rules of the drip model, fetched once
+        prefetch_related_objects([self.drip_model], "queryset_rules")
         walked_range = []
         for shift in range(-into_past, into_future):
             kwargs: DripBaseParamsOptions = dict(
@@ -317,15 +662,28 @@ class DripBase(object):
         return walked_range
 
     def apply_queryset_rules(self, manager_qs: Union[BaseManager, QuerySet]) -> QuerySet:
-        """First collect all filter/exclude kwargs and apply any annotations.
-        Then apply all filters at once, and all excludes at once.
+        """Apply any annotations, then the AND and OR rules in a single WHERE clause:
+        users matching all the AND rules or any of the OR rules.
 
         :param manager_qs: Base queryset or manager to apply queryset rules
         :type manager_qs: Union[BaseManager, QuerySet]
         :return: Queryset with all (AND/OR) filters applied
         :rtype: QuerySet
         """
-        return self.apply_and_queryset_rules(manager_qs) | self.apply_or_queryset_rules(manager_qs)
+        return self.get_compiled_rules().apply(manager_qs, self.now)
+
+    def get_rules(self) -> List[QuerySetRule]:
+        """
+        Returns the queryset rules of the drip, fetched in a single query for the AND and OR rules.
+        Rules prefetched with ``prefetch_related("queryset_rules")`` are used without any query.
+        """
+        if self._rules is None:
+            self._rules = list(self.drip_model.queryset_rules.all())
+        return self._rules
+
+    def get_compiled_rules(self) -> CompiledRuleSet:
+        """Returns the compiled queryset rules, shared by every run until a rule of the drip is changed."""
+        return rules_cache.get(self.drip_model.pk, self.get_rules())
 
     def apply_or_queryset_rules(self, manager_qs: Union[BaseManager, QuerySet]) -> QuerySet:
         """First collect all filter kwargs. Then apply OR filters at once.
@@ -335,18 +693,7 @@ class DripBase(object):
         :return: Queryset with OR filters applied
         :rtype: QuerySet
         """
-        rules: List[Q] = []
-        rule_set = self.drip_model.queryset_rules.filter(rule_type="or")
-        for query_rule in rule_set:
-            kwargs = query_rule.filter_kwargs(now=self.now)
-            query_or = Q(**kwargs)
-            rules.append(query_or)
-
-        query: Q = rules.pop() if rules else Q()
-        for rule in rules:
-            query |= rule
-        qs = manager_qs.filter(query) if query != Q() else manager_qs.none()
-        return qs
+        return self.get_compiled_rules().apply_or(manager_qs, self.now)
 
     def apply_and_queryset_rules(self, manager_qs: Union[BaseManager, QuerySet]) -> QuerySet:
         """First collect all filter/exclude kwargs and apply any annotations.
@@ -357,44 +704,27 @@ class DripBase(object):
         :return: Queryset with AND filters applied
         :rtype: QuerySet
         """
-        clauses: Dict[str, List] = {
-            "filter": [],
-            "exclude": [],
-        }
-        rules = []
-        qs = manager_qs.all()
-        for rule in self.drip_model.queryset_rules.filter(rule_type="and"):
-            rules.append(rule)
-
-            clause = clauses.get(rule.method_type, clauses["filter"])
-
-            kwargs = rule.filter_kwargs(now=self.now)
-            clause.append(Q(**kwargs))
-
-            qs = rule.apply_any_annotation(qs)
-
-        if clauses["exclude"]:
-            qs = qs.exclude(functools.reduce(operator.or_, clauses["exclude"]))
-
-        qs = qs.filter(*clauses["filter"]) if len(rules) > 0 else qs.none()
-
-        return qs
+        return self.get_compiled_rules().apply_and(manager_qs, self.now)
 
     ##################
     #   MANAGEMENT   #
     ##################
 
     def get_queryset(self) -> QuerySet:
-        """Apply queryset rules or returns the existing queryset
+        """Apply queryset rules or returns the existing queryset.
+        Users are only made distinct when a rule crosses a relation to many objects,
+        or when the base ``queryset`` joins other tables or is distinct.
 
         :return: Queryset with all (AND/OR) filters applied
         :rtype: QuerySet
         """
         queryset = getattr(self, "_queryset", None)
         if queryset is None:
-            self._queryset = self.apply_queryset_rules(
-                self.queryset(),
-            ).distinct()
+            base_queryset = self.queryset().all()
+            queryset = self.apply_queryset_rules(base_queryset)
+            if self.get_compiled_rules().requires_distinct or may_repeat_rows(base_queryset):
+                queryset = queryset.distinct()
+            self._queryset = queryset
         return self._queryset
 
     def get_drip_unsubscribe_users_config(self) -> bool:
@@ -405,61 +735,327 @@ class DripBase(object):
         )
         return drip_unsubscribe_users_config
 
-    def run(self) -> Optional[int]:
+    def get_sent_drips_batch_size_config(self) -> Optional[int]:
+        """If DRIP_SENT_DRIPS_BATCH_SIZE is set, SentDrips are written in batches of that size."""
+        return getattr(settings, "DRIP_SENT_DRIPS_BATCH_SIZE", None)
+
+    def get_shared_connection_config(self) -> Optional[SharedConnection]:
+        """
+        If DRIP_SHARED_CONNECTION is set to True, returns a SharedConnection used to deliver every message.
+        DRIP_SHARED_CONNECTION_CHUNK_SIZE sets how many messages are delivered before reopening it.
+        """
+        if not getattr(settings, "DRIP_SHARED_CONNECTION", False):
+            return None
+        return SharedConnection(chunk_size=self.get_shared_connection_chunk_size_config())
+
+    def get_shared_connection_chunk_size_config(self) -> Optional[int]:
+        return getattr(settings, "DRIP_SHARED_CONNECTION_CHUNK_SIZE", None)
+
+    def get_send_workers_config(self) -> int:
+        """Amount of threads rendering and delivering messages, set with DRIP_SEND_WORKERS."""
+        return getattr(settings, "DRIP_SEND_WORKERS", 1)
+
+    def get_audience_chunk_size_config(self) -> int:
+        """Amount of users fetched at once while sending, set with DRIP_AUDIENCE_CHUNK_SIZE."""
+        return getattr(settings, "DRIP_AUDIENCE_CHUNK_SIZE", 2000)
+
+    def get_claim_sends_config(self) -> bool:
+        """
+        If DRIP_CLAIM_SENDS is set to True (the default), users of drips that can not be resent
+        are claimed before delivering them the drip, so concurrent runs skip each other's users.
+        """
+        return getattr(settings, "DRIP_CLAIM_SENDS", True)
+
+    def get_claim_ttl_config(self) -> float:
+        """
+        Seconds after which the claim of a user that was not delivered the drip is stale,
+        and can be taken over by another run, set with DRIP_CLAIM_TTL.
+        """
+        return getattr(settings, "DRIP_CLAIM_TTL", 3600)
+
+    def get_claim_batch_size_config(self) -> int:
+        """Amount of users claimed at once, right before delivering them, set with DRIP_CLAIM_BATCH_SIZE."""
+        return getattr(settings, "DRIP_CLAIM_BATCH_SIZE", 100)
+
+    def get_in_memory_exclusions_config(self) -> bool:
+        """
+        If DRIP_IN_MEMORY_EXCLUSIONS is set to True, sent and unsubscribed users are loaded in compact
+        sets once per run and filtered out of the streamed audience, instead of being pruned by the database.
+        """
+        return getattr(settings, "DRIP_IN_MEMORY_EXCLUSIONS", False)
+
+    def requires_claims(self) -> bool:
+        return self.get_claim_sends_config() and not self.drip_model.can_resend_drip
+
+    # Ignoring this line because mypy says User is not a valid type
+    def claim_users(self, users: List[User]) -> List[User]:  # type: ignore
+        """
+        Inserts a claim for every user, ignoring the users already claimed by this or another run
+        unless their claim is stale, and returns the users claimed by this run.
+        """
+        DripClaim.objects.bulk_create(
+            [DripClaim(drip=self.drip_model, user=user, run_id=self.run_id) for user in users],
+            ignore_conflicts=True,
+        )
+        claimed_ids = self.get_claimed_ids(users)
+        if len(claimed_ids) < len(users):
+            self.take_over_stale_claims([user.pk for user in users if user.pk not in claimed_ids])
+            claimed_ids = self.get_claimed_ids(users)
+        return [user for user in users if user.pk in claimed_ids]
+
+    # Ignoring this line because mypy says User is not a valid type
+    def get_claimed_ids(self, users: List[User]) -> Set[Any]:  # type: ignore
+        return set(
+            DripClaim.objects.filter(drip=self.drip_model, run_id=self.run_id, user__in=users).values_list(
+                "user_id", flat=True
+            )
+        )
+
+    def take_over_stale_claims(self, user_ids: List[Any]) -> int:
+        """
+        Moves to this run the stale claims of the users: the ones older than DRIP_CLAIM_TTL, or made before
+        ``claims_stale_before``, of users with neither a SentDrip, which messages in the outbox also have,
+        nor a pending retry. The runs that made them died before delivering the drip.
+        Only one run can take over each claim, its time is reset when it is taken over.
+        """
+        now = conditional_now()
+        stale_before = now - timedelta(seconds=self.get_claim_ttl_config())
+        if self.claims_stale_before is not None:
+            stale_before = max(stale_before, self.claims_stale_before)
+        delivered = SentDrip.objects.filter(drip=OuterRef("drip_id"), user=OuterRef("user_id"))
+        retried = DripRetry.objects.filter(drip=OuterRef("drip_id"), user=OuterRef("user_id"), status=RETRY_PENDING)
+        return (
+            DripClaim.objects.filter(drip=self.drip_model, user_id__in=user_ids, created_date__lt=stale_before)
+            .filter(~Exists(delivered), ~Exists(retried))
+            .update(run_id=self.run_id, created_date=now)
+        )
+
+    # Ignoring this line because mypy says User is not a valid type
+    def release_claim(self, user: User) -> None:  # type: ignore
+        """Drops the claim of a user that was not delivered the drip, so a later run can try again."""
+        if self.requires_claims():
+            DripClaim.objects.filter(drip=self.drip_model, user=user, run_id=self.run_id).delete()
+
+    def iterate_audience_chunks(self) -> Iterator[List[User]]:  # type: ignore
+        """
+        Streams the users of the queryset in primary key chunks, so memory does not grow
+        with the size of the audience. When claims are required, users are claimed in batches
+        of DRIP_CLAIM_BATCH_SIZE as they are consumed, and users claimed by other runs are left out.
+        """
+        for users in queryset_chunks(self.get_queryset(), self.get_audience_chunk_size_config()):
+            users = self.filter_excluded(users)
+            if not self.requires_claims():
+                if users:
+                    yield users
+                continue
+            batch_size = self.get_claim_batch_size_config()
+            for start in range(0, len(users), batch_size):
+                claimed = self.claim_users(users[start : start + batch_size])
+                if claimed:
+                    yield claimed
+
+    def iterate_audience(self) -> Iterator[User]:  # type: ignore
+        for users in self.iterate_audience_chunks():
+            yield from users
+
+    async def aiterate_audience(self) -> AsyncIterator[User]:  # type: ignore
+        """Asynchronous version of ``iterate_audience``."""
+        if self.requires_claims():
+            audience = aiter_chunks(self.iterate_audience_chunks())
+        else:
+            queryset = await sync_to_async(self.get_queryset)()
+            audience = aiter_queryset(queryset, self.get_audience_chunk_size_config())
+        exclusion_sets = await sync_to_async(self.get_exclusion_sets)()
+        async for user in audience:
+            if not any(user.pk in exclusion_set for exclusion_set in exclusion_sets):
+                yield user
+
+    def limit_to_pk_range(self, first_pk: Any, last_pk: Any) -> None:
+        """Restricts the audience to the users with a primary key between first_pk and last_pk, both included."""
+        self._queryset = self.get_queryset().filter(pk__gte=first_pk, pk__lte=last_pk)
+        self._pk_range = (first_pk, last_pk)
+
+    def get_pk_ranges(self, chunk_size: int) -> List[Tuple[Any, Any]]:
+        """
+        Splits the audience in ranges of up to ``chunk_size`` users,
+        returned as (first_pk, last_pk) tuples in primary key order.
+        """
+        pk_ranges: List[Tuple[Any, Any]] = []
+        pks = self.get_queryset().order_by("pk").values_list("pk", flat=True)
+        first_pk = last_pk = None
+        amount = 0
+        for pk in pks.iterator(chunk_size=self.get_audience_chunk_size_config()):
+            if amount == 0:
+                first_pk = pk
+            last_pk = pk
+            amount += 1
+            if amount == chunk_size:
+                pk_ranges.append((first_pk, last_pk))
+                amount = 0
+        if amount:
+            pk_ranges.append((first_pk, last_pk))
+        return pk_ranges
+
+    def get_outbox_config(self) -> bool:
+        """If DRIP_OUTBOX_SETTINGS enables the outbox, messages are rendered into it instead of being delivered."""
+        return get_outbox_settings().get("ENABLED", False)
+
+    def get_async_max_in_flight_config(self) -> int:
+        """Maximum amount of messages in flight when sending asynchronously, set with DRIP_ASYNC_MAX_IN_FLIGHT."""
+        return getattr(settings, "DRIP_ASYNC_MAX_IN_FLIGHT", 100)
+
+    def get_delivery(self, workers: Optional[int] = None) -> Delivery:
+        """
+        Returns the Delivery used to render and send the messages.
+        With more than one worker, messages are delivered on a thread pool.
+        """
+        workers = workers or self.get_send_workers_config()
+        if workers > 1:
+            return ThreadedDelivery(
+                workers,
+                chunk_size=self.get_shared_connection_chunk_size_config(),
+                rate_limiter=self.rate_limiter,
+            )
+        return Delivery(shared_connection=self.get_shared_connection_config(), rate_limiter=self.rate_limiter)
+
+    def run(self, workers: Optional[int] = None) -> Optional[int]:
         """Get the queryset, prune sent people, and send it.
 
+        :param workers: Amount of threads delivering messages, defaults to DRIP_SEND_WORKERS
+        :type workers: Optional[int]
         :return: Returns count of created SentDrips.
         :rtype: Optional[int]
         """
         if not self.drip_model.enabled:
             return None
 
-        self.prune()
-        count = self.send()
+        self.prune_for_send()
+        count = self.send(workers=workers)
 
         return count
 
+    async def arun(self, max_in_flight: Optional[int] = None) -> Optional[int]:
+        """Asynchronous version of ``run``.
+
+        :param max_in_flight: Maximum amount of messages in flight, defaults to DRIP_ASYNC_MAX_IN_FLIGHT
+        :type max_in_flight: Optional[int]
+        :return: Returns count of created SentDrips.
+        :rtype: Optional[int]
+        """
+        if not self.drip_model.enabled:
+            return None
+
+        await sync_to_async(self.prune_for_send)()
+        count = await self.asend(max_in_flight=max_in_flight)
+
+        return count
+
+    def unsubscribed_users_drip_exclusion(self) -> Optional[Exists]:
+        """If DRIP_UNSUBSCRIBE_USERS is set to True, matches the users unsubscribed from the Drip."""
+        if not self.get_drip_unsubscribe_users_config():
+            return None
+        return Exists(UserUnsubscribeDrip.objects.filter(drip=self.drip_model, user=OuterRef("pk")))
+
+    def unsubscribed_users_campaign_exclusion(self) -> Optional[Exists]:
+        """If DRIP_UNSUBSCRIBE_USERS is set to True, matches the users unsubscribed from the Campaign of the Drip."""
+        if not (self.get_drip_unsubscribe_users_config() and self.drip_model.campaign_id):
+            return None
+        return Exists(
+            UserUnsubscribeCampaign.objects.filter(campaign_id=self.drip_model.campaign_id, user=OuterRef("pk"))
+        )
+
+    def unsubscribed_users_general_exclusion(self) -> Optional[Exists]:
+        """If DRIP_UNSUBSCRIBE_USERS is set to True, matches the users unsubscribed from all emails."""
+        if not self.get_drip_unsubscribe_users_config():
+            return None
+        return Exists(UserUnsubscribe.objects.filter(user=OuterRef("pk")))
+
+    def sent_drips_exclusion(self) -> Optional[Exists]:
+        """If the Drip can not be resent, matches the users who have a SentDrip already."""
+        if self.drip_model.can_resend_drip:
+            return None
+        return Exists(
+            SentDrip.objects.filter(
+                date__lt=conditional_now(),
+                drip=self.drip_model,
+                user=OuterRef("pk"),
+            )
+        )
+
+    def pending_retries_exclusion(self) -> Exists:
+        """Matches the users whose message of this Drip failed and is waiting to be delivered again."""
+        return Exists(DripRetry.objects.filter(drip=self.drip_model, status=RETRY_PENDING, user=OuterRef("pk")))
+
+    def load_exclusion_sets(self) -> List[IdSet]:
+        """
+        Loads the ids of the users who have a SentDrip already and, if configured, of the unsubscribed users.
+        The users unsubscribed from all emails are loaded once by the ``shared_exclusions`` of the run, when set.
+        """
+        chunk_size = self.get_audience_chunk_size_config()
+        exclusion_sets = []
+        if not self.drip_model.can_resend_drip:
+            sent_drips = SentDrip.objects.filter(date__lt=conditional_now(), drip=self.drip_model)
+            exclusion_sets.append(load_id_set(sent_drips, chunk_size=chunk_size, pk_range=self._pk_range))
+        if self.get_drip_unsubscribe_users_config():
+            unsubscribed = [UserUnsubscribeDrip.objects.filter(drip=self.drip_model)]
+            if self.drip_model.campaign_id:
+                unsubscribed.append(UserUnsubscribeCampaign.objects.filter(campaign_id=self.drip_model.campaign_id))
+            exclusion_sets.append(load_id_set(*unsubscribed, chunk_size=chunk_size, pk_range=self._pk_range))
+            if self.shared_exclusions is not None:
+                exclusion_sets.append(self.shared_exclusions.get_unsubscribed_users())
+            else:
+                exclusion_sets.append(
+                    load_id_set(UserUnsubscribe.objects.all(), chunk_size=chunk_size, pk_range=self._pk_range)
+                )
+        return [exclusion_set for exclusion_set in exclusion_sets if len(exclusion_set)]
+
+    def get_exclusion_sets(self) -> List[IdSet]:
+        """Compact sets of the ids of the users filtered out of the audience, loaded once per run."""
+        if not self.uses_in_memory_exclusions():
+            return []
+        if self._exclusion_sets is None:
+            self._exclusion_sets = self.load_exclusion_sets()
+        return self._exclusion_sets
+
+    # Ignoring this line because mypy says User is not a valid type
+    def filter_excluded(self, users: List[User]) -> List[User]:  # type: ignore
+        """Removes the users found in the exclusion sets."""
+        exclusion_sets = self.get_exclusion_sets()
+        if not exclusion_sets:
+            return users
+        return [user for user in users if not any(user.pk in exclusion_set for exclusion_set in exclusion_sets)]
+
+    def exclude(self, *exclusions: Optional[Exists]) -> None:
+        """Removes the users matched by any of the exclusions from the queryset, with NOT EXISTS anti-joins."""
+        anti_joins = [~exclusion for exclusion in exclusions if exclusion is not None]
+        if anti_joins:
+            self._queryset = self.get_queryset().filter(*anti_joins)
+
     def exclude_unsubcribed_users_drip(self) -> None:
-        """If DRIP_UNSUBSCRIBE_USERS is set to True, get a list of unsubscribed users ids to Drip model."""
-        unsubscribed_ids: Union[QuerySet, List] = []
-        unsubscribe_users = self.get_drip_unsubscribe_users_config()
-        if unsubscribe_users:
-            # Unsubscribed users on Drip
-            unsubscribed_ids = self.drip_model.unsubscribed_users.all().values_list("id", flat=True)
-        self._queryset = self.get_queryset().exclude(id__in=unsubscribed_ids)
+        """If DRIP_UNSUBSCRIBE_USERS is set to True, excludes the users unsubscribed from the Drip."""
+        self.exclude(self.unsubscribed_users_drip_exclusion())
 
     def exclude_unsubcribed_users_campaign(self) -> None:
-        """If DRIP_UNSUBSCRIBE_USERS is set to True, get a list of unsubscribed users ids to Campaign model."""
-        unsubscribed_ids: Union[QuerySet, List] = []
-        unsubscribe_users = self.get_drip_unsubscribe_users_config()
-        campaign = self.drip_model.campaign
-        if unsubscribe_users and campaign:
-            # Unsubscribed users on Campaign
-            unsubscribed_ids = campaign.unsubscribed_users.all().values_list("id", flat=True)
-        self._queryset = self.get_queryset().exclude(id__in=unsubscribed_ids)
+        """If DRIP_UNSUBSCRIBE_USERS is set to True, excludes the users unsubscribed from the Campaign."""
+        self.exclude(self.unsubscribed_users_campaign_exclusion())
 
     def exclude_unsubcribed_users_general(self) -> None:
-        """If DRIP_UNSUBSCRIBE_USERS is set to True, get a list of unsubscribed users ids to app (all emails)."""
-        unsubscribed_ids: Union[QuerySet, List] = []
-        unsubscribe_users = self.get_drip_unsubscribe_users_config()
-        if unsubscribe_users:
-            # Unsubscribed users on Drip
-            unsubscribed_ids = UserUnsubscribe.objects.all().values_list("user__id", flat=True)
-        self._queryset = self.get_queryset().exclude(id__in=unsubscribed_ids)
+        """If DRIP_UNSUBSCRIBE_USERS is set to True, excludes the users unsubscribed from all emails."""
+        self.exclude(self.unsubscribed_users_general_exclusion())
 
     def exclude_sent_drips_users(self) -> None:
-        """If configured in can_resend_drip changes queryset excluding Users ids who have a SentDrip already."""
-        if not self.drip_model.can_resend_drip:
-            target_user_ids = self.get_queryset().values_list("id", flat=True)
-            exclude_user_ids = SentDrip.objects.filter(
-                date__lt=conditional_now(),
-                drip=self.drip_model,
-                user__id__in=target_user_ids,
-            ).values_list("user_id", flat=True)
-            self._queryset = self.get_queryset().exclude(id__in=exclude_user_ids)
+        """If configured in can_resend_drip changes queryset excluding Users who have a SentDrip already."""
+        self.exclude(self.sent_drips_exclusion())
+
+    def exclude_pending_retries_users(self) -> None:
+        """Excludes Users whose message of this Drip failed and is waiting to be delivered again."""
+        self.exclude(self.pending_retries_exclusion())
 
     def prune(self) -> None:
-        """Do an exclude for all Users who have a SentDrip already and if configured the unsubscribed users."""
+        """
+        Excludes all Users who have a SentDrip already or a pending retry, and if configured the unsubscribed users.
+        Every exclusion is a NOT EXISTS anti-join of the same WHERE clause, so the audience query is not nested again.
+        """
         self.get_queryset()
         # sent drips exclude
         self.exclude_sent_drips_users()
@@ -469,39 +1065,157 @@ class DripBase(object):
         self.exclude_unsubcribed_users_campaign()
         # unsubscribed users exclude from all emails
         self.exclude_unsubcribed_users_general()
+        # pending retries exclude
+        self.exclude_pending_retries_users()
+
+    def prune_for_send(self) -> None:
+        """
+        Prunes the audience right before sending it. With DRIP_IN_MEMORY_EXCLUSIONS, only the users with a pending
+        retry are excluded by the database, the sent and unsubscribed users are filtered out of the streamed
+        audience by the exclusion sets, see ``get_exclusion_sets``.
+        """
+        if self.uses_in_memory_exclusions():
+            self.exclude_pending_retries_users()
+        else:
+            self.prune()
+
+    def uses_in_memory_exclusions(self) -> bool:
+        """
+        Whether DRIP_IN_MEMORY_EXCLUSIONS is set to True and no subclass overrides the hooks excluding
+        the sent and unsubscribed users, which are then applied by the database.
+        """
+        if not self.get_in_memory_exclusions_config():
+            return False
+        cls = type(self)
+        return all(getattr(cls, hook) is getattr(DripBase, hook) for hook in IN_MEMORY_EXCLUSION_HOOKS)
 
-    def get_count_from_queryset(self, message_class) -> int:
+    # Ignoring this line because mypy says User is not a valid type
+    def build_sent_drip(self, user: User, message_instance: DripMessage) -> SentDrip:  # type: ignore
+        """Returns an unsaved SentDrip recording the message delivered to the user."""
+        return SentDrip(
+            drip=self.drip_model,
+            user=user,
+            from_email=self.from_email,
+            from_email_name=self.from_email_name,
+            subject=message_instance.subject,
+            body=message_instance.body,
+        )
+
+    def report_rate_limit_wait(self) -> None:
+        """Logs the seconds the run spent waiting for the rate limiter."""
+        if self.rate_limiter:
+            logging.info(
+                "Drip {drip} waited {seconds:.3f} seconds for the rate limiter".format(
+                    drip=self.drip_model.id,
+                    seconds=self.rate_limiter.waited,
+                )
+            )
+
+    # Ignoring this line because mypy says User is not a valid type
+    def log_failed_send(self, user: User, error: Exception) -> None:  # type: ignore
+        logging.error(
+            "Failed to send drip {drip} to user {user}: {err}".format(
+                drip=self.drip_model.id,
+                user=str(user),
+                err=str(error),
+            )
+        )
+
+    def schedule_retry(self, message_instance: DripMessage, error: Exception) -> bool:
+        """
+        If DRIP_RETRY_SETTINGS enables retries, stores the rendered message to be delivered again later.
+        Messages that failed to render are not stored, as rendering them again would fail too.
+        Returns whether the retry was stored.
+        """
+        if self.retry_policy is None or message_instance._message is None:
+            return False
+        try:
+            self.retry_policy.schedule(message_instance, error)
+        except Exception as e:
+            logging.error(
+                "Failed to schedule a retry of drip {drip} to user {user}: {err}".format(
+                    drip=self.drip_model.id,
+                    user=str(message_instance.user),
+                    err=str(e),
+                )
+            )
+            return False
+        return True
+
+    def handle_failed_send(self, message_instance: DripMessage, error: Exception) -> None:
+        """Logs a message that failed to be delivered, and stores it for a retry or releases its claim."""
+        self.log_failed_send(message_instance.user, error)
+        if not self.schedule_retry(message_instance, error):
+            self.release_claim(message_instance.user)
+
+    def record_sent_drip(self, writer: SentDripWriter, message_instance: DripMessage, result: int) -> None:
+        """Adds a SentDrip to the writer when the message was delivered."""
+        try:
+            if result:
+                writer.add(self.build_sent_drip(message_instance.user, message_instance))
+        except Exception as e:
+            self.log_failed_send(message_instance.user, e)
+
+    def get_count_from_queryset(self, message_class, workers: Optional[int] = None) -> int:
         """
         Given a Message Class instance (by default drip.drips.DripMessage),
         returns the amount of sent Drips.
         """
         # TODO: try to reduce the side-effects of this method.
-        count = 0
-        for user in self.get_queryset():
+        writer = SentDripWriter(batch_size=self.get_sent_drips_batch_size_config(), on_error=self.log_failed_send)
+        self.rate_limiter = RateLimiter.from_settings()
+        self.retry_policy = RetryPolicy.from_settings()
+        delivery = self.get_delivery(workers)
+        message_instances = (message_class(self, user) for user in self.iterate_audience())
+        for message_instance, result, error in delivery.deliver(message_instances):
+            if error is not None:
+                self.handle_failed_send(message_instance, error)
+                continue
+            self.record_sent_drip(writer, message_instance, result)
+        writer.flush()
+        self.report_rate_limit_wait()
+        return writer.count
+
+    def enqueue_from_queryset(self, message_class) -> int:
+        """
+        Renders the message of every user into the outbox, reserving its SentDrip in the same transaction.
+        Returns the amount of reserved SentDrips, messages are delivered later by draining the outbox.
+        """
+        writer = OutboxWriter(batch_size=get_outbox_settings().get("BATCH_SIZE", 500))
+        for user in self.iterate_audience():
             message_instance = message_class(self, user)
             try:
-                result = message_instance.message.send()
-                if result:
-                    SentDrip.objects.create(
-                        drip=self.drip_model,
-                        user=user,
-                        from_email=self.from_email,
-                        from_email_name=self.from_email_name,
-                        subject=message_instance.subject,
-                        body=message_instance.body,
-                    )
-                    count += 1
+                sent_drip = self.build_sent_drip(user, message_instance)
+                plain = message_instance.plain
             except Exception as e:
-                logging.error(
-                    "Failed to send drip {drip} to user {user}: {err}".format(
-                        drip=self.drip_model.id,
-                        user=str(user),
-                        err=str(e),
-                    )
-                )
-        return count
-
-    def send(self) -> int:
+                self.log_failed_send(user, e)
+                self.release_claim(user)
+                continue
+            writer.add(sent_drip, plain)
+        writer.flush()
+        return writer.count
+
+    async def aget_count_from_queryset(self, message_class, max_in_flight: Optional[int] = None) -> int:
+        """
+        Asynchronous version of ``get_count_from_queryset``.
+        The audience is streamed and messages are delivered through an AsyncDelivery.
+        """
+        writer = SentDripWriter(batch_size=self.get_sent_drips_batch_size_config(), on_error=self.log_failed_send)
+        self.rate_limiter = RateLimiter.from_settings()
+        self.retry_policy = RetryPolicy.from_settings()
+        delivery = AsyncDelivery(max_in_flight or self.get_async_max_in_flight_config(), rate_limiter=self.rate_limiter)
+        message_instances = (message_class(self, user) async for user in self.aiterate_audience())
+
+        async for message_instance, result, error in delivery.deliver(message_instances):
+            if error is not None:
+                await sync_to_async(self.handle_failed_send)(message_instance, error)
+                continue
+            await sync_to_async(self.record_sent_drip)(writer, message_instance, result)
+        await sync_to_async(writer.flush)()
+        self.report_rate_limit_wait()
+        return writer.count
+
+    def send(self, workers: Optional[int] = None) -> int:
         """
         Send the message to each user on the queryset.
 
@@ -517,8 +1231,34 @@ class DripBase(object):
                 settings.DEFAULT_FROM_EMAIL,
             )
         MessageClass = message_class_for(self.drip_model.message_class)
+        # every run claims users with its own id, and loads its own exclusion sets
+        self.run_id = uuid4().hex
+        self._exclusion_sets = None
+
+        if self.get_outbox_config():
+            return self.enqueue_from_queryset(MessageClass)
+        return self.get_count_from_queryset(MessageClass, workers=workers)
+
+    async def asend(self, max_in_flight: Optional[int] = None) -> int:
+        """
+        Asynchronous version of ``send``.
+
+        Returns count of created SentDrips.
+        """
+        if not self.from_email:
+            self.from_email = getattr(
+                settings,
+                "DRIP_FROM_EMAIL",
+                settings.DEFAULT_FROM_EMAIL,
+            )
+        MessageClass = message_class_for(self.drip_model.message_class)
+        # every run claims users with its own id, and loads its own exclusion sets
+        self.run_id = uuid4().hex
+        self._exclusion_sets = None
 
-        return self.get_count_from_queryset(MessageClass)
+        if self.get_outbox_config():
+            return await sync_to_async(self.enqueue_from_queryset)(MessageClass)
+        return await self.aget_count_from_queryset(MessageClass, max_in_flight=max_in_flight)
 
     ####################
     #   USER DEFINED   #
@@ -0,0 +1,111 @@
+import heapq
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Any, Iterable, Iterator, Optional, Sequence, Tuple, Union
+
+from django.db import models
+from django.db.models.query import QuerySet
+
+from drip.models import UserUnsubscribe
+from drip.utils import get_user_model
+
+
+class SortedIdSet(object):
+    """
+    Set of user ids stored in a sorted sequence, looked up with a binary search.
+    Integer ids are stored in an ``array``, using 8 bytes per id instead of a Python object each.
+    """
+
+    def __init__(self, ids: Sequence[Any]):
+        self.ids = ids
+
+    def __contains__(self, pk: Any) -> bool:
+        index = bisect_left(self.ids, pk)
+        return index < len(self.ids) and self.ids[index] == pk
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class IdBitmap(object):
+    """Set of integer user ids stored as one bit per id between the lowest and the highest one."""
+
+    def __init__(self, ids: Sequence[int]):
+        self.offset = ids[0]
+        self.length = len(ids)
+        self.bits = bytearray((ids[-1] - self.offset) // 8 + 1)
+        for pk in ids:
+            position = pk - self.offset
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, pk: Any) -> bool:
+        if not isinstance(pk, int):
+            return False
+        position = pk - self.offset
+        return 0 <= position < len(self.bits) * 8 and bool(self.bits[position >> 3] >> (position & 7) & 1)
+
+    def __len__(self) -> int:
+        return self.length
+
+
+IdSet = Union[SortedIdSet, IdBitmap]
+
+
+def build_int_id_set(*sorted_ids: Iterable[int]) -> IdSet:
+    """
+    Builds the set of the union of several sorted streams of integer ids, without holding them as Python objects.
+    The set is a bitmap when the ids are dense enough for it to be smaller than the sorted array.
+    """
+    ids = array("q")
+    previous = None
+    is_sorted = True
+    for pk in heapq.merge(*sorted_ids):
+        if pk == previous:
+            continue
+        if previous is not None and pk < previous:
+            is_sorted = False
+        ids.append(pk)
+        previous = pk
+    if not is_sorted:
+        ids = array("q", sorted(set(ids)))
+    if ids and (ids[-1] - ids[0]) // 8 + 1 < ids.itemsize * len(ids):
+        return IdBitmap(ids)
+    return SortedIdSet(ids)
+
+
+def build_id_set(*sorted_ids: Iterable[Any]) -> IdSet:
+    """Builds the set of the union of several streams of user ids, sorted by the database."""
+    if isinstance(get_user_model()._meta.pk, models.IntegerField):
+        return build_int_id_set(*sorted_ids)
+    return SortedIdSet(sorted(set(pk for ids in sorted_ids for pk in ids)))
+
+
+def iterate_user_ids(queryset: QuerySet, chunk_size: int, pk_range: Optional[Tuple[Any, Any]] = None) -> Iterator[Any]:
+    """Streams the sorted ``user_id`` column of the queryset, restricted to the users of ``pk_range`` when given."""
+    if pk_range is not None:
+        queryset = queryset.filter(user_id__gte=pk_range[0], user_id__lte=pk_range[1])
+    return queryset.order_by("user_id").values_list("user_id", flat=True).iterator(chunk_size=chunk_size)
+
+
+def load_id_set(*querysets: QuerySet, chunk_size: int = 2000, pk_range: Optional[Tuple[Any, Any]] = None) -> IdSet:
+    """Loads the ids of the users of the rows of the querysets in a compact set."""
+    return build_id_set(*[iterate_user_ids(queryset, chunk_size, pk_range) for queryset in querysets])
+
+
+class SharedExclusions(object):
+    """
+    Exclusion sets shared by every drip of a ``send_drips`` invocation, loaded by the first drip that needs them:
+    the users unsubscribed from all emails do not depend on the drip.
+    """
+
+    def __init__(self, chunk_size: int = 2000):
+        self.chunk_size = chunk_size
+        self._unsubscribed_users: Optional[IdSet] = None
+        self._lock = threading.Lock()
+
+    def get_unsubscribed_users(self) -> IdSet:
+        with self._lock:
+            if self._unsubscribed_users is None:
+                self._unsubscribed_users = load_id_set(UserUnsubscribe.objects.all(), chunk_size=self.chunk_size)
+            return self._unsubscribed_users
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from drip.outbox import drain_outbox
+
+
+class Command(BaseCommand):
+    help = "Deliver the rendered drip messages waiting in the outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=None,
+            help="Maximum amount of messages delivered in this run.",
+        )
+
+    def handle(self, *args, **options):
+        count = drain_outbox(limit=options["limit"])
+        self.stdout.write("Outbox: {count} sent".format(count=count))
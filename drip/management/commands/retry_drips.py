@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from drip.retries import retry_drips
+
+
+class Command(BaseCommand):
+    help = "Deliver again the drip messages that failed and are due for a retry."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=None,
+            help="Maximum amount of retries delivered in this run.",
+        )
+
+    def handle(self, *args, **options):
+        count = retry_drips(limit=options["limit"])
+        self.stdout.write("Retried: {count} sent".format(count=count))
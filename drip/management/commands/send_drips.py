@@ -1,9 +1,98 @@
-from django.core.management.base import BaseCommand
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Dict, List, Optional
 
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from drip.chunks import ChunkLeaser
+from drip.exclusions import SharedExclusions
 from drip.models import Drip
+from drip.processes import init_drip_process, run_drip
 
 
 class Command(BaseCommand):
+    help = "Send all the enabled drips."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Amount of threads rendering and delivering messages for each drip, defaults to DRIP_SEND_WORKERS.",
+        )
+        parser.add_argument(
+            "--async",
+            action="store_true",
+            dest="use_async",
+            help="Deliver messages with asyncio, keeping up to DRIP_ASYNC_MAX_IN_FLIGHT messages in flight.",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=None,
+            help="Spread the enabled drips across a pool of processes.",
+        )
+        parser.add_argument(
+            "--chunked",
+            action="store_true",
+            help="Split the drips in chunks leased from the database, so several nodes can send at once.",
+        )
+
     def handle(self, *args, **options):
-        for drip in Drip.objects.filter(enabled=True):
-            drip.drip.run()
+        if options["chunked"]:
+            if options["processes"] or options["use_async"]:
+                raise CommandError("--chunked can not be combined with --processes or --async")
+            self.handle_chunked(options["workers"])
+            return
+        if options["processes"]:
+            self.handle_processes(options["processes"], options["workers"], options["use_async"])
+            return
+        # users unsubscribed from all emails are loaded once for every drip
+        shared_exclusions = SharedExclusions()
+        for drip in Drip.objects.filter(enabled=True).prefetch_related("queryset_rules"):
+            drip_base = drip.drip
+            drip_base.shared_exclusions = shared_exclusions
+            if options["use_async"]:
+                async_to_sync(drip_base.arun)()
+            else:
+                drip_base.run(workers=options["workers"])
+
+    def handle_chunked(self, workers: Optional[int]) -> None:
+        """Plans the chunks of the enabled drips, unless another node did, and sends chunks until none is left."""
+        leaser = ChunkLeaser.from_settings()
+        planned = leaser.plan()
+        count = leaser.work(workers=workers)
+        self.stdout.write("Chunks: {planned} planned, {count} sent".format(planned=planned, count=count))
+
+    def get_executor(self, processes: int) -> Executor:
+        return ProcessPoolExecutor(max_workers=processes, initializer=init_drip_process)
+
+    def handle_processes(self, processes: int, workers: Optional[int], use_async: bool) -> None:
+        """
+        Runs every enabled drip in a pool of processes, printing the result of each one and the total.
+        Raises CommandError, so the command exits with a nonzero status, when any drip crashed.
+        """
+        drips: Dict[int, str] = dict(Drip.objects.filter(enabled=True).values_list("id", "name"))
+        # Child processes must open their own database connections.
+        connections.close_all()
+
+        total = 0
+        failed: List[int] = []
+        with self.get_executor(processes) as executor:
+            futures = {drip_id: executor.submit(run_drip, drip_id, workers, use_async) for drip_id in drips}
+            for drip_id, future in futures.items():
+                try:
+                    count = future.result() or 0
+                except Exception as e:
+                    failed.append(drip_id)
+                    self.stderr.write("Drip {name} ({id}) failed: {err}".format(name=drips[drip_id], id=drip_id, err=e))
+                    continue
+                total += count
+                self.stdout.write(
+                    "Drip {name} ({id}): {count} sent".format(name=drips[drip_id], id=drip_id, count=count)
+                )
+
+        self.stdout.write("Total: {total} sent".format(total=total))
+        if failed:
+            raise CommandError("{amount} drips failed".format(amount=len(failed)))
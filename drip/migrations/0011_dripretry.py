@@ -0,0 +1,38 @@
+# Generated by Django 3.2.15 on 2026-10-17 23:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('drip', '0010_userunsubscribe'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DripRetry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('lastchanged', models.DateTimeField(auto_now=True)),
+                ('subject', models.TextField()),
+                ('body', models.TextField()),
+                ('plain', models.TextField()),
+                ('from_email', models.CharField(default=None, max_length=255, null=True)),
+                ('from_email_name', models.CharField(default=None, max_length=150, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(db_index=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('dead', 'Dead')], default='pending', max_length=12)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('drip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='retries', to='drip.drip')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='drip_retries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'drip retries',
+            },
+        ),
+    ]
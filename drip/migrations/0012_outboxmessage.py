@@ -0,0 +1,28 @@
+# Generated by Django 3.2.15 on 2026-10-17 23:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drip', '0011_dripretry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('plain', models.TextField()),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(db_index=True)),
+                ('lease_id', models.CharField(blank=True, default='', max_length=32)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('dead', 'Dead')], default='pending', max_length=12)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('sent_drip', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='outbox_message', to='drip.sentdrip')),
+            ],
+        ),
+    ]
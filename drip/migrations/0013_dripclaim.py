@@ -0,0 +1,30 @@
+# Generated by Django 3.2.15 on 2026-10-17 23:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('drip', '0012_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DripClaim',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('run_id', models.CharField(max_length=32)),
+                ('drip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='claims', to='drip.drip')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='drip_claims', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dripclaim',
+            constraint=models.UniqueConstraint(fields=('drip', 'user'), name='unique_drip_claim'),
+        ),
+    ]
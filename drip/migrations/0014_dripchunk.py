@@ -0,0 +1,29 @@
+# Generated by Django 3.2.15 on 2026-10-17 23:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drip', '0013_dripclaim'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DripChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('first_pk', models.CharField(max_length=64)),
+                ('last_pk', models.CharField(max_length=64)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('leased', 'Leased'), ('done', 'Done')], db_index=True, default='pending', max_length=12)),
+                ('lease_owner', models.CharField(blank=True, default='', max_length=64)),
+                ('leased_until', models.DateTimeField(default=None, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('sent', models.PositiveIntegerField(default=0)),
+                ('drip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='drip.drip')),
+            ],
+        ),
+    ]
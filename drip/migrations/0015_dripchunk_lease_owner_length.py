@@ -0,0 +1,18 @@
+# Generated by Django 3.2.15 on 2026-10-18 00:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drip', '0014_dripchunk'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dripchunk',
+            name='lease_owner',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import OrderedDict
+from email.message import Message
+from email.utils import formatdate, make_msgid
+from typing import Optional, Tuple, Union
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.core.mail.message import DNS_NAME, SafeMIMEMultipart, SafeMIMEText, forbid_multi_line_headers
+
+
+class MessageSkeleton(object):
+    """
+    MIME structure shared by the messages of a drip run, built once instead of for every message:
+    the encoded ``From`` header, the encoded subjects, the ``Date`` header of the current second
+    and the encoded text parts of the bodies shared by many messages, like static ones.
+    Each message then only encodes its recipient, its own body parts and its Message-ID.
+
+    :param from_email: From address of the messages
+    :type from_email: Optional[str]
+    :param encoding: Charset of the messages, defaults to DEFAULT_CHARSET
+    :type encoding: Optional[str]
+    :param max_parts: Amount of encoded text parts kept
+    :type max_parts: int
+    """
+
+    def __init__(self, from_email: Optional[str], encoding: Optional[str] = None, max_parts: int = 8):
+        self.from_email = from_email
+        self.encoding = encoding or settings.DEFAULT_CHARSET
+        self.max_parts = max_parts
+        self.from_header = self.encode_header("From", from_email)
+        self._subject: Tuple[Optional[str], str] = (None, "")
+        self._date: Tuple[int, str] = (0, "")
+        self._parts: "OrderedDict[Tuple[str, str], SafeMIMEText]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def encode_header(self, name: str, value: Optional[str]) -> str:
+        return forbid_multi_line_headers(name, value, self.encoding)[1]
+
+    def get_subject_header(self, subject: str) -> str:
+        cached_subject, header = self._subject
+        if cached_subject != subject:
+            header = self.encode_header("Subject", subject)
+            self._subject = (subject, header)
+        return header
+
+    def get_date_header(self) -> str:
+        # the header has no fractions of second, so it is the same during a whole second
+        now = int(time.time())
+        cached_now, header = self._date
+        if cached_now != now:
+            header = formatdate(now, localtime=settings.EMAIL_USE_LOCALTIME)
+            self._date = (now, header)
+        return header
+
+    def get_text_part(self, text: str, subtype: str) -> SafeMIMEText:
+        """
+        Returns the encoded text part of a multipart message, shared by the messages with the same text.
+        Parts are never changed once encoded, so every message can include the same one.
+        """
+        key = (subtype, text)
+        with self._lock:
+            part = self._parts.get(key)
+            if part is not None:
+                self._parts.move_to_end(key)
+                return part
+        part = SafeMIMEText(text, subtype, self.encoding)
+        with self._lock:
+            self._parts[key] = part
+            while len(self._parts) > self.max_parts:
+                self._parts.popitem(last=False)
+        return part
+
+    def can_build(self, email: "DripEmail") -> bool:
+        """Whether the email only uses what the skeleton builds, otherwise Django builds it."""
+        return (
+            not (email.attachments or email.cc or email.reply_to or email.extra_headers)
+            and (email.encoding or settings.DEFAULT_CHARSET) == self.encoding
+            and email.from_email == self.from_email
+            and all(mimetype.startswith("text/") for content, mimetype in email.alternatives)
+        )
+
+    def build(self, email: "DripEmail") -> Union[SafeMIMEText, SafeMIMEMultipart]:
+        """Builds the same MIME message as ``EmailMultiAlternatives.message``, reusing the shared parts."""
+        msg: Union[SafeMIMEText, SafeMIMEMultipart]
+        if email.alternatives:
+            msg = SafeMIMEMultipart(_subtype=email.alternative_subtype, encoding=self.encoding)
+            if email.body:
+                msg.attach(self.get_text_part(email.body, email.content_subtype))
+            for content, mimetype in email.alternatives:
+                msg.attach(self.get_text_part(content, mimetype.split("/", 1)[1]))
+        else:
+            # the headers are set on the body part itself, it can not be shared
+            msg = SafeMIMEText(email.body, email.content_subtype, self.encoding)
+        # the headers are encoded already, skip the encoding of the Safe MIME classes
+        Message.__setitem__(msg, "Subject", self.get_subject_header(email.subject))
+        Message.__setitem__(msg, "From", self.from_header)
+        if email.to:
+            Message.__setitem__(msg, "To", self.encode_header("To", ", ".join(str(to) for to in email.to)))
+        Message.__setitem__(msg, "Date", self.get_date_header())
+        Message.__setitem__(msg, "Message-ID", make_msgid(domain=DNS_NAME))
+        return msg
+
+
+class DripEmail(EmailMultiAlternatives):
+    """Email built from the ``MessageSkeleton`` of its drip run, when it has one."""
+
+    def __init__(self, *args, skeleton: Optional[MessageSkeleton] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.skeleton = skeleton
+
+    def message(self) -> Union[SafeMIMEText, SafeMIMEMultipart]:
+        if self.skeleton is None or not self.skeleton.can_build(self):
+            return super().message()
+        return self.skeleton.build(self)
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import TYPE_CHECKING, Callable, Dict, Union
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Union
 
 if TYPE_CHECKING:
     from drip.drips import DripBase
@@ -12,7 +12,7 @@ from django.db.models.query import QuerySet
 from drip.campaigns.models import Campaign
 from drip.helpers import parse
 from drip.types import BoolOrStr, FExpressionOrStr, FieldValue, TimeDeltaOrStr
-from drip.utils import get_user_model, validate_schedules
+from drip.utils import get_model_field, get_user_model, validate_schedules
 
 # Raise exception if SCHEDULER is not valid
 validate_schedules()
@@ -130,6 +130,127 @@ class SentDrip(AbstractSentDrip):
     pass
 
 
+RETRY_PENDING = "pending"
+RETRY_DEAD = "dead"
+
+RETRY_STATUSES = (
+    (RETRY_PENDING, "Pending"),
+    (RETRY_DEAD, "Dead"),
+)
+
+
+class DripRetry(models.Model):
+    """
+    A drip message that failed to be delivered, kept already rendered
+    to be delivered again later with exponential backoff.
+    """
+
+    created_date = models.DateTimeField(auto_now_add=True)
+    lastchanged = models.DateTimeField(auto_now=True)
+    drip = models.ForeignKey(
+        Drip,
+        related_name="retries",
+        on_delete=models.CASCADE,
+    )
+    user = models.ForeignKey(
+        getattr(settings, "AUTH_USER_MODEL", "auth.User"),
+        related_name="drip_retries",
+        on_delete=models.CASCADE,
+    )
+    subject = models.TextField()
+    body = models.TextField()
+    plain = models.TextField()
+    from_email = models.CharField(max_length=255, null=True, default=None)
+    from_email_name = models.CharField(max_length=150, null=True, default=None)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(db_index=True)
+    status = models.CharField(max_length=12, default=RETRY_PENDING, choices=RETRY_STATUSES)
+    last_error = models.TextField(blank=True, default="")
+
+    class Meta:
+        verbose_name_plural = "drip retries"
+
+
+class DripClaim(models.Model):
+    """
+    Reserves a drip for a user before delivering it, so concurrent runs
+    never deliver a drip that can not be resent twice to the same user.
+    """
+
+    created_date = models.DateTimeField(auto_now_add=True)
+    drip = models.ForeignKey(
+        Drip,
+        related_name="claims",
+        on_delete=models.CASCADE,
+    )
+    user = models.ForeignKey(
+        getattr(settings, "AUTH_USER_MODEL", "auth.User"),
+        related_name="drip_claims",
+        on_delete=models.CASCADE,
+    )
+    run_id = models.CharField(max_length=32)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["drip", "user"], name="unique_drip_claim"),
+        ]
+
+
+CHUNK_PENDING = "pending"
+CHUNK_LEASED = "leased"
+CHUNK_DONE = "done"
+
+CHUNK_STATUSES = (
+    (CHUNK_PENDING, "Pending"),
+    (CHUNK_LEASED, "Leased"),
+    (CHUNK_DONE, "Done"),
+)
+
+
+class DripChunk(models.Model):
+    """
+    A range of the audience of a drip, leased by the nodes sending drips.
+    The primary keys are stored as text, so any primary key type can be used.
+    """
+
+    created_date = models.DateTimeField(auto_now_add=True)
+    drip = models.ForeignKey(
+        Drip,
+        related_name="chunks",
+        on_delete=models.CASCADE,
+    )
+    first_pk = models.CharField(max_length=64)
+    last_pk = models.CharField(max_length=64)
+    status = models.CharField(max_length=12, default=CHUNK_PENDING, choices=CHUNK_STATUSES, db_index=True)
+    lease_owner = models.CharField(max_length=255, blank=True, default="")
+    leased_until = models.DateTimeField(null=True, default=None)
+    attempts = models.PositiveIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+
+
+class OutboxMessage(models.Model):
+    """
+    A rendered drip message waiting to be delivered.
+
+    It is created in the same transaction as the SentDrip that reserves the
+    message, which keeps the rendered subject and body. Uses the same statuses
+    as DripRetry: messages that keep failing are marked as dead.
+    """
+
+    created_date = models.DateTimeField(auto_now_add=True)
+    sent_drip = models.OneToOneField(
+        SentDrip,
+        related_name="outbox_message",
+        on_delete=models.CASCADE,
+    )
+    plain = models.TextField()
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(db_index=True)
+    lease_id = models.CharField(max_length=32, blank=True, default="")
+    status = models.CharField(max_length=12, default=RETRY_PENDING, choices=RETRY_STATUSES)
+    last_error = models.TextField(blank=True, default="")
+
+
 METHOD_TYPES = (
     ("filter", "Filter"),
     ("exclude", "Exclude"),
@@ -152,6 +273,9 @@ LOOKUP_TYPES = (
     ("iendswith", "ends with (case insensitive)"),
 )
 
+# Lookups comparing the value with the whole field, so the value is converted to the type of the field.
+TYPED_LOOKUPS = {"exact", "gt", "gte", "lt", "lte"}
+
 RULE_TYPES = (
     ("or", "Or"),
     ("and", "And"),
@@ -278,6 +402,42 @@ class AbstractQuerySetRule(models.Model):
             booleans = False
         return booleans
 
+    def get_value_field(self) -> Optional[models.Field]:
+        """
+        Returns the field of the user model the value is compared with,
+        or None when the value is not compared with a whole field.
+        """
+        if self.lookup_type not in TYPED_LOOKUPS:
+            return None
+        if self.field_name.endswith("__count"):
+            return models.IntegerField()
+        return get_model_field(get_user_model(), self.field_name)
+
+    def convert_value(self, field_value: str) -> Any:
+        field = self.get_value_field()
+        if field is None:
+            return field_value
+        try:
+            typed_value = field.to_python(field_value)
+        except ValidationError:
+            return field_value
+        # an empty value would turn the comparison into an isnull lookup
+        return field_value if typed_value is None else typed_value
+
+    def set_typed_value(self, field_value: FieldValue) -> Any:
+        """
+        Converts a string field_value with the ``to_python`` method of the field it is compared with,
+        so the queries send parameters of the type of the column. The converted value is cached until
+        the rule changes. Values that can not be converted are returned unchanged.
+        """
+        if type(field_value) != str:
+            return field_value
+        key = (self.field_name, self.lookup_type, field_value)
+        cached = getattr(self, "_typed_value", None)
+        if cached is None or cached[0] != key:
+            cached = self._typed_value = (key, self.convert_value(field_value))
+        return cached[1]
+
     def filter_kwargs(
         self, now: Callable = datetime.now
     ) -> Dict[str, Union[BoolOrStr, FExpressionOrStr, TimeDeltaOrStr]]:
@@ -306,6 +466,8 @@ class AbstractQuerySetRule(models.Model):
 
         field_value = self.set_booleans(field_value) if type(field_value) == str else field_value
 
+        field_value = self.set_typed_value(field_value)
+
         kwargs = {field_name: field_value}
 
         return kwargs
@@ -0,0 +1,244 @@
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import connections, router, transaction
+
+from drip.delivery import SharedConnection
+from drip.models import RETRY_DEAD, RETRY_PENDING, DripClaim, DripRetry, OutboxMessage, SentDrip
+from drip.ratelimit import RateLimiter
+from drip.retries import RetryPolicy, build_stored_message
+from drip.utils import get_conditional_now
+
+conditional_now = get_conditional_now()
+
+
+def get_outbox_settings() -> dict:
+    return getattr(settings, "DRIP_OUTBOX_SETTINGS", {})
+
+
+class OutboxWriter(object):
+    """
+    Stage one of the outbox pipeline: reserves the SentDrips of rendered messages
+    together with their outbox messages, ``batch_size`` messages per transaction.
+    A batch that fails to be written is logged and not counted.
+
+    :param batch_size: Amount of messages written per transaction
+    :type batch_size: int
+    """
+
+    def __init__(self, batch_size: int = 500):
+        self.batch_size = batch_size
+        self.count = 0
+        self._pending: List[Tuple[SentDrip, str]] = []
+
+    def add(self, sent_drip: SentDrip, plain: str) -> None:
+        self._pending.append((sent_drip, plain))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def save_sent_drips(self, sent_drips: List[SentDrip]) -> None:
+        """Inserts the SentDrips, at once when the database returns the primary keys of bulk inserts."""
+        if connections[router.db_for_write(SentDrip)].features.can_return_rows_from_bulk_insert:
+            SentDrip.objects.bulk_create(sent_drips)
+            return
+        for sent_drip in sent_drips:
+            sent_drip.save()
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        now = conditional_now()
+        try:
+            with transaction.atomic():
+                self.save_sent_drips([sent_drip for sent_drip, _ in pending])
+                OutboxMessage.objects.bulk_create(
+                    [
+                        OutboxMessage(sent_drip=sent_drip, plain=plain, next_attempt_at=now)
+                        for sent_drip, plain in pending
+                    ]
+                )
+        except Exception as e:
+            logging.error(
+                "Failed to enqueue {amount} messages for drip {drip}: {err}".format(
+                    amount=len(pending),
+                    drip=pending[0][0].drip_id,
+                    err=str(e),
+                )
+            )
+            # the messages were not reserved, a later run can claim their users again
+            DripClaim.objects.filter(
+                drip_id=pending[0][0].drip_id,
+                user_id__in=[sent_drip.user_id for sent_drip, _ in pending],
+            ).delete()
+        else:
+            self.count += len(pending)
+
+
+class OutboxDrainer(object):
+    """
+    Stage two of the outbox pipeline: delivers the pending outbox messages in batches.
+
+    Every batch is leased by pushing its next attempt ``lease`` seconds ahead, so several
+    drainers can run at once, and messages of a drainer that dies are delivered by another
+    one once the lease expires. Every delivered message is removed from the outbox right away,
+    and a drainer stops its batch as soon as it loses the lease. Failed messages are retried with
+    the backoff of ``retry_policy`` and moved to the dead retries after its ``max_attempts``.
+
+    :param batch_size: Amount of messages leased at once
+    :type batch_size: int
+    :param lease: Seconds a batch is reserved for this drainer
+    :type lease: float
+    :param retry_policy: Backoff of failed messages
+    :type retry_policy: RetryPolicy
+    """
+
+    def __init__(self, batch_size: int = 500, lease: float = 300, retry_policy: Optional[RetryPolicy] = None):
+        self.batch_size = batch_size
+        self.lease = lease
+        self.retry_policy = retry_policy or RetryPolicy()
+
+    @classmethod
+    def from_settings(cls) -> "OutboxDrainer":
+        """Builds the drainer from DRIP_OUTBOX_SETTINGS, with the backoff of DRIP_RETRY_SETTINGS."""
+        outbox_settings = get_outbox_settings()
+        return cls(
+            batch_size=outbox_settings.get("BATCH_SIZE", 500),
+            lease=outbox_settings.get("LEASE", 300),
+            retry_policy=RetryPolicy.from_settings(),
+        )
+
+    def lease_batch(self, size: int, now: datetime) -> List[OutboxMessage]:
+        """Reserves up to ``size`` due messages, skipping the ones another drainer reserved first."""
+        lease_id = uuid4().hex
+        due_ids = list(
+            OutboxMessage.objects.filter(status=RETRY_PENDING, next_attempt_at__lte=now)
+            .order_by("next_attempt_at")
+            .values_list("pk", flat=True)[:size]
+        )
+        if not due_ids:
+            return []
+        OutboxMessage.objects.filter(pk__in=due_ids, status=RETRY_PENDING, next_attempt_at__lte=now).update(
+            lease_id=lease_id,
+            next_attempt_at=now + timedelta(seconds=self.lease),
+        )
+        return list(OutboxMessage.objects.filter(lease_id=lease_id).select_related("sent_drip__user"))
+
+    def give_up(self, outbox_message: OutboxMessage, attempts: int, error: Exception) -> None:
+        """
+        Moves a message that keeps failing to a dead DripRetry, kept to be inspected, and drops the
+        SentDrip that reserved it, so a later run can claim the user again.
+        """
+        sent_drip = outbox_message.sent_drip
+        with transaction.atomic():
+            deleted, _ = OutboxMessage.objects.filter(pk=outbox_message.pk, lease_id=outbox_message.lease_id).delete()
+            if not deleted:
+                # another drainer leased the message again
+                return
+            DripRetry.objects.create(
+                drip_id=sent_drip.drip_id,
+                user_id=sent_drip.user_id,
+                subject=sent_drip.subject,
+                body=sent_drip.body,
+                plain=outbox_message.plain,
+                from_email=sent_drip.from_email,
+                from_email_name=sent_drip.from_email_name,
+                attempts=attempts,
+                next_attempt_at=conditional_now(),
+                status=RETRY_DEAD,
+                last_error=str(error),
+            )
+            SentDrip.objects.filter(pk=sent_drip.pk).delete()
+            # the drip was never delivered, a later run can claim the user again
+            DripClaim.objects.filter(drip_id=sent_drip.drip_id, user_id=sent_drip.user_id).delete()
+
+    def record_failure(self, outbox_message: OutboxMessage, error: Exception) -> None:
+        attempts = outbox_message.attempts + 1
+        if attempts >= self.retry_policy.max_attempts:
+            logging.error(
+                "Giving up on drip {drip} for user {user} after {attempts} attempts: {err}".format(
+                    drip=outbox_message.sent_drip.drip_id,
+                    user=outbox_message.sent_drip.user_id,
+                    attempts=attempts,
+                    err=str(error),
+                )
+            )
+            self.give_up(outbox_message, attempts, error)
+            return
+        OutboxMessage.objects.filter(pk=outbox_message.pk, lease_id=outbox_message.lease_id).update(
+            attempts=attempts,
+            last_error=str(error),
+            next_attempt_at=self.retry_policy.get_next_attempt_at(attempts),
+        )
+
+    def deliver_batch(
+        self,
+        outbox_messages: List[OutboxMessage],
+        shared_connection: SharedConnection,
+        rate_limiter: Optional[RateLimiter],
+    ) -> int:
+        """
+        Delivers the leased messages, removing each one from the outbox once it is sent.
+        Stops when the lease expires or another drainer leased the messages again,
+        so the rest of the batch is only delivered by the drainer holding it.
+        """
+        delivered = 0
+        for outbox_message in outbox_messages:
+            sent_drip = outbox_message.sent_drip
+            if rate_limiter:
+                rate_limiter.acquire(sent_drip.drip_id, sent_drip.user.email)
+            # every leased message expires with the lease of its batch
+            if conditional_now() >= outbox_message.next_attempt_at:
+                logging.warning(
+                    "The lease of {lease} expired, stopping its batch".format(lease=outbox_message.lease_id)
+                )
+                break
+            message = build_stored_message(
+                sent_drip.subject,
+                sent_drip.body,
+                outbox_message.plain,
+                sent_drip.from_email,
+                sent_drip.from_email_name,
+                sent_drip.user.email,
+            )
+            try:
+                if not shared_connection.get().send_messages([message]):
+                    raise Exception("The email backend did not deliver the message")
+            except Exception as e:
+                shared_connection.discard()
+                self.record_failure(outbox_message, e)
+                continue
+            delivered += 1
+            deleted, _ = OutboxMessage.objects.filter(pk=outbox_message.pk, lease_id=outbox_message.lease_id).delete()
+            if not deleted:
+                logging.warning(
+                    "The lease of {lease} was lost, stopping its batch".format(lease=outbox_message.lease_id)
+                )
+                break
+        return delivered
+
+    def drain(self, limit: Optional[int] = None) -> int:
+        """Delivers due messages until the outbox is empty or ``limit`` messages were attempted."""
+        count = 0
+        attempted = 0
+        rate_limiter = RateLimiter.from_settings()
+        shared_connection = SharedConnection(chunk_size=getattr(settings, "DRIP_SHARED_CONNECTION_CHUNK_SIZE", None))
+        try:
+            while limit is None or attempted < limit:
+                size = self.batch_size if limit is None else min(self.batch_size, limit - attempted)
+                outbox_messages = self.lease_batch(size, conditional_now())
+                if not outbox_messages:
+                    break
+                attempted += len(outbox_messages)
+                count += self.deliver_batch(outbox_messages, shared_connection, rate_limiter)
+        finally:
+            shared_connection.discard()
+        return count
+
+
+def drain_outbox(limit: Optional[int] = None) -> int:
+    """Delivers the pending outbox messages with DRIP_OUTBOX_SETTINGS, returns the amount of delivered messages."""
+    return OutboxDrainer.from_settings().drain(limit=limit)
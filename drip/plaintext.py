@@ -0,0 +1,157 @@
+import re
+from functools import lru_cache
+from html.parser import HTMLParser
+from typing import List, NamedTuple, Optional, Tuple
+
+# Elements separated from the surrounding text by a blank line.
+PARAGRAPH_TAGS = {
+    "address",
+    "article",
+    "aside",
+    "blockquote",
+    "dl",
+    "fieldset",
+    "figure",
+    "footer",
+    "form",
+    "h1",
+    "h2",
+    "h3",
+    "h4",
+    "h5",
+    "h6",
+    "header",
+    "hr",
+    "main",
+    "nav",
+    "ol",
+    "p",
+    "pre",
+    "section",
+    "table",
+    "ul",
+}
+# Elements starting on a new line.
+LINE_TAGS = {"br", "dd", "div", "dt", "figcaption", "li", "tr"}
+# Elements whose content is not text of the message.
+SKIPPED_TAGS = {"head", "noscript", "script", "style", "template", "title"}
+# Elements without end tag.
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+WHITESPACE_RE = re.compile(r"\s+")
+# Markers of line and paragraph breaks, and of preformatted whitespace, resolved once the whole document was parsed.
+LINE_BREAK = "\x00"
+PARAGRAPH_BREAK = "\x01"
+PREFORMATTED_BREAK = "\x02"
+PREFORMATTED_SPACE = "\x03"
+BREAKS_RE = re.compile(r" *[\x00\x01][\x00\x01 ]*")
+
+
+class PlainText(NamedTuple):
+    """Plain text of a body, and whether the body had any HTML markup."""
+
+    text: str
+    has_html: bool
+
+
+class HTMLTextParser(HTMLParser):
+    """
+    Single pass HTML to text converter: block elements start new lines, whitespace is collapsed
+    like browsers do, links keep their URL after their text and images are replaced by their alt text.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self.has_html = False
+        self.skipped = 0
+        self.preformatted = 0
+        self.links: List[Tuple[Optional[str], int]] = []
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        self.has_html = True
+        if tag in SKIPPED_TAGS:
+            self.skipped += 1
+        elif tag in PARAGRAPH_TAGS:
+            self.parts.append(PARAGRAPH_BREAK)
+        elif tag in LINE_TAGS:
+            self.parts.append(LINE_BREAK)
+        elif tag in ("td", "th"):
+            self.parts.append(" ")
+        if tag == "pre":
+            self.preformatted += 1
+        elif tag == "li":
+            self.parts.append("- ")
+        elif tag == "a":
+            self.links.append((dict(attrs).get("href"), len(self.parts)))
+        elif tag == "img":
+            alt = dict(attrs).get("alt")
+            if alt and not self.skipped:
+                self.handle_data(alt)
+
+    def handle_startendtag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag: str) -> None:
+        self.has_html = True
+        if tag in SKIPPED_TAGS:
+            self.skipped = max(self.skipped - 1, 0)
+        elif tag in PARAGRAPH_TAGS:
+            self.parts.append(PARAGRAPH_BREAK)
+        elif tag in LINE_TAGS:
+            self.parts.append(LINE_BREAK)
+        if tag == "pre":
+            self.preformatted = max(self.preformatted - 1, 0)
+        elif tag == "a" and self.links:
+            href, start = self.links.pop()
+            text = "".join(self.parts[start:]).strip()
+            if href and not href.startswith("#") and href != text:
+                if href.startswith("mailto:") and href[len("mailto:") :] == text:
+                    return
+                self.parts.append(" ({href})".format(href=href) if text else href)
+
+    def handle_data(self, data: str) -> None:
+        if self.skipped:
+            return
+        if self.preformatted:
+            self.parts.append(data.replace("\n", PREFORMATTED_BREAK).replace(" ", PREFORMATTED_SPACE))
+        else:
+            self.parts.append(WHITESPACE_RE.sub(" ", data))
+
+    def handle_comment(self, data: str) -> None:
+        self.has_html = True
+
+    def handle_decl(self, decl: str) -> None:
+        self.has_html = True
+
+    def handle_pi(self, data: str) -> None:
+        self.has_html = True
+
+    def get_text(self) -> str:
+        text = "".join(self.parts)
+        # collapse the spaces around line breaks, and the breaks between them
+        text = BREAKS_RE.sub(lambda match: "\n\n" if PARAGRAPH_BREAK in match.group() else "\n", text)
+        return text.replace(PREFORMATTED_BREAK, "\n").replace(PREFORMATTED_SPACE, " ").strip()
+
+
+def html_to_text(html: str) -> PlainText:
+    """
+    Converts an HTML body to plain text. Bodies without any markup are returned as they are,
+    with ``has_html`` False, so they are sent as plain text only.
+    """
+    if "<" not in html:
+        return PlainText(html, False)
+    parser = HTMLTextParser()
+    parser.feed(html)
+    parser.close()
+    if not parser.has_html:
+        return PlainText(html, False)
+    return PlainText(parser.get_text(), True)
+
+
+@lru_cache(maxsize=128)
+def get_plain_text(html: str) -> PlainText:
+    """Cached ``html_to_text``, so bodies shared by many messages are converted once."""
+    return html_to_text(html)
@@ -0,0 +1,34 @@
+"""
+Helpers to send drips on a pool of processes.
+
+Functions here are imported by child processes before Django is set up,
+so models are only imported inside them.
+"""
+from typing import Optional
+
+import django
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.db import connections
+
+
+def init_drip_process() -> None:
+    """Set up Django in processes that were spawned instead of forked."""
+    if not apps.ready:
+        django.setup()
+
+
+def run_drip(drip_id: int, workers: Optional[int] = None, use_async: bool = False) -> Optional[int]:
+    """
+    Runs the drip with the given id and returns the count of created SentDrips.
+    Database connections opened by the drip are closed before returning.
+    """
+    from drip.models import Drip
+
+    try:
+        drip = Drip.objects.get(pk=drip_id).drip
+        if use_async:
+            return async_to_sync(drip.arun)()
+        return drip.run(workers=workers)
+    finally:
+        connections.close_all()
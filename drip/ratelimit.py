@@ -0,0 +1,146 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Union
+
+from django.conf import settings
+from django.core.cache import BaseCache, caches
+
+DomainRates = Union[int, float, Dict[str, Union[int, float]]]
+
+
+@contextmanager
+def cache_lock(cache: BaseCache, key: str, timeout: int = 5) -> Iterator[None]:
+    """
+    Mutual exclusion shared by every thread and process using the same cache.
+    The lock expires after ``timeout`` seconds in case its owner dies while holding it.
+    """
+    lock_key = "{key}:lock".format(key=key)
+    while not cache.add(lock_key, 1, timeout):
+        time.sleep(0.001)
+    try:
+        yield
+    finally:
+        cache.delete(lock_key)
+
+
+class TokenBucket(object):
+    """
+    Token bucket refilled with ``rate`` tokens per second, holding up to ``capacity`` tokens.
+
+    The state of the bucket lives in the Django cache, so every thread and every
+    process using the same cache backend share it. It is stored as the time at
+    which the bucket will be full again, which needs a single cache key.
+
+    :param key: Cache key of the bucket
+    :type key: str
+    :param rate: Tokens added per second
+    :type rate: float
+    :param capacity: Maximum amount of tokens, defaults to ``rate``
+    :type capacity: Optional[float]
+    :param cache: Cache backend where the bucket is stored
+    :type cache: BaseCache
+    """
+
+    def __init__(self, key: str, rate: float, capacity: Optional[float] = None, cache: Optional[BaseCache] = None):
+        self.key = key
+        self.rate = float(rate)
+        self.capacity = max(float(capacity or rate), 1.0)
+        self.cache = cache or caches["default"]
+
+    def reserve(self) -> float:
+        """Takes a token and returns the seconds to wait before using it."""
+        interval = 1 / self.rate
+        burst = interval * (self.capacity - 1)
+        with cache_lock(self.cache, self.key):
+            now = time.time()
+            full_at = max(self.cache.get(self.key, now), now)
+            wait = max(full_at - burst - now, 0.0)
+            full_at += interval
+            self.cache.set(self.key, full_at, timeout=int(full_at - now) + 60)
+        return wait
+
+
+class RateLimiter(object):
+    """
+    Paces outbound messages with a global bucket, a bucket per drip and a bucket
+    per recipient domain. Every delivery waits until all its buckets have a token.
+
+    Rates are messages per second, and any of them can be None to disable that bucket.
+    ``per_domain`` is either a single rate for every domain or a dict of rates per domain,
+    where the ``"*"`` key sets the rate of the domains that are not listed.
+
+    ``waited`` accumulates the seconds spent waiting for tokens.
+    """
+
+    def __init__(
+        self,
+        global_rate: Optional[float] = None,
+        per_drip: Optional[float] = None,
+        per_domain: Optional[DomainRates] = None,
+        burst: Optional[float] = None,
+        cache_alias: str = "default",
+        key_prefix: str = "drip:ratelimit",
+    ):
+        self.global_rate = global_rate
+        self.per_drip = per_drip
+        self.per_domain = per_domain
+        self.burst = burst
+        self.cache = caches[cache_alias]
+        self.key_prefix = key_prefix
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> Optional["RateLimiter"]:
+        """
+        Builds the limiter from DRIP_RATE_LIMIT_SETTINGS, returns None when no rate is configured.
+        """
+        rate_limit_settings = getattr(settings, "DRIP_RATE_LIMIT_SETTINGS", {})
+        global_rate = rate_limit_settings.get("GLOBAL")
+        per_drip = rate_limit_settings.get("PER_DRIP")
+        per_domain = rate_limit_settings.get("PER_DOMAIN")
+        if not (global_rate or per_drip or per_domain):
+            return None
+        return cls(
+            global_rate=global_rate,
+            per_drip=per_drip,
+            per_domain=per_domain,
+            burst=rate_limit_settings.get("BURST"),
+            cache_alias=rate_limit_settings.get("CACHE", "default"),
+        )
+
+    def get_domain_rate(self, domain: str) -> Optional[float]:
+        if isinstance(self.per_domain, dict):
+            return self.per_domain.get(domain, self.per_domain.get("*"))
+        return self.per_domain
+
+    def get_bucket(self, name: str, rate: float) -> TokenBucket:
+        key = "{prefix}:{name}".format(prefix=self.key_prefix, name=name)
+        return TokenBucket(key, rate, capacity=self.burst, cache=self.cache)
+
+    def get_buckets(self, drip_id: int, email: str) -> List[TokenBucket]:
+        buckets = []
+        if self.global_rate:
+            buckets.append(self.get_bucket("global", self.global_rate))
+        if self.per_drip:
+            buckets.append(self.get_bucket("drip:{id}".format(id=drip_id), self.per_drip))
+        domain = email.rpartition("@")[2].lower()
+        domain_rate = self.get_domain_rate(domain)
+        if domain_rate:
+            buckets.append(self.get_bucket("domain:{domain}".format(domain=domain), domain_rate))
+        return buckets
+
+    def reserve(self, drip_id: int, email: str) -> float:
+        """Takes a token from every bucket of the message, returns the seconds to wait before delivering it."""
+        wait = max([bucket.reserve() for bucket in self.get_buckets(drip_id, email)], default=0.0)
+        with self._lock:
+            self.waited += wait
+        return wait
+
+    def acquire(self, drip_id: int, email: str) -> float:
+        """Blocks until the message can be delivered, returns the seconds waited."""
+        wait = self.reserve(drip_id, email)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
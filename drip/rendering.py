@@ -0,0 +1,296 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Collection, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.template import Context, Template, defaulttags
+from django.template.base import FilterExpression, Node, NodeList, TextNode, Variable, VariableNode
+from django.templatetags.static import StaticNode
+from django.utils.safestring import SafeString
+
+
+class TemplateCache(object):
+    """
+    Least recently used cache of compiled templates, shared by every drip run of the process.
+
+    Entries are looked up by key, and only reused when they were compiled from the same source,
+    so a stale key can never render an outdated template. The cache holds up to
+    ``DRIP_TEMPLATE_CACHE_SIZE`` templates (128 by default).
+    """
+
+    def __init__(self):
+        self._templates: "OrderedDict[Hashable, Tuple[Any, Template]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def maxsize(self) -> int:
+        return getattr(settings, "DRIP_TEMPLATE_CACHE_SIZE", 128)
+
+    def get(self, key: Optional[Hashable], source: Any) -> Template:
+        """Returns the compiled template of ``source``, compiling it when it is not cached under ``key``."""
+        if key is None:
+            return Template(source)
+        with self._lock:
+            entry = self._templates.get(key)
+            if entry is not None and entry[0] == source:
+                self._templates.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # compile outside of the lock, other threads can keep using the cache meanwhile
+        template = Template(source)
+        with self._lock:
+            self._templates[key] = (source, template)
+            self._templates.move_to_end(key)
+            while len(self._templates) > self.maxsize:
+                self._templates.popitem(last=False)
+        return template
+
+    def clear(self) -> None:
+        with self._lock:
+            self._templates.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+
+template_cache = TemplateCache()
+
+
+# Nodes that only read the context through their filter expressions and child nodes.
+TRANSPARENT_NODES = (
+    TextNode,
+    defaulttags.AutoEscapeControlNode,
+    defaulttags.CommentNode,
+    defaulttags.LoadNode,
+    defaulttags.SpacelessNode,
+    defaulttags.TemplateTagNode,
+    defaulttags.VerbatimNode,
+)
+
+# Filters that give a different output on every render.
+NON_DETERMINISTIC_FILTERS = {"random"}
+
+
+class UnknownNode(Exception):
+    """Raised for nodes whose use of the context can not be told."""
+
+
+def expression_names(filter_expression: FilterExpression) -> Set[str]:
+    """Root names of the variables read by a filter expression, like ``user`` for ``user.email|default:fallback``."""
+    names = set()
+    variables = [filter_expression.var]
+    for filter_func, args in filter_expression.filters:
+        if getattr(filter_func, "__name__", None) in NON_DETERMINISTIC_FILTERS:
+            raise UnknownNode(filter_func)
+        variables.extend(arg for lookup, arg in args if lookup)
+    for variable in variables:
+        if isinstance(variable, Variable) and variable.lookups:
+            names.add(variable.lookups[0])
+    return names
+
+
+def condition_names(condition: Any) -> Set[str]:
+    """Root names of the variables read by an ``{% if %}`` condition."""
+    if condition is None:
+        return set()
+    if isinstance(getattr(condition, "value", None), FilterExpression):
+        return expression_names(condition.value)
+    return condition_names(getattr(condition, "first", None)) | condition_names(getattr(condition, "second", None))
+
+
+def own_names(node: Node) -> Set[str]:
+    """Root names of the variables read by a node, without its children, raises UnknownNode when it can not tell."""
+    names: Set[str] = set()
+    if isinstance(node, VariableNode):
+        names |= expression_names(node.filter_expression)
+    elif isinstance(node, defaulttags.IfNode):
+        for condition, nodelist in node.conditions_nodelists:
+            names |= condition_names(condition)
+    elif isinstance(node, defaulttags.ForNode):
+        names |= expression_names(node.sequence)
+    elif isinstance(node, defaulttags.WithNode):
+        for value in node.extra_context.values():
+            names |= expression_names(value)
+    elif isinstance(node, defaulttags.CycleNode):
+        for value in node.cyclevars:
+            names |= expression_names(value)
+    elif isinstance(node, defaulttags.FirstOfNode):
+        for value in node.vars:
+            names |= expression_names(value)
+    elif isinstance(node, defaulttags.FilterNode):
+        names |= expression_names(node.filter_expr)
+    elif isinstance(node, StaticNode):
+        names |= expression_names(node.path)
+    elif not isinstance(node, TRANSPARENT_NODES):
+        # includes, blocks and custom tags may read anything
+        raise UnknownNode(node)
+    return names
+
+
+def node_names(node: Node) -> Set[str]:
+    """Root names of the variables read by a node and its children, raises UnknownNode when it can not tell."""
+    names = own_names(node)
+    if isinstance(node, defaulttags.IfNode):
+        for condition, nodelist in node.conditions_nodelists:
+            names |= nodelist_names(nodelist)
+        return names
+    for attr in node.child_nodelists:
+        names |= nodelist_names(getattr(node, attr, None) or [])
+    return names
+
+
+def nodelist_names(nodelist: Iterable[Node]) -> Set[str]:
+    names: Set[str] = set()
+    for node in nodelist:
+        names |= node_names(node)
+    return names
+
+
+def is_static_template(template: Template, user_context_names: Collection[str]) -> bool:
+    """
+    Whether the output of the template can not depend on the per-user context, because none
+    of its nodes reads any of ``user_context_names``. Templates using tags or filters whose
+    use of the context can not be told are never static.
+    """
+    try:
+        names = nodelist_names(template.nodelist)
+    except UnknownNode:
+        return False
+    return not names.intersection(user_context_names)
+
+
+def prints_names_as_is(template: Template, names: Collection[str]) -> bool:
+    """
+    Whether the template only uses the variables of ``names`` to print them as they are, like
+    ``{{ unsubscribe_link }}``, so a placeholder rendered in their place can be replaced by their value.
+    """
+    try:
+        for node in template.nodelist.get_nodes_by_type(Node):
+            if isinstance(node, VariableNode):
+                expression = node.filter_expression
+                variable = expression.var
+                is_bare = isinstance(variable, Variable) and not expression.filters
+                if is_bare and len(variable.lookups or ()) == 1 and variable.lookups[0] in names:
+                    continue
+            if own_names(node).intersection(names):
+                return False
+    except UnknownNode:
+        return False
+    return True
+
+
+class RenderMemo(object):
+    """
+    Least recently used memo of the subject, body and plain text rendered for each render key
+    of a drip run, see ``DripMessage.get_render_key``. It holds up to ``DRIP_RENDER_MEMO_SIZE``
+    keys (100 by default).
+    """
+
+    def __init__(self):
+        self._renders: "OrderedDict[Hashable, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def maxsize(self) -> int:
+        return getattr(settings, "DRIP_RENDER_MEMO_SIZE", 100)
+
+    def get(self, key: Hashable, name: str, render: Callable[[], Any]) -> Any:
+        """Returns the memoized ``name`` render of the key, calling ``render`` when it is not memoized."""
+        with self._lock:
+            renders = self._renders.get(key)
+            if renders is not None and name in renders:
+                self._renders.move_to_end(key)
+                self.hits += 1
+                return renders[name]
+            self.misses += 1
+        rendered = render()
+        with self._lock:
+            self._renders.setdefault(key, {})[name] = rendered
+            self._renders.move_to_end(key)
+            while len(self._renders) > self.maxsize:
+                self._renders.popitem(last=False)
+        return rendered
+
+    def __len__(self) -> int:
+        return len(self._renders)
+
+
+# Attributes of the nodes that store their output in a context variable, like ``{% cycle 'a' 'b' as row %}``.
+ASSIGNMENT_ATTRIBUTES = ("asvar", "variable_name", "varname")
+
+
+def is_constant_node(node: Node) -> bool:
+    """
+    Whether the node renders the same output with any context: it reads no variable
+    and, to not change what the nodes after it render, assigns none either.
+    """
+    try:
+        if node_names(node):
+            return False
+    except UnknownNode:
+        return False
+    return not any(
+        getattr(child, attr, None) for child in node.get_nodes_by_type(Node) for attr in ASSIGNMENT_ATTRIBUTES
+    )
+
+
+class SegmentedTemplate(object):
+    """
+    Compiled template split in constant segments, rendered once, and the nodes that read the
+    context, rendered every time. Consecutive constant nodes are joined in a single string, so
+    rendering the body of a drip only evaluates its variables and joins precomputed strings.
+
+    The output is the same as the one of ``Template.render``.
+    """
+
+    def __init__(self, template: Template):
+        self.template = template
+        self.name = template.name
+        self._segments: Dict[Tuple[Any, ...], NodeList] = {}
+
+    def render_constants(self, nodes: List[Node], options: Tuple[Any, ...]) -> str:
+        autoescape, use_l10n, use_tz = options
+        context = Context(autoescape=autoescape, use_l10n=use_l10n, use_tz=use_tz)
+        return self.render_nodes(NodeList(nodes), context)
+
+    def build_segments(self, options: Tuple[Any, ...]) -> NodeList:
+        segments = NodeList()
+        constants: List[Node] = []
+        for node in self.template.nodelist:
+            if is_constant_node(node):
+                constants.append(node)
+                continue
+            if constants:
+                segments.append(self.render_constants(constants, options))
+                constants = []
+            segments.append(node)
+        if constants:
+            segments.append(self.render_constants(constants, options))
+        return segments
+
+    def get_segments(self, context: Context) -> NodeList:
+        # constant nodes like {{ '<i>' }} render differently with these context options
+        options = (context.autoescape, context.use_l10n, context.use_tz)
+        segments = self._segments.get(options)
+        if segments is None:
+            segments = self._segments[options] = self.build_segments(options)
+        return segments
+
+    def render_nodes(self, nodelist: NodeList, context: Context) -> SafeString:
+        # same as Template.render, to give the nodes the same render context
+        with context.render_context.push_state(self.template):
+            if context.template is None:
+                with context.bind_template(self.template):
+                    context.template_name = self.name
+                    return nodelist.render(context)
+            return nodelist.render(context)
+
+    def render(self, context: Context) -> SafeString:
+        return self.render_nodes(self.get_segments(context), context)
@@ -0,0 +1,198 @@
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Optional
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.db.models import F
+
+from drip.delivery import SharedConnection
+from drip.models import RETRY_DEAD, RETRY_PENDING, DripClaim, DripRetry, SentDrip
+from drip.ratelimit import RateLimiter
+from drip.utils import get_conditional_now
+
+if TYPE_CHECKING:
+    from drip.drips import DripMessage
+
+conditional_now = get_conditional_now()
+
+
+def build_stored_message(
+    subject: str,
+    body: str,
+    plain: str,
+    from_email: Optional[str],
+    from_email_name: Optional[str],
+    email: str,
+) -> EmailMultiAlternatives:
+    """Rebuilds an email from a stored rendering, the same way DripMessage builds it."""
+    if from_email_name:
+        from_ = "{name} <{email}>".format(name=from_email_name, email=from_email)
+    else:
+        from_ = from_email
+    message = EmailMultiAlternatives(subject, plain, from_, [email])
+    # the plain text is the body itself when the body has no html
+    if plain != body:
+        message.attach_alternative(body, "text/html")
+    return message
+
+
+class RetryPolicy(object):
+    """
+    Decides when a failed drip message is delivered again.
+
+    The n-th retry waits ``backoff * 2 ** (n - 1)`` seconds, up to ``max_backoff``,
+    with a random jitter of up to half that delay so retries of a failed batch
+    are spread instead of hitting the email provider at once. After ``max_attempts``
+    failed deliveries, counting the original one, the retry is marked as dead.
+
+    :param max_attempts: Deliveries attempted before giving up
+    :type max_attempts: int
+    :param backoff: Seconds waited before the first retry
+    :type backoff: float
+    :param max_backoff: Maximum seconds waited between retries
+    :type max_backoff: float
+    """
+
+    def __init__(self, max_attempts: int = 5, backoff: float = 60, max_backoff: float = 3600):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    @classmethod
+    def from_settings(cls) -> Optional["RetryPolicy"]:
+        """Builds the policy from DRIP_RETRY_SETTINGS, returns None when retries are not enabled."""
+        retry_settings = getattr(settings, "DRIP_RETRY_SETTINGS", {})
+        if not retry_settings.get("ENABLED", False):
+            return None
+        return cls(
+            max_attempts=retry_settings.get("MAX_ATTEMPTS", 5),
+            backoff=retry_settings.get("BACKOFF", 60),
+            max_backoff=retry_settings.get("MAX_BACKOFF", 3600),
+        )
+
+    def get_delay(self, attempts: int) -> float:
+        """Seconds to wait before the next delivery of a message that failed ``attempts`` times."""
+        delay = min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def get_next_attempt_at(self, attempts: int, now: Optional[datetime] = None) -> datetime:
+        return (now or conditional_now()) + timedelta(seconds=self.get_delay(attempts))
+
+    def schedule(self, message_instance: "DripMessage", error: Exception) -> DripRetry:
+        """Stores the rendered message that failed to be delivered for the first time."""
+        drip_base = message_instance.drip_base
+        status = RETRY_DEAD if self.max_attempts <= 1 else RETRY_PENDING
+        return DripRetry.objects.create(
+            drip=drip_base.drip_model,
+            user=message_instance.user,
+            subject=message_instance.subject,
+            body=message_instance.body,
+            plain=message_instance.plain,
+            from_email=drip_base.from_email,
+            from_email_name=drip_base.from_email_name,
+            attempts=1,
+            next_attempt_at=self.get_next_attempt_at(1),
+            status=status,
+            last_error=str(error),
+        )
+
+    def claim(self, retry: DripRetry, now: datetime) -> bool:
+        """
+        Counts a new attempt and pushes the next one back, only if no other worker did it first.
+        If the worker dies while delivering, the retry is picked up again after the backoff.
+        """
+        claimed = DripRetry.objects.filter(pk=retry.pk, status=RETRY_PENDING, attempts=retry.attempts).update(
+            attempts=F("attempts") + 1,
+            next_attempt_at=self.get_next_attempt_at(retry.attempts + 1, now),
+            lastchanged=now,
+        )
+        retry.attempts += 1
+        return bool(claimed)
+
+    def build_message(self, retry: DripRetry) -> EmailMultiAlternatives:
+        return build_stored_message(
+            retry.subject,
+            retry.body,
+            retry.plain,
+            retry.from_email,
+            retry.from_email_name,
+            retry.user.email,
+        )
+
+    def record_success(self, retry: DripRetry) -> None:
+        with transaction.atomic():
+            SentDrip.objects.create(
+                drip_id=retry.drip_id,
+                user_id=retry.user_id,
+                subject=retry.subject,
+                body=retry.body,
+                from_email=retry.from_email,
+                from_email_name=retry.from_email_name,
+            )
+            retry.delete()
+
+    def record_failure(self, retry: DripRetry, error: Exception) -> None:
+        retry.last_error = str(error)
+        update_fields = ["last_error"]
+        if retry.attempts >= self.max_attempts:
+            retry.status = RETRY_DEAD
+            update_fields.append("status")
+            logging.error(
+                "Giving up on drip {drip} for user {user} after {attempts} attempts: {err}".format(
+                    drip=retry.drip_id,
+                    user=retry.user_id,
+                    attempts=retry.attempts,
+                    err=str(error),
+                )
+            )
+            # the drip was never delivered, a later run can claim the user again
+            DripClaim.objects.filter(drip_id=retry.drip_id, user_id=retry.user_id).delete()
+        DripRetry.objects.filter(pk=retry.pk).update(**{field: getattr(retry, field) for field in update_fields})
+
+    def retry_pending(self, limit: Optional[int] = None) -> int:
+        """
+        Delivers again the pending retries that are due, returns the amount of delivered messages.
+        Delivered messages are recorded as SentDrips and their retries are deleted.
+        """
+        now = conditional_now()
+        retries = (
+            DripRetry.objects.filter(status=RETRY_PENDING, next_attempt_at__lte=now)
+            .select_related("user")
+            .order_by("next_attempt_at")
+        )
+        if limit:
+            retries = retries[:limit]
+
+        count = 0
+        rate_limiter = RateLimiter.from_settings()
+        shared_connection = SharedConnection(chunk_size=getattr(settings, "DRIP_SHARED_CONNECTION_CHUNK_SIZE", None))
+        try:
+            for retry in retries:
+                if not self.claim(retry, now):
+                    continue
+                if rate_limiter:
+                    rate_limiter.acquire(retry.drip_id, retry.user.email)
+                try:
+                    sent = shared_connection.get().send_messages([self.build_message(retry)])
+                    if not sent:
+                        raise Exception("The email backend did not deliver the message")
+                except Exception as e:
+                    shared_connection.discard()
+                    self.record_failure(retry, e)
+                    continue
+                self.record_success(retry)
+                count += 1
+        finally:
+            shared_connection.discard()
+        return count
+
+
+def retry_drips(limit: Optional[int] = None) -> int:
+    """Delivers the due retries with the policy in DRIP_RETRY_SETTINGS, returns the amount of delivered messages."""
+    policy = RetryPolicy.from_settings()
+    if policy is None:
+        return 0
+    return policy.retry_pending(limit=limit)
@@ -0,0 +1,252 @@
+import functools
+import operator
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, Callable, Hashable, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from django.conf import settings
+from django.db.models import Count, Exists, IntegerField, Model, OuterRef, Q, Subquery
+from django.db.models.manager import BaseManager
+from django.db.models.query import QuerySet
+
+from drip.helpers import parse
+from drip.utils import get_user_model, is_multi_valued
+
+# Prefixes of the rule values relative to the time of the evaluation, with the sign of their shift.
+TIME_SHIFTS = (
+    ("now-", False, -1),
+    ("now+", False, 1),
+    ("today-", True, -1),
+    ("today+", True, 1),
+)
+
+# Comparisons of a count with zero, checked with whether a related object exists (True) or not (False).
+EXISTS_COMPARISONS = {
+    ("gt", 0): True,
+    ("gte", 1): True,
+    ("exact", 0): False,
+    ("lt", 1): False,
+    ("lte", 0): False,
+}
+
+
+def count_subquery(model: Model, agg: str) -> Subquery:
+    """Correlated subquery counting the related objects of each row, the same as ``Count(agg, distinct=True)``."""
+    counted = model._base_manager.filter(pk=OuterRef("pk")).order_by().values("pk")
+    return Subquery(counted.annotate(count=Count(agg, distinct=True)).values("count"), output_field=IntegerField())
+
+
+def exists_subquery(model: Model, agg: str) -> Exists:
+    """Correlated subquery checking whether each row has any related object."""
+    return Exists(model._base_manager.filter(pk=OuterRef("pk"), **{"__".join([agg, "isnull"]): False}))
+
+
+class CompiledRule(NamedTuple):
+    """
+    A queryset rule with its value parsed. Values relative to the time of the evaluation
+    keep their parsed ``shift``, and are bound to the current time by ``get_value``.
+    Rules over counts compared with zero set ``count_exists``, and are checked with EXISTS.
+    """
+
+    rule_type: str
+    method_type: str
+    lookup: str
+    value: Any
+    shift: Optional[timedelta]
+    from_today: bool
+    annotation: Optional[Tuple[str, str]]
+    multi_valued: bool
+    count_exists: Optional[bool]
+
+    def get_value(self, now: Callable) -> Any:
+        if self.shift is None:
+            return self.value
+        base = now().date() if self.from_today else now()
+        return base + self.shift
+
+    def get_q(self, now: Callable, model: Model) -> Q:
+        if self.annotation is not None and self.count_exists is not None:
+            exists = Q(exists_subquery(model, self.annotation[1]))
+            return exists if self.count_exists else ~exists
+        return Q(**{self.lookup: self.get_value(now)})
+
+
+def compile_rule(rule: Any) -> CompiledRule:
+    """Parses the value of a queryset rule once, the same way ``AbstractQuerySetRule.filter_kwargs`` does."""
+    value: Any = rule.field_value
+    shift = None
+    from_today = False
+    for prefix, is_today, sign in TIME_SHIFTS:
+        if value.startswith(prefix):
+            shift = parse(value.replace(prefix, "")) * sign
+            from_today = is_today
+            value = None
+            break
+    else:
+        value = rule.set_f_expressions(value)
+        value = rule.set_booleans(value) if type(value) == str else value
+        value = rule.set_typed_value(value)
+    annotation = None
+    count_exists = None
+    if rule.field_name.endswith("__count"):
+        agg, _, _ = rule.field_name.rpartition("__")
+        annotation = (rule.annotated_field_name, agg)
+        if type(value) == int:
+            count_exists = EXISTS_COMPARISONS.get((rule.lookup_type, value))
+    return CompiledRule(
+        rule_type=rule.rule_type,
+        method_type=rule.method_type,
+        lookup="__".join([rule.annotated_field_name, rule.lookup_type]),
+        value=value,
+        shift=shift,
+        from_today=from_today,
+        annotation=annotation,
+        # counts are aggregated per user, they never repeat users
+        multi_valued=annotation is None and is_multi_valued(get_user_model(), rule.field_name),
+        count_exists=count_exists,
+    )
+
+
+class CompiledRuleSet(object):
+    """
+    The queryset rules of a drip, compiled once and applied to any queryset. Only the values
+    relative to the time of the evaluation, like ``now-7 days``, are computed again on each one.
+    """
+
+    def __init__(self, rules: Iterable[Any]):
+        compiled = [compile_rule(rule) for rule in rules]
+        self.and_rules = [rule for rule in compiled if rule.rule_type == "and"]
+        self.or_rules = [rule for rule in compiled if rule.rule_type == "or"]
+
+    def bind_now(self, now: Callable) -> Callable:
+        """Returns ``now`` called at most once, so every rule of an evaluation shares the same time."""
+        return functools.lru_cache(maxsize=None)(now)
+
+    @property
+    def requires_distinct(self) -> bool:
+        """
+        Whether the rules can match a user more than once, because a filter crosses a relation to many objects.
+        Excluded relations are checked with subqueries, so they never repeat users.
+        """
+        return any(rule.multi_valued for rule in self.and_rules if rule.method_type != "exclude") or any(
+            rule.multi_valued for rule in self.or_rules
+        )
+
+    def annotate(self, qs: QuerySet) -> QuerySet:
+        """
+        Annotates the counts of the rules with a correlated subquery each, instead of joining the
+        counted relations and grouping the users, so several counts do not multiply the joined rows.
+        Counts are only aliased where ``QuerySet.alias`` exists, so the subquery is not selected too.
+        """
+        annotate = getattr(qs, "alias", qs.annotate)
+        annotations = {}
+        for rule in self.and_rules + self.or_rules:
+            if rule.annotation is not None and rule.count_exists is None:
+                name, agg = rule.annotation
+                annotations[name] = count_subquery(qs.model, agg)
+        return annotate(**annotations) if annotations else qs
+
+    def get_and_q(self, now: Callable, model: Model) -> Q:
+        """The AND rules: no excluded rule and every filter rule."""
+        filters = [rule.get_q(now, model) for rule in self.and_rules if rule.method_type != "exclude"]
+        excludes = [rule.get_q(now, model) for rule in self.and_rules if rule.method_type == "exclude"]
+        query = Q(*filters)
+        if excludes:
+            query &= ~functools.reduce(operator.or_, excludes)
+        return query
+
+    def get_or_q(self, now: Callable, model: Model) -> Q:
+        """The OR rules: any of them."""
+        return functools.reduce(operator.or_, [rule.get_q(now, model) for rule in self.or_rules])
+
+    def apply(self, manager_qs: Union[BaseManager, QuerySet], now: Callable) -> QuerySet:
+        """
+        Applies the AND and OR rules in a single WHERE clause: the users matching every AND rule,
+        or any OR rule. A drip without rules matches no user.
+        """
+        qs = manager_qs.all()
+        now = self.bind_now(now)
+        branches = []
+        if self.and_rules:
+            branches.append(self.get_and_q(now, qs.model))
+        if self.or_rules:
+            branches.append(self.get_or_q(now, qs.model))
+        if not branches:
+            return qs.none()
+        return self.annotate(qs).filter(functools.reduce(operator.or_, branches))
+
+    def apply_and(self, manager_qs: Union[BaseManager, QuerySet], now: Callable) -> QuerySet:
+        """Applies the annotations of the AND rules, then all their excludes at once and all their filters at once."""
+        qs = manager_qs.all()
+        if not self.and_rules:
+            return qs.none()
+        return self.annotate(qs).filter(self.get_and_q(self.bind_now(now), qs.model))
+
+    def apply_or(self, manager_qs: Union[BaseManager, QuerySet], now: Callable) -> QuerySet:
+        """Applies the OR rules at once."""
+        if not self.or_rules:
+            return manager_qs.none()
+        qs = manager_qs.all()
+        return self.annotate(qs).filter(self.get_or_q(self.bind_now(now), qs.model))
+
+
+def get_rules_signature(rules: Iterable[Any]) -> Tuple[Tuple[Any, ...], ...]:
+    """Definition of the rules a rule set is compiled from."""
+    return tuple(
+        (rule.pk, rule.rule_type, rule.method_type, rule.field_name, rule.lookup_type, rule.field_value)
+        for rule in rules
+    )
+
+
+class CompiledRulesCache(object):
+    """
+    Least recently used cache of the compiled rule sets of the drips, shared by every drip run of the process.
+
+    Rule sets are looked up by drip and time its newest rule was changed, and only reused when they
+    were compiled from the same rules, so rules deleted or updated without saving them are never
+    applied. The cache holds up to ``DRIP_RULES_CACHE_SIZE`` rule sets (128 by default).
+    """
+
+    def __init__(self):
+        self._rule_sets: "OrderedDict[Hashable, Tuple[Any, CompiledRuleSet]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def maxsize(self) -> int:
+        return getattr(settings, "DRIP_RULES_CACHE_SIZE", 128)
+
+    def get(self, drip_pk: Any, rules: List[Any]) -> CompiledRuleSet:
+        """Returns the compiled rule set of the rules of a drip, compiling it when it is not cached."""
+        if drip_pk is None:
+            return CompiledRuleSet(rules)
+        key = (drip_pk, max((rule.lastchanged for rule in rules if rule.lastchanged), default=None))
+        signature = get_rules_signature(rules)
+        with self._lock:
+            entry = self._rule_sets.get(key)
+            if entry is not None and entry[0] == signature:
+                self._rule_sets.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        rule_set = CompiledRuleSet(rules)
+        with self._lock:
+            self._rule_sets[key] = (signature, rule_set)
+            self._rule_sets.move_to_end(key)
+            while len(self._rule_sets) > self.maxsize:
+                self._rule_sets.popitem(last=False)
+        return rule_set
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rule_sets.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._rule_sets)
+
+
+rules_cache = CompiledRulesCache()
@@ -1,7 +1,13 @@
-from celery import current_app
+from typing import Any, List, Optional
+
+from celery import chord, current_app
+from celery.result import AsyncResult
 from celery.schedules import crontab
-from django.core.management import call_command
+from django.conf import settings
 
+from drip.models import Drip
+from drip.outbox import drain_outbox
+from drip.retries import retry_drips
 from drip.scheduler.constants import SCHEDULER_CELERY, get_drip_scheduler_settings
 
 (
@@ -16,11 +22,63 @@ app = current_app._get_current_object()
 
 CELERY_ENABLED = SCHEDULER == SCHEDULER_CELERY
 
+
+@app.task
+def send_drip_chunk(drip_id: int, first_pk: Any, last_pk: Any) -> int:
+    """
+    Renders, sends and records the drip for the users with a primary key
+    between first_pk and last_pk. Returns the count of created SentDrips.
+    """
+    drip = Drip.objects.get(pk=drip_id).drip
+    if not drip.drip_model.enabled:
+        return 0
+    drip.prune_for_send()
+    drip.limit_to_pk_range(first_pk, last_pk)
+    return drip.send()
+
+
+@app.task
+def sum_drip_counts(counts: List[Optional[int]]) -> int:
+    """Chord callback adding up the counts of every chunk."""
+    return sum(count or 0 for count in counts)
+
+
+@app.task
+def retry_failed_drips(limit: Optional[int] = None) -> int:
+    """Delivers again the failed drip messages that are due, returns the amount of delivered messages."""
+    return retry_drips(limit=limit)
+
+
+@app.task
+def drain_drip_outbox(limit: Optional[int] = None) -> int:
+    """Delivers the pending messages of the outbox, returns the amount of delivered messages."""
+    return drain_outbox(limit=limit)
+
+
+def dispatch_drip_chunks(chunk_size: Optional[int] = None) -> Optional[AsyncResult]:
+    """
+    Splits the audience of every enabled drip in primary key ranges of
+    ``chunk_size`` users (DRIP_CELERY_CHUNK_SIZE by default) and dispatches one
+    ``send_drip_chunk`` task per range, in a chord summed by ``sum_drip_counts``.
+    """
+    chunk_size = chunk_size or getattr(settings, "DRIP_CELERY_CHUNK_SIZE", 1000)
+    chunk_tasks = []
+    for drip_model in Drip.objects.filter(enabled=True).prefetch_related("queryset_rules"):
+        drip = drip_model.drip
+        drip.prune()
+        for first_pk, last_pk in drip.get_pk_ranges(chunk_size):
+            chunk_tasks.append(send_drip_chunk.s(drip_model.id, first_pk, last_pk))
+    if not chunk_tasks:
+        return None
+    return chord(chunk_tasks)(sum_drip_counts.s())
+
+
 if DRIP_SCHEDULE and CELERY_ENABLED:
 
     @app.task
     def call_send_drips_celery_command():
-        call_command("send_drips")
+        """Plans the scheduled drips run, fanning it out in chunk tasks across the workers."""
+        dispatch_drip_chunks()
 
 
 @app.on_after_finalize.connect
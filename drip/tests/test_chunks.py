@@ -0,0 +1,168 @@
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+import pytest
+from django.core import mail
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.utils import timezone
+
+from drip.chunks import LOCK_MODE_CONDITIONAL, LOCK_MODE_SKIP_LOCKED, ChunkLeaser
+from drip.models import CHUNK_DONE, CHUNK_LEASED, CHUNK_PENDING, DripChunk, DripClaim, SentDrip
+from drip.tests.test_drips import SetupDataDripMixin
+from drip.utils import get_user_model
+
+pytestmark = pytest.mark.django_db
+User = get_user_model()
+
+
+@pytest.fixture(params=[LOCK_MODE_SKIP_LOCKED, LOCK_MODE_CONDITIONAL])
+def lock_mode(request):
+    return request.param
+
+
+class TestChunkLeaser(SetupDataDripMixin):
+    def setup_method(self, test_method):
+        self.build_user_data()
+        self.model_drip = self.build_everyone_drip(enabled=True)
+
+    def build_leaser(self, lock_mode, owner=None):
+        return ChunkLeaser(chunk_size=6, lease=60, lock_mode=lock_mode, owner=owner)
+
+    def test_plan_splits_the_audience(self):
+        leaser = self.build_leaser(LOCK_MODE_CONDITIONAL)
+
+        assert 4 == leaser.plan()
+
+        pks = list(User.objects.order_by("pk").values_list("pk", flat=True))
+        chunks = list(DripChunk.objects.order_by("pk"))
+        assert [(str(pks[0]), str(pks[5])), (str(pks[6]), str(pks[11]))] == [
+            (chunk.first_pk, chunk.last_pk) for chunk in chunks[:2]
+        ]
+        assert {CHUNK_PENDING} == {chunk.status for chunk in chunks}
+
+    def test_plan_waits_for_unfinished_chunks(self):
+        leaser = self.build_leaser(LOCK_MODE_CONDITIONAL)
+        leaser.plan()
+
+        assert 0 == leaser.plan()
+        assert 4 == DripChunk.objects.count()
+
+        DripChunk.objects.update(status=CHUNK_DONE)
+        assert 0 == leaser.plan()
+        DripChunk.objects.update(created_date=leaser.get_window_start() - timedelta(seconds=1))
+        assert 4 == leaser.plan()
+        assert 4 == DripChunk.objects.count()
+
+    def test_plan_again_once_sent_without_window(self):
+        leaser = ChunkLeaser(chunk_size=6, window=0)
+        leaser.plan()
+
+        DripChunk.objects.update(status=CHUNK_DONE)
+        assert 4 == leaser.plan()
+
+    def test_sequential_nodes_send_once_per_window(self, lock_mode):
+        self.model_drip.can_resend_drip = True
+        self.model_drip.save()
+        first_node = self.build_leaser(lock_mode, owner="first")
+        second_node = self.build_leaser(lock_mode, owner="second")
+
+        first_node.plan()
+        assert 20 == first_node.work()
+        # started once the first node finished
+        assert 0 == second_node.plan()
+        assert 0 == second_node.work()
+        assert 20 == len(mail.outbox)
+
+    def test_nodes_lease_different_chunks(self, lock_mode):
+        first_node = self.build_leaser(lock_mode, owner="first")
+        second_node = self.build_leaser(lock_mode, owner="second")
+        first_node.plan()
+
+        first_chunk = first_node.lease_chunk()
+        second_chunk = second_node.lease_chunk()
+
+        assert first_chunk.pk != second_chunk.pk
+        assert CHUNK_LEASED == first_chunk.status
+        assert "first" == DripChunk.objects.get(pk=first_chunk.pk).lease_owner
+        assert "second" == DripChunk.objects.get(pk=second_chunk.pk).lease_owner
+
+    def test_work_sends_every_chunk(self, lock_mode):
+        leaser = self.build_leaser(lock_mode)
+        leaser.plan()
+
+        assert 20 == leaser.work()
+
+        assert 20 == len(mail.outbox)
+        assert 20 == SentDrip.objects.count()
+        assert {CHUNK_DONE} == set(DripChunk.objects.values_list("status", flat=True))
+        assert [6, 6, 6, 2] == list(DripChunk.objects.order_by("pk").values_list("sent", flat=True))
+        assert leaser.lease_chunk() is None
+
+    def test_expired_lease_is_reclaimed(self, lock_mode, caplog):
+        dead_node = self.build_leaser(lock_mode, owner="dead")
+        dead_node.plan()
+        chunk = dead_node.lease_chunk()
+        DripChunk.objects.filter(pk=chunk.pk).update(leased_until=timezone.now() - timedelta(seconds=1))
+
+        reclaimed = self.build_leaser(lock_mode, owner="alive").lease_chunk()
+
+        assert chunk.pk == reclaimed.pk
+        assert 2 == reclaimed.attempts
+        dead_node.finish_chunk(chunk, 0)
+        assert "expired while sending it" in caplog.text
+        assert CHUNK_LEASED == DripChunk.objects.get(pk=chunk.pk).status
+
+    def test_expired_lease_takes_over_the_claims_left(self, lock_mode):
+        dead_node = self.build_leaser(lock_mode, owner="dead")
+        dead_node.plan()
+        chunk = dead_node.lease_chunk()
+        users = User.objects.filter(pk__gte=chunk.first_pk, pk__lte=chunk.last_pk)
+        DripClaim.objects.bulk_create([DripClaim(drip=self.model_drip, user=user, run_id="dead") for user in users])
+        DripChunk.objects.filter(pk=chunk.pk).update(leased_until=timezone.now() - timedelta(seconds=1))
+
+        assert 20 == self.build_leaser(lock_mode, owner="alive").work()
+        assert not DripClaim.objects.filter(run_id="dead").exists()
+
+    def test_conditional_lease_lost_race(self):
+        leaser = self.build_leaser(LOCK_MODE_CONDITIONAL, owner="slow")
+        leaser.plan()
+        stale_chunk = DripChunk.objects.order_by("pk").first()
+        self.build_leaser(LOCK_MODE_CONDITIONAL, owner="fast").lease_chunk()
+
+        with patch.object(leaser, "get_leasable", return_value=[stale_chunk]):
+            assert leaser.lease_conditional(timezone.now()) is None
+        assert "fast" == DripChunk.objects.get(pk=stale_chunk.pk).lease_owner
+
+    def test_failed_chunk_is_finished(self, caplog):
+        leaser = self.build_leaser(LOCK_MODE_CONDITIONAL)
+        leaser.plan()
+
+        with patch("drip.drips.DripBase.send", side_effect=[Exception("DB down"), 6, 6, 2]):
+            assert 14 == leaser.work()
+
+        assert "Failed to send chunk" in caplog.text
+        assert {CHUNK_DONE} == set(DripChunk.objects.values_list("status", flat=True))
+
+    def test_auto_lock_mode(self):
+        leaser = ChunkLeaser()
+
+        with patch.object(connection.features, "has_select_for_update_skip_locked", False):
+            assert LOCK_MODE_CONDITIONAL == leaser.get_lock_mode()
+        with patch.object(connection.features, "has_select_for_update_skip_locked", True):
+            assert LOCK_MODE_SKIP_LOCKED == leaser.get_lock_mode()
+
+    def test_send_drips_command_chunked(self, settings):
+        settings.DRIP_CHUNK_SETTINGS = {"CHUNK_SIZE": 5}
+        out = StringIO()
+
+        call_command("send_drips", chunked=True, stdout=out)
+
+        assert "Chunks: 4 planned, 20 sent" in out.getvalue()
+        assert 20 == SentDrip.objects.count()
+
+    def test_send_drips_command_chunked_with_processes(self):
+        with pytest.raises(CommandError):
+            call_command("send_drips", chunked=True, processes=2)
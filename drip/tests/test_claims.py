@@ -0,0 +1,174 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.core import mail
+from django.db import IntegrityError
+from django.utils import timezone
+
+from drip.models import DripClaim, DripRetry, SentDrip
+from drip.retries import retry_drips
+from drip.tests.test_drips import SetupDataDripMixin
+
+pytestmark = pytest.mark.django_db
+
+
+class TestDripClaims(SetupDataDripMixin):
+    def setup_method(self, test_method):
+        self.build_user_data()
+
+    def test_send_claims_every_delivered_user(self):
+        drip = self.build_everyone_drip().drip
+
+        assert 20 == drip.send()
+
+        claims = DripClaim.objects.filter(drip=drip.drip_model)
+        assert 20 == claims.count()
+        assert {drip.run_id} == set(claims.values_list("run_id", flat=True))
+        assert set(SentDrip.objects.values_list("user_id", flat=True)) == set(claims.values_list("user_id", flat=True))
+
+    def test_claims_are_unique(self):
+        drip = self.build_joined_date_drip().drip
+        user = drip.get_queryset().first()
+        DripClaim.objects.create(drip=drip.drip_model, user=user, run_id="first")
+
+        with pytest.raises(IntegrityError):
+            DripClaim.objects.create(drip=drip.drip_model, user=user, run_id="second")
+
+    def test_overlapping_runs_skip_claimed_users(self):
+        model_drip = self.build_everyone_drip()
+        first_run = model_drip.drip
+        second_run = model_drip.drip
+        # both runs pruned before any of them delivered the drip
+        first_run.prune()
+        second_run.prune()
+
+        assert 20 == first_run.send()
+        assert 0 == second_run.send()
+        assert 20 == len(mail.outbox)
+        assert 20 == SentDrip.objects.count()
+
+    def test_users_claimed_by_another_run_are_skipped(self):
+        model_drip = self.build_everyone_drip()
+        users = list(model_drip.drip.get_queryset()[:5])
+        DripClaim.objects.bulk_create([DripClaim(drip=model_drip, user=user, run_id="other") for user in users])
+
+        assert 15 == model_drip.drip.send()
+        assert not SentDrip.objects.filter(user__in=users).exists()
+
+    def age_claims(self, seconds=3601):
+        DripClaim.objects.update(created_date=timezone.now() - timedelta(seconds=seconds))
+
+    def test_stale_claims_are_taken_over(self):
+        model_drip = self.build_everyone_drip()
+        users = list(model_drip.drip.get_queryset()[:5])
+        DripClaim.objects.bulk_create([DripClaim(drip=model_drip, user=user, run_id="dead") for user in users])
+        self.age_claims()
+        drip = model_drip.drip
+
+        assert 20 == drip.send()
+        assert {drip.run_id} == set(DripClaim.objects.values_list("run_id", flat=True))
+
+    def test_claim_ttl(self, settings):
+        settings.DRIP_CLAIM_TTL = 60
+        model_drip = self.build_everyone_drip()
+        users = list(model_drip.drip.get_queryset()[:5])
+        DripClaim.objects.bulk_create([DripClaim(drip=model_drip, user=user, run_id="dead") for user in users])
+
+        self.age_claims(30)
+        assert 15 == model_drip.drip.send()
+        self.age_claims(61)
+        assert 5 == model_drip.drip.send()
+
+    def test_stale_claims_with_a_pending_retry_are_kept(self, settings):
+        settings.DRIP_RETRY_SETTINGS = {"ENABLED": True, "MAX_ATTEMPTS": 2}
+        drip = self.build_everyone_drip().drip
+
+        with patch("django.core.mail.EmailMessage.send", side_effect=[Exception("SMTP down")] + [1] * 19):
+            assert 19 == drip.send()
+        self.age_claims()
+
+        with patch.object(drip, "prune"):
+            assert 0 == drip.send()
+        assert not DripClaim.objects.filter(run_id=drip.run_id).exists()
+
+    def test_claims_of_deleted_sent_drips_are_taken_over_once_stale(self):
+        model_drip = self.build_everyone_drip()
+        assert 20 == model_drip.drip.send()
+        SentDrip.objects.all().delete()
+
+        assert 0 == model_drip.drip.send()
+        self.age_claims()
+        assert 20 == model_drip.drip.send()
+
+    def test_stale_claims_are_taken_over_once(self):
+        model_drip = self.build_everyone_drip()
+        users = list(model_drip.drip.get_queryset()[:5])
+        DripClaim.objects.bulk_create([DripClaim(drip=model_drip, user=user, run_id="dead") for user in users])
+        self.age_claims()
+        first_run, second_run = model_drip.drip, model_drip.drip
+        user_ids = [user.pk for user in users]
+
+        assert 5 == first_run.take_over_stale_claims(user_ids)
+        assert 0 == second_run.take_over_stale_claims(user_ids)
+
+    def test_users_are_claimed_right_before_delivery(self, settings):
+        settings.DRIP_CLAIM_BATCH_SIZE = 5
+        drip = self.build_everyone_drip().drip
+        claims_on_delivery = []
+
+        def send(message, *args, **kwargs):
+            claims_on_delivery.append(DripClaim.objects.count())
+            return 1
+
+        with patch("django.core.mail.EmailMessage.send", autospec=True, side_effect=send):
+            assert 20 == drip.send()
+
+        assert [5] * 5 + [10] * 5 + [15] * 5 + [20] * 5 == claims_on_delivery
+
+    def test_asend_skips_claimed_users(self):
+        model_drip = self.build_everyone_drip()
+        users = list(model_drip.drip.get_queryset()[:5])
+        DripClaim.objects.bulk_create([DripClaim(drip=model_drip, user=user, run_id="other") for user in users])
+
+        assert 15 == async_to_sync(model_drip.drip.asend)()
+
+    def test_resendable_drips_are_not_claimed(self):
+        model_drip = self.build_everyone_drip()
+        model_drip.can_resend_drip = True
+        model_drip.save()
+
+        assert 20 == model_drip.drip.send()
+        assert 20 == model_drip.drip.send()
+        assert not DripClaim.objects.exists()
+
+    def test_claims_disabled(self, settings):
+        settings.DRIP_CLAIM_SENDS = False
+        drip = self.build_everyone_drip().drip
+
+        assert 20 == drip.send()
+        assert not DripClaim.objects.exists()
+
+    def test_failed_send_releases_the_claim(self):
+        drip = self.build_joined_date_drip().drip
+
+        with patch("django.core.mail.EmailMessage.send", side_effect=[1, Exception("SMTP down")]):
+            assert 1 == drip.send()
+
+        assert 1 == DripClaim.objects.count()
+        assert 1 == drip.drip_model.drip.send()
+
+    def test_failed_send_with_retry_keeps_the_claim(self, settings):
+        settings.DRIP_RETRY_SETTINGS = {"ENABLED": True, "MAX_ATTEMPTS": 2}
+        drip = self.build_joined_date_drip().drip
+
+        with patch("django.core.mail.EmailMessage.send", side_effect=[1, Exception("SMTP down")]):
+            assert 1 == drip.send()
+
+        assert 2 == DripClaim.objects.count()
+        DripRetry.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        with patch("django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=Exception("Timeout")):
+            retry_drips()
+        # the retry is dead, so its user can be claimed again
+        assert 1 == DripClaim.objects.count()
@@ -0,0 +1,241 @@
+import socket
+from typing import Optional
+from unittest.mock import patch
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.core import mail
+from django.core.management import call_command
+
+from drip.delivery import SentDripWriter, ThreadedDelivery
+from drip.models import SentDrip
+from drip.tests.test_drips import SetupDataDripMixin
+from drip.utils import get_user_model
+
+pytestmark = pytest.mark.django_db
+User = get_user_model()
+
+
+class TestSentDripsBatching(SetupDataDripMixin):
+    def setup_method(self, test_method):
+        self.build_user_data()
+
+    @pytest.mark.parametrize(
+        "batch_size, expected_inserts",
+        (
+            (None, 0),  # Default configuration, rows are created one by one
+            (1, 2),  # One bulk insert per sent drip
+            (2, 1),  # Both sent drips are written at once
+            (100, 1),  # Remaining rows are flushed at the end of the run
+        ),
+    )
+    def test_sent_drips_batch_size(self, settings, batch_size: Optional[int], expected_inserts: int):
+        settings.DRIP_SENT_DRIPS_BATCH_SIZE = batch_size
+        drip = self.build_joined_date_drip().drip
+
+        with patch.object(SentDrip.objects, "bulk_create", wraps=SentDrip.objects.bulk_create) as bulk_create:
+            count = drip.send()
+
+        assert 2 == count
+        assert 2 == SentDrip.objects.count()
+        assert expected_inserts == bulk_create.call_count
+
+    def test_sent_drips_batch_only_records_sent_messages(self, settings):
+        settings.DRIP_SENT_DRIPS_BATCH_SIZE = 10
+        drip = self.build_joined_date_drip().drip
+
+        with patch("django.core.mail.EmailMessage.send", side_effect=[1, Exception("SMTP down")]):
+            count = drip.send()
+
+        assert 1 == count
+        assert 1 == SentDrip.objects.count()
+
+    def test_failed_batch_is_not_counted(self, settings, caplog):
+        settings.DRIP_SENT_DRIPS_BATCH_SIZE = 10
+        drip = self.build_joined_date_drip().drip
+
+        with patch.object(SentDrip.objects, "bulk_create", side_effect=Exception("DB down")):
+            count = drip.send()
+
+        assert 0 == count
+        assert 2 == len(mail.outbox)
+        for sent_user in drip.get_queryset():
+            assert (
+                "Failed to send drip {drip} to user {user}: DB down".format(drip=drip.drip_model.id, user=sent_user)
+                in caplog.text
+            )
+
+    def test_writer_without_batch_size_saves_immediately(self):
+        drip = self.build_joined_date_drip().drip
+        writer = SentDripWriter()
+        user = drip.get_queryset().first()
+        writer.add(SentDrip(drip=drip.drip_model, user=user, subject="subject", body="body"))
+
+        assert 1 == writer.count
+        assert 1 == SentDrip.objects.count()
+
+
+class TestSharedConnection(SetupDataDripMixin):
+    def setup_method(self, test_method):
+        self.build_user_data()
+
+    @pytest.mark.parametrize(
+        "shared_connection, chunk_size, expected_connections",
+        (
+            (True, None, 1),  # One connection for the whole drip
+            (True, 1, 2),  # One connection per message
+            (True, 5, 1),  # Both messages fit in one chunk
+            (False, None, 0),  # Default configuration, messages open their own connection
+        ),
+    )
+    def test_shared_connection_chunks(
+        self, settings, shared_connection: bool, chunk_size: Optional[int], expected_connections: int
+    ):
+        settings.DRIP_SHARED_CONNECTION = shared_connection
+        settings.DRIP_SHARED_CONNECTION_CHUNK_SIZE = chunk_size
+        drip = self.build_joined_date_drip().drip
+
+        with patch("drip.delivery.get_connection", wraps=mail.get_connection) as get_connection:
+            count = drip.send()
+
+        assert 2 == count
+        assert 2 == len(mail.outbox)
+        assert 2 == SentDrip.objects.count()
+        assert expected_connections == get_connection.call_count
+
+    def test_shared_connection_tracks_each_message(self, settings):
+        settings.DRIP_SHARED_CONNECTION = True
+        drip = self.build_joined_date_drip().drip
+
+        with patch("django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=[0, 1]):
+            count = drip.send()
+
+        assert 1 == count
+        assert 1 == SentDrip.objects.count()
+
+    def test_shared_connection_is_reopened_after_failure(self, settings):
+        settings.DRIP_SHARED_CONNECTION = True
+        drip = self.build_joined_date_drip().drip
+
+        with patch("drip.delivery.get_connection", wraps=mail.get_connection) as get_connection, patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=[Exception("Broken pipe"), 1]
+        ):
+            count = drip.send()
+
+        assert 1 == count
+        assert 2 == get_connection.call_count
+
+
+class TestThreadedDelivery(SetupDataDripMixin):
+    def setup_method(self, test_method):
+        self.build_user_data()
+
+    def test_threaded_delivery_count(self, settings):
+        settings.DRIP_SEND_WORKERS = 4
+        drip = self.build_everyone_drip().drip
+
+        with patch("drip.delivery.get_connection", wraps=mail.get_connection) as get_connection:
+            count = drip.send()
+
+        assert 20 == count
+        assert 20 == len(mail.outbox)
+        assert 20 == SentDrip.objects.count()
+        assert set(User.objects.values_list("id", flat=True)) == set(SentDrip.objects.values_list("user_id", flat=True))
+        # every worker delivers through its own connection
+        assert 1 <= get_connection.call_count <= 4
+
+    def test_threaded_delivery_failures(self, caplog):
+        drip = self.build_everyone_drip().drip
+
+        with patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=[Exception("SMTP down")] * 5 + [1] * 15,
+        ):
+            count = drip.send(workers=3)
+
+        assert 15 == count
+        assert 15 == SentDrip.objects.count()
+        assert 5 == caplog.text.count("Failed to send drip")
+
+    def test_send_drips_command_workers(self):
+        self.build_everyone_drip(enabled=True)
+
+        with patch("drip.drips.ThreadedDelivery", wraps=ThreadedDelivery) as threaded_delivery:
+            call_command("send_drips", workers=2)
+
+        assert 1 == threaded_delivery.call_count
+        assert 20 == SentDrip.objects.count()
+
+
+class TestAsyncDelivery(SetupDataDripMixin):
+    def setup_method(self, test_method):
+        self.build_user_data()
+
+    def test_arun(self):
+        model_drip = self.build_everyone_drip(enabled=True)
+
+        count = async_to_sync(model_drip.drip.arun)(max_in_flight=3)
+
+        assert 20 == count
+        assert 20 == len(mail.outbox)
+        assert 20 == SentDrip.objects.count()
+
+    def test_arun_disabled_drip(self):
+        model_drip = self.build_everyone_drip()
+
+        assert async_to_sync(model_drip.drip.arun)() is None
+        assert 0 == SentDrip.objects.count()
+
+    def test_asend_failures(self, caplog):
+        drip = self.build_everyone_drip().drip
+
+        with patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=[Exception("SMTP down")] * 4 + [1] * 16,
+        ):
+            count = async_to_sync(drip.asend)()
+
+        assert 16 == count
+        assert 16 == SentDrip.objects.count()
+        assert 4 == caplog.text.count("Failed to send drip")
+
+    def test_asend_smtp_client(self, settings):
+        controller_module = pytest.importorskip("aiosmtpd.controller")
+        pytest.importorskip("aiosmtplib")
+
+        class Handler:
+            def __init__(self):
+                self.envelopes = []
+
+            async def handle_DATA(self, server, session, envelope):
+                self.envelopes.append(envelope)
+                return "250 OK"
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        handler = Handler()
+        controller = controller_module.Controller(handler, hostname="127.0.0.1", port=port)
+        controller.start()
+        settings.EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+        settings.EMAIL_HOST = "127.0.0.1"
+        settings.EMAIL_PORT = port
+        settings.EMAIL_USE_TLS = False
+        drip = self.build_everyone_drip().drip
+        try:
+            count = async_to_sync(drip.asend)(max_in_flight=4)
+        finally:
+            controller.stop()
+
+        assert 20 == count
+        assert 20 == len(handler.envelopes)
+        assert {user.email for user in User.objects.all()} == {
+            recipient for envelope in handler.envelopes for recipient in envelope.rcpt_tos
+        }
+
+    def test_send_drips_command_async(self):
+        self.build_everyone_drip(enabled=True)
+
+        call_command("send_drips", use_async=True)
+
+        assert 20 == SentDrip.objects.count()
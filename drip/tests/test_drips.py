@@ -1,4 +1,6 @@
+from concurrent.futures import Executor, Future
 from datetime import timedelta
+from io import StringIO
 from typing import Any, Dict, Optional
 from unittest.mock import patch
 
@@ -6,8 +8,11 @@ import pytest
 from django.conf import settings
 from django.contrib.admin.sites import AdminSite
 from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
 from django.test import TestCase
 from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
 from django.urls import resolve, reverse
 from django.utils import timezone
 
@@ -15,6 +20,7 @@ from credits.models import Profile
 from drip.admin import DripAdmin, DripForm
 from drip.drips import DEFAULT_DRIP_MESSAGE_CLASS, DripBase, configured_message_classes, message_class_for
 from drip.models import Campaign, Drip, QuerySetRule, SentDrip, UserUnsubscribe
+from drip.processes import run_drip
 from drip.scheduler.cron_scheduler import cron_send_drips
 from drip.utils import get_user_model, unicode
 
@@ -98,6 +104,21 @@ class SetupDataDripMixin:
         )
         return model_drip
 
+    def build_everyone_drip(self, build_campaign: bool = False, enabled: bool = False):
+        """Builds the drip of ``build_joined_date_drip`` with a single rule matching every user."""
+        model_drip = self.build_joined_date_drip(build_campaign=build_campaign)
+        model_drip.queryset_rules.all().delete()
+        QuerySetRule.objects.create(
+            drip=model_drip,
+            field_name="email",
+            lookup_type="endswith",
+            field_value="@test.com",
+        )
+        if enabled:
+            model_drip.enabled = True
+            model_drip.save()
+        return model_drip
+
 
 class TestCaseDrips(SetupDataDripMixin):
     def setup_method(self, test_method):
@@ -290,6 +311,31 @@ class TestCaseDrips(SetupDataDripMixin):
         drip.prune()
         assert some_user not in drip.get_queryset()
 
+    @pytest.mark.parametrize("chunk_size, expected_chunk_queries", ((3, 7), (4, 6), (100, 1)))
+    def test_send_streams_audience_in_chunks(self, settings, chunk_size: int, expected_chunk_queries: int):
+        settings.DRIP_AUDIENCE_CHUNK_SIZE = chunk_size
+        model_drip = Drip.objects.create(
+            name="Everyone",
+            subject_template="HELLO {{ user.username }}",
+            body_html_template="KETTEHS ROCK!",
+        )
+        QuerySetRule.objects.create(
+            drip=model_drip,
+            field_name="profile__user__groups__count",
+            lookup_type="exact",
+            field_value="0",
+        )
+        drip = model_drip.drip
+
+        with CaptureQueriesContext(connection) as queries:
+            assert 20 == drip.send()
+
+        chunk_queries = [query for query in queries if "LIMIT {}".format(chunk_size) in query["sql"]]
+        assert expected_chunk_queries == len(chunk_queries)
+        # users were never cached on the queryset
+        assert drip.get_queryset()._result_cache is None
+        assert set(User.objects.values_list("id", flat=True)) == set(SentDrip.objects.values_list("user_id", flat=True))
+
     def test_custom_short_term_drip(self):
         model_drip = self.build_joined_date_drip(shift_one=3, shift_two=4)
         drip = model_drip.drip
@@ -777,6 +823,51 @@ class TestSendDripsCommand(SetupDataDripMixin):
         assert drip_count_queryset == drip.get_queryset().count()
 
 
+class InlineExecutor(Executor):
+    """Runs submitted calls right away, standing in for the process pool."""
+
+    def submit(self, fn, *args, **kwargs):
+        future: Future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class TestSendDripsCommandProcesses(SetupDataDripMixin):
+    def setup_method(self, test_method):
+        self.build_user_data()
+        self.model_drip = self.build_joined_date_drip()
+        self.model_drip.enabled = True
+        self.model_drip.save()
+
+    @patch("drip.management.commands.send_drips.Command.get_executor", return_value=InlineExecutor())
+    def test_send_drips_command_processes(self, get_executor):
+        out = StringIO()
+
+        call_command("send_drips", processes=2, stdout=out)
+
+        get_executor.assert_called_once_with(2)
+        assert 2 == SentDrip.objects.count()
+        assert "Drip A Custom Week Ago ({id}): 2 sent".format(id=self.model_drip.id) in out.getvalue()
+        assert "Total: 2 sent" in out.getvalue()
+
+    @patch("drip.management.commands.send_drips.Command.get_executor", return_value=InlineExecutor())
+    def test_send_drips_command_processes_crash(self, get_executor):
+        err = StringIO()
+
+        with patch("drip.drips.DripBase.run", side_effect=Exception("Worker crashed")):
+            with pytest.raises(CommandError):
+                call_command("send_drips", processes=2, stdout=StringIO(), stderr=err)
+
+        assert "Worker crashed" in err.getvalue()
+
+    def test_run_drip_in_process(self):
+        assert 2 == run_drip(self.model_drip.id)
+        assert 2 == SentDrip.objects.count()
+
+
 class TestFormAdminDrip:
     @pytest.mark.parametrize(
         "drip_unsubscribe_users, has_changed_help_text",
@@ -0,0 +1,158 @@
+from unittest.mock import patch
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.core import mail
+from django.core.management import call_command
+from django.utils import timezone
+
+from drip.campaigns.models import UserUnsubscribeCampaign
+from drip.exclusions import IdBitmap, SharedExclusions, SortedIdSet, build_id_set, load_id_set
+from drip.models import SentDrip, UserUnsubscribe, UserUnsubscribeDrip
+from drip.tests.test_drips import SetupDataDripMixin, get_user_model_mock
+from drip.utils import get_user_model
+
+pytestmark = pytest.mark.django_db
+
+User = get_user_model()
+
+
+class TestIdSets:
+    def test_dense_ids_are_a_bitmap(self):
+        id_set = build_id_set(range(1, 1000, 2), range(500, 510))
+
+        assert isinstance(id_set, IdBitmap)
+        assert 505 == len(id_set)
+        assert {pk for pk in range(0, 1100) if pk in id_set} == set(range(1, 1000, 2)) | set(range(500, 510))
+
+    def test_sparse_ids_are_a_sorted_array(self):
+        ids = [3, 10**6, 10**9]
+
+        id_set = build_id_set(ids)
+
+        assert isinstance(id_set, SortedIdSet)
+        assert [True, True, True, False, False] == [pk in id_set for pk in ids + [4, 10**9 + 1]]
+
+    def test_unsorted_and_repeated_ids(self):
+        id_set = build_id_set([5, 1, 5, 10**7, 2])
+
+        assert [1, 2, 5, 10**7] == list(id_set.ids)
+
+    def test_empty_ids(self):
+        id_set = build_id_set([])
+
+        assert 0 == len(id_set)
+        assert 1 not in id_set
+
+    def test_non_integer_ids(self):
+        with patch("drip.exclusions.get_user_model", get_user_model_mock):
+            id_set = build_id_set(["b", "a"], ["c", "a"])
+
+        assert isinstance(id_set, SortedIdSet)
+        assert ["a", "b", "c"] == id_set.ids
+        assert "b" in id_set
+        assert "d" not in id_set
+
+
+class TestInMemoryExclusions(SetupDataDripMixin):
+    @pytest.fixture(autouse=True)
+    def in_memory_exclusions(self, settings):
+        settings.DRIP_UNSUBSCRIBE_USERS = True
+        settings.DRIP_IN_MEMORY_EXCLUSIONS = True
+
+    def setup_method(self, test_method):
+        self.build_user_data()
+        self.model_drip = self.build_everyone_drip(build_campaign=True, enabled=True)
+        self.users = list(User.objects.order_by("pk"))
+        SentDrip.objects.create(drip=self.model_drip, user=self.users[0], subject="", body="")
+        UserUnsubscribeDrip.objects.create(drip=self.model_drip, user=self.users[1])
+        UserUnsubscribeCampaign.objects.create(campaign=self.model_drip.campaign, user=self.users[2])
+        UserUnsubscribe.objects.create(user=self.users[3])
+
+    def get_recipients(self):
+        return {message.to[0] for message in mail.outbox}
+
+    def test_prune_for_send_leaves_exclusions_to_the_sets(self):
+        drip = self.model_drip.drip
+
+        drip.prune_for_send()
+
+        assert 1 == str(drip.get_queryset().query).count("NOT EXISTS")
+        assert 20 == drip.get_queryset().count()
+
+    def test_prune_excludes_every_user_in_the_database(self):
+        drip = self.model_drip.drip
+
+        drip.prune()
+
+        assert [user.pk for user in self.users[4:]] == list(
+            drip.get_queryset().order_by("pk").values_list("pk", flat=True)
+        )
+        assert [(self.users[4].pk, self.users[-1].pk)] == drip.get_pk_ranges(20)
+
+    def test_excluded_users_are_not_sent(self):
+        assert 16 == self.model_drip.drip.run()
+
+        assert {user.email for user in self.users[4:]} == self.get_recipients()
+
+    def test_same_audience_as_the_database(self, settings):
+        settings.DRIP_CLAIM_SENDS = False
+        in_memory = self.model_drip.drip
+        in_memory.prune_for_send()
+        settings.DRIP_IN_MEMORY_EXCLUSIONS = False
+        database = self.model_drip.drip
+        database.prune()
+
+        pruned = [user.pk for user in database.iterate_audience()]
+        settings.DRIP_IN_MEMORY_EXCLUSIONS = True
+        assert pruned == [user.pk for user in in_memory.iterate_audience()]
+
+    def test_async_run(self, settings):
+        settings.DRIP_CLAIM_SENDS = False
+
+        assert 16 == async_to_sync(self.model_drip.drip.arun)()
+
+        assert {user.email for user in self.users[4:]} == self.get_recipients()
+
+    def test_resendable_drips_do_not_load_sent_users(self):
+        self.model_drip.can_resend_drip = True
+        self.model_drip.save()
+
+        assert 17 == self.model_drip.drip.run()
+
+    def test_sets_are_restricted_to_the_pk_range(self):
+        drip = self.model_drip.drip
+        drip.prune_for_send()
+        drip.limit_to_pk_range(self.users[1].pk, self.users[5].pk)
+
+        exclusion_sets = drip.get_exclusion_sets()
+
+        assert [2, 1] == [len(exclusion_set) for exclusion_set in exclusion_sets]
+        assert [user.pk for user in self.users[4:6]] == [user.pk for user in drip.iterate_audience()]
+
+    def test_send_drips_loads_the_unsubscribed_users_once(self):
+        self.model_drip.name = "first"
+        self.model_drip.save()
+        self.build_everyone_drip(build_campaign=True, enabled=True)
+
+        with patch("drip.exclusions.load_id_set", wraps=load_id_set) as load:
+            call_command("send_drips")
+
+        general_loads = [call for call in load.call_args_list if call.args[0].model is UserUnsubscribe]
+        assert 1 == len(general_loads)
+        assert 16 + 19 == len(mail.outbox)
+
+    def test_shared_exclusions(self):
+        shared_exclusions = SharedExclusions()
+
+        unsubscribed = shared_exclusions.get_unsubscribed_users()
+        UserUnsubscribe.objects.create(user=self.users[4])
+
+        assert unsubscribed is shared_exclusions.get_unsubscribed_users()
+        assert self.users[3].pk in unsubscribed
+        assert self.users[4].pk not in unsubscribed
+
+    def test_sent_drips_of_the_run_are_not_loaded(self):
+        SentDrip.objects.filter(user=self.users[0]).update(date=timezone.now() + timezone.timedelta(days=1))
+
+        assert 17 == self.model_drip.drip.run()
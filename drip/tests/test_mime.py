@@ -0,0 +1,109 @@
+from email.generator import Generator
+from unittest.mock import patch
+
+import pytest
+from django.core import mail
+from django.core.mail import EmailMultiAlternatives
+
+from drip.mime import DripEmail, MessageSkeleton
+from drip.tests.test_drips import SetupDataDripMixin
+
+pytestmark = pytest.mark.django_db
+
+DATE = "Sun, 18 Oct 2026 10:00:00 -0000"
+MESSAGE_ID = "<fixed@drips>"
+
+
+def build_emails(subject, plain, from_email, to, html=None, skeleton=None):
+    emails = []
+    for email in [
+        EmailMultiAlternatives(subject, plain, from_email, [to]),
+        DripEmail(subject, plain, from_email, [to]),
+    ]:
+        if html is not None:
+            email.attach_alternative(html, "text/html")
+        emails.append(email)
+    emails[1].skeleton = skeleton or MessageSkeleton(emails[1].from_email)
+    return emails
+
+
+def as_bytes(email):
+    with patch("django.core.mail.message.formatdate", return_value=DATE), patch(
+        "drip.mime.formatdate", return_value=DATE
+    ), patch("django.core.mail.message.make_msgid", return_value=MESSAGE_ID), patch(
+        "drip.mime.make_msgid", return_value=MESSAGE_ID
+    ), patch.object(
+        Generator, "_make_boundary", return_value="==boundary=="
+    ):
+        return email.message().as_bytes()
+
+
+class TestMessageSkeleton:
+    @pytest.mark.parametrize(
+        "subject, plain, html, from_email",
+        [
+            ("Hi", "KETTEHS ROCK!", None, "drips@example.com"),
+            ("Hi", "KETTEHS ROCK!", "<p>KETTEHS ROCK!</p>", "Drips <drips@example.com>"),
+            ("¡Hola Señor!", "Olé", "<p>Olé</p>", "Dríps <drips@example.com>"),
+            ("Long", "x" * 1200, "<p>{x}</p>".format(x="y" * 1200), None),
+        ],
+    )
+    def test_builds_the_same_message_as_django(self, subject, plain, html, from_email):
+        django_email, drip_email = build_emails(subject, plain, from_email, "user@example.com", html)
+
+        assert as_bytes(django_email) == as_bytes(drip_email)
+
+    def test_shared_bodies_are_encoded_once(self):
+        skeleton = MessageSkeleton("drips@example.com")
+        first = build_emails("Hi", "Rock", "drips@example.com", "first@example.com", "<p>Rock</p>", skeleton)[1]
+        second = build_emails("Hi", "Rock", "drips@example.com", "second@example.com", "<p>Rock</p>", skeleton)[1]
+
+        first_parts, second_parts = first.message().get_payload(), second.message().get_payload()
+
+        assert first_parts[0] is second_parts[0]
+        assert first_parts[1] is second_parts[1]
+        assert b"To: second@example.com" in as_bytes(second)
+
+    def test_parts_are_bounded(self):
+        skeleton = MessageSkeleton("drips@example.com", max_parts=2)
+
+        for text in ["first", "second", "third"]:
+            skeleton.get_text_part(text, "plain")
+
+        assert 2 == len(skeleton._parts)
+
+    def test_date_header_is_built_once_per_second(self):
+        skeleton = MessageSkeleton("drips@example.com")
+
+        with patch("drip.mime.time.time", side_effect=[1000.1, 1000.9, 1001.2]), patch(
+            "drip.mime.formatdate", side_effect=["first", "second"]
+        ) as formatdate:
+            assert ["first", "first", "second"] == [skeleton.get_date_header() for _ in range(3)]
+
+        assert 2 == formatdate.call_count
+
+    def test_other_messages_are_built_by_django(self):
+        django_email, drip_email = build_emails("Hi", "Rock", "drips@example.com", "user@example.com", "<p>Rock</p>")
+        for email in [django_email, drip_email]:
+            email.cc = ["cc@example.com"]
+            email.attach("report.csv", "a,b", "text/csv")
+
+        with patch.object(MessageSkeleton, "build") as build:
+            assert as_bytes(django_email) == as_bytes(drip_email)
+
+        build.assert_not_called()
+
+
+class TestDripMessageSkeleton(SetupDataDripMixin):
+    def setup_method(self, test_method):
+        self.build_user_data()
+        self.model_drip = self.build_everyone_drip()
+        self.model_drip.body_html_template = "<p>KETTEHS ROCK!</p>"
+        self.model_drip.save()
+
+    def test_messages_share_the_skeleton(self):
+        assert 20 == self.model_drip.drip.send()
+
+        skeletons = {message.skeleton for message in mail.outbox}
+        assert 1 == len(skeletons)
+        assert {message.to[0] for message in mail.outbox} == {message.message()["To"] for message in mail.outbox}
@@ -0,0 +1,186 @@
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.core import mail
+from django.core.management import call_command
+from django.utils import timezone
+
+from drip.delivery import SharedConnection
+from drip.models import RETRY_DEAD, RETRY_PENDING, DripClaim, DripRetry, OutboxMessage, SentDrip
+from drip.outbox import OutboxDrainer, OutboxWriter, drain_outbox
+from drip.retries import RetryPolicy
+from drip.tests.test_drips import SetupDataDripMixin
+
+pytestmark = pytest.mark.django_db
+
+
+class TestOutbox(SetupDataDripMixin):
+    def setup_method(self, test_method):
+        self.build_user_data()
+
+    @pytest.fixture(autouse=True)
+    def outbox_settings(self, settings):
+        settings.DRIP_OUTBOX_SETTINGS = {"ENABLED": True, "BATCH_SIZE": 3}
+
+    def make_due(self):
+        OutboxMessage.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+
+    def test_send_renders_into_the_outbox(self):
+        drip = self.build_everyone_drip().drip
+
+        count = drip.send()
+
+        assert 20 == count
+        assert 0 == len(mail.outbox)
+        assert 20 == SentDrip.objects.count()
+        assert 20 == OutboxMessage.objects.filter(status=RETRY_PENDING).count()
+        outbox_message = OutboxMessage.objects.select_related("sent_drip__user").first()
+        assert "HELLO {username}".format(username=outbox_message.sent_drip.user.username) == (
+            outbox_message.sent_drip.subject
+        )
+        assert "KETTEHS ROCK!" == outbox_message.plain
+
+    def test_asend_renders_into_the_outbox(self):
+        drip = self.build_everyone_drip().drip
+
+        count = async_to_sync(drip.asend)()
+
+        assert 20 == count
+        assert 0 == len(mail.outbox)
+        assert 20 == OutboxMessage.objects.count()
+
+    def test_reserved_users_are_pruned(self):
+        model_drip = self.build_everyone_drip(enabled=True)
+        model_drip.drip.run()
+
+        assert 0 == model_drip.drip.run()
+        assert 20 == OutboxMessage.objects.count()
+
+    def test_failed_batch_is_not_enqueued(self, caplog):
+        drip = self.build_everyone_drip().drip
+
+        with patch.object(OutboxMessage.objects, "bulk_create", side_effect=[None, Exception("DB down")] + [None] * 5):
+            count = drip.send()
+
+        assert 17 == count
+        assert 17 == SentDrip.objects.count()
+        assert "Failed to enqueue 3 messages" in caplog.text
+
+    def test_writer_saves_one_by_one_without_bulk_returning(self):
+        drip = self.build_everyone_drip().drip
+        writer = OutboxWriter(batch_size=10)
+        for user in drip.get_queryset()[:2]:
+            writer.add(SentDrip(drip=drip.drip_model, user=user, subject="subject", body="<p>body</p>"), "body")
+
+        with patch.object(SentDrip.objects, "bulk_create") as bulk_create:
+            writer.flush()
+
+        assert not bulk_create.called
+        assert 2 == writer.count
+        assert 2 == OutboxMessage.objects.count()
+
+    def test_drain_delivers_in_batches(self):
+        self.build_everyone_drip().drip.send()
+
+        with patch.object(OutboxDrainer, "lease_batch", autospec=True, side_effect=OutboxDrainer.lease_batch) as lease:
+            count = drain_outbox()
+
+        assert 20 == count
+        assert 20 == len(mail.outbox)
+        assert not OutboxMessage.objects.exists()
+        assert 20 == SentDrip.objects.count()
+        # 7 batches of up to 3 messages and a last empty lease
+        assert 8 == lease.call_count
+        message = mail.outbox[0]
+        assert message.subject.startswith("HELLO ")
+        assert "KETTEHS ROCK!" == message.body
+
+    def test_drain_limit(self):
+        self.build_everyone_drip().drip.send()
+
+        assert 5 == drain_outbox(limit=5)
+        assert 15 == OutboxMessage.objects.count()
+
+    def test_leased_messages_are_skipped(self):
+        self.build_everyone_drip().drip.send()
+        OutboxDrainer(batch_size=10).lease_batch(10, timezone.now())
+
+        assert 10 == drain_outbox()
+        assert 10 == OutboxMessage.objects.count()
+
+    def test_expired_lease_is_delivered(self):
+        self.build_everyone_drip().drip.send()
+        OutboxDrainer(batch_size=20).lease_batch(20, timezone.now())
+        self.make_due()
+
+        assert 20 == drain_outbox()
+
+    def test_failures_back_off_until_dead(self, caplog):
+        self.build_joined_date_drip().drip.send()
+        drainer = OutboxDrainer(retry_policy=RetryPolicy(max_attempts=2))
+
+        with patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=[Exception("Timeout"), 1, Exception("Timeout")],
+        ):
+            assert 1 == drainer.drain()
+            failed = OutboxMessage.objects.get()
+            assert RETRY_PENDING == failed.status
+            assert 1 == failed.attempts
+            assert failed.next_attempt_at > timezone.now() + timedelta(seconds=29)
+            self.make_due()
+            assert 0 == drainer.drain()
+
+        assert not OutboxMessage.objects.exists()
+        dead = DripRetry.objects.get()
+        assert RETRY_DEAD == dead.status
+        assert 2 == dead.attempts
+        assert "Timeout" == dead.last_error
+        assert "Giving up on drip" in caplog.text
+        # the dead message releases the SentDrip that reserved it
+        assert 1 == SentDrip.objects.count()
+        assert not SentDrip.objects.filter(user_id=dead.user_id).exists()
+        assert not DripClaim.objects.filter(user_id=dead.user_id).exists()
+        assert 0 == drainer.drain()
+
+    def test_lost_lease_stops_the_batch(self, caplog):
+        self.build_everyone_drip().drip.send()
+        drainer = OutboxDrainer(batch_size=5)
+        leased = drainer.lease_batch(5, timezone.now())
+
+        def send_messages(messages):
+            # another drainer leases the messages again while the first one is sent
+            OutboxMessage.objects.filter(lease_id=leased[0].lease_id).update(lease_id="other")
+            return 1
+
+        with patch("django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=send_messages) as send:
+            assert 1 == drainer.deliver_batch(leased, SharedConnection(), None)
+
+        assert 1 == send.call_count
+        assert "was lost" in caplog.text
+        # the rest of the batch is left to the drainer holding the lease
+        assert 5 == OutboxMessage.objects.filter(lease_id="other").count()
+
+    def test_expired_lease_stops_the_batch(self, caplog):
+        self.build_everyone_drip().drip.send()
+        drainer = OutboxDrainer(batch_size=5)
+        leased = drainer.lease_batch(5, timezone.now())
+        expired = timezone.now() + timedelta(seconds=drainer.lease)
+
+        with patch("drip.outbox.conditional_now", side_effect=[timezone.now(), expired]):
+            assert 1 == drainer.deliver_batch(leased, SharedConnection(), None)
+
+        assert 1 == len(mail.outbox)
+        assert "expired" in caplog.text
+        assert 19 == OutboxMessage.objects.count()
+
+    def test_drain_drip_outbox_command(self):
+        self.build_everyone_drip().drip.send()
+        out = StringIO()
+
+        call_command("drain_drip_outbox", stdout=out)
+
+        assert "Outbox: 20 sent" in out.getvalue()
@@ -0,0 +1,82 @@
+from unittest.mock import patch
+
+import pytest
+from django.core import mail
+
+from drip.drips import DripMessage
+from drip.plaintext import PlainText, get_plain_text, html_to_text
+from drip.tests.test_drips import SetupDataDripMixin
+
+pytestmark = pytest.mark.django_db
+
+
+class TestHtmlToText:
+    @pytest.mark.parametrize(
+        "html, text",
+        [
+            ("<p>KETTEHS ROCK!</p>", "KETTEHS ROCK!"),
+            (
+                "<h1>Hi  Jane</h1>\n<p>Line one<br>line\n   two</p><div>end</div>",
+                "Hi Jane\n\nLine one\nline two\n\nend",
+            ),
+            ("<ul><li>First</li>\n<li>Second</li></ul>", "- First\n- Second"),
+            ("<table><tr><td>A</td><td>B</td></tr><tr><td>C</td></tr></table>", "A B\nC"),
+            ('<a href="https://drips.com/u/">Unsubscribe</a>', "Unsubscribe (https://drips.com/u/)"),
+            ('<a href="https://drips.com">https://drips.com</a> <a href="#top">Top</a>', "https://drips.com Top"),
+            ('<a href="mailto:hi@drips.com">hi@drips.com</a>', "hi@drips.com"),
+            ('<img src="logo.png" alt="Drips"> &amp; &lt;friends&gt;', "Drips & <friends>"),
+            ("<head><title>News</title><style>p {}</style></head><script>run()</script>Body", "Body"),
+            ("<p>Code:</p><pre>  indented\n    more</pre>", "Code:\n\n  indented\n    more"),
+            ("<!-- comment -->Hi", "Hi"),
+        ],
+    )
+    def test_converts_html(self, html, text):
+        assert PlainText(text, True) == html_to_text(html)
+
+    @pytest.mark.parametrize("body", ["KETTEHS ROCK!", "1 < 2 &amp; 3", "  spaced\n\ntext  "])
+    def test_text_without_markup_is_kept(self, body):
+        assert PlainText(body, False) == html_to_text(body)
+
+    def test_bodies_are_converted_once(self):
+        get_plain_text.cache_clear()
+
+        with patch("drip.plaintext.html_to_text", wraps=html_to_text) as convert:
+            for _ in range(3):
+                assert "Hi" == get_plain_text("<p>Hi</p>").text
+
+        assert 1 == convert.call_count
+
+
+class TestMessagePlainText(SetupDataDripMixin):
+    def setup_method(self, test_method):
+        self.build_user_data()
+        self.model_drip = self.build_everyone_drip()
+
+    def test_html_body_is_attached(self):
+        self.model_drip.body_html_template = "<p>Hi {{ user.username }}</p>"
+        self.model_drip.save()
+
+        assert 20 == self.model_drip.drip.send()
+
+        message = mail.outbox[0]
+        assert message.body == message.alternatives[0][0][len("<p>") : -len("</p>")]
+        assert "text/html" == message.alternatives[0][1]
+
+    def test_plain_body_is_not_attached(self):
+        assert 20 == self.model_drip.drip.send()
+
+        assert {"KETTEHS ROCK!"} == {message.body for message in mail.outbox}
+        assert not any(message.alternatives for message in mail.outbox)
+
+    def test_custom_plain_text(self):
+        class ShortPlainMessage(DripMessage):
+            @property
+            def plain(self):
+                self._plain = "Hi"
+                return self._plain
+
+        drip = self.model_drip.drip
+        message = ShortPlainMessage(drip, drip.get_queryset().first())
+
+        assert message.has_html
+        assert "KETTEHS ROCK!" == message.message.alternatives[0][0]
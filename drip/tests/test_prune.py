@@ -0,0 +1,110 @@
+import pytest
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from drip.campaigns.models import UserUnsubscribeCampaign
+from drip.drips import DripBase
+from drip.models import RETRY_PENDING, DripRetry, SentDrip, UserUnsubscribe, UserUnsubscribeDrip
+from drip.tests.test_drips import SetupDataDripMixin
+from drip.utils import get_user_model
+
+pytestmark = pytest.mark.django_db
+
+User = get_user_model()
+
+
+class TestPrune(SetupDataDripMixin):
+    @pytest.fixture(autouse=True)
+    def unsubscribe_users(self, settings):
+        settings.DRIP_UNSUBSCRIBE_USERS = True
+
+    def setup_method(self, test_method):
+        self.build_user_data()
+        self.model_drip = self.build_everyone_drip(build_campaign=True)
+        self.users = list(User.objects.order_by("pk"))
+
+    def build_exclusions(self):
+        """Excludes one different user with every exclusion of prune."""
+        SentDrip.objects.create(drip=self.model_drip, user=self.users[0], subject="", body="")
+        DripRetry.objects.create(
+            drip=self.model_drip,
+            user=self.users[1],
+            subject="",
+            body="",
+            plain="",
+            next_attempt_at=timezone.now(),
+            status=RETRY_PENDING,
+        )
+        UserUnsubscribeDrip.objects.create(drip=self.model_drip, user=self.users[2])
+        UserUnsubscribeCampaign.objects.create(campaign=self.model_drip.campaign, user=self.users[3])
+        UserUnsubscribe.objects.create(user=self.users[4])
+
+    def test_prune_excludes_every_pruned_user(self):
+        self.build_exclusions()
+        drip = self.model_drip.drip
+
+        drip.prune()
+
+        assert set(user.pk for user in self.users[5:]) == set(drip.get_queryset().values_list("pk", flat=True))
+
+    def test_prune_matches_the_exclude_methods(self):
+        self.build_exclusions()
+        pruned = self.model_drip.drip
+        pruned.prune()
+        excluded = self.model_drip.drip
+        excluded.exclude_sent_drips_users()
+        excluded.exclude_pending_retries_users()
+        excluded.exclude_unsubcribed_users_drip()
+        excluded.exclude_unsubcribed_users_campaign()
+        excluded.exclude_unsubcribed_users_general()
+
+        assert list(excluded.get_queryset().order_by("pk")) == list(pruned.get_queryset().order_by("pk"))
+
+    @pytest.mark.parametrize("in_memory", [False, True])
+    def test_prune_calls_overridden_exclude_methods(self, settings, in_memory):
+        settings.DRIP_IN_MEMORY_EXCLUSIONS = in_memory
+        self.build_exclusions()
+        excluded_pk = self.users[5].pk
+
+        class CustomExclusionDrip(DripBase):
+            def exclude_unsubcribed_users_general(self):
+                # keeps the users unsubscribed from all emails, excludes another one
+                self.exclude(Exists(User.objects.filter(pk=excluded_pk, id=OuterRef("pk"))))
+
+        drip = CustomExclusionDrip(drip_model=self.model_drip, name=self.model_drip.name)
+
+        drip.prune_for_send()
+
+        expected = {self.users[4].pk} | set(user.pk for user in self.users[6:])
+        assert expected == set(user.pk for user in drip.iterate_audience())
+
+    def test_resendable_drips_keep_users_with_sent_drips(self):
+        self.build_exclusions()
+        self.model_drip.can_resend_drip = True
+        self.model_drip.save()
+        drip = self.model_drip.drip
+
+        drip.prune()
+
+        assert drip.get_queryset().filter(pk=self.users[0].pk).exists()
+
+    def test_audience_query_is_not_nested(self):
+        drip = self.model_drip.drip
+
+        drip.prune()
+
+        sql = str(drip.get_queryset().query)
+        assert 1 == sql.count('FROM "{table}"'.format(table=User._meta.db_table))
+        assert 5 == sql.count("NOT EXISTS")
+        assert " IN (SELECT" not in sql
+
+    def test_explain_scans_the_audience_once(self):
+        drip = self.model_drip.drip
+
+        drip.prune()
+
+        plan = drip.get_queryset().explain()
+        user_table_lines = [line for line in plan.splitlines() if User._meta.db_table in line]
+        assert 1 == len(user_table_lines)
+        for table in ["drip_sentdrip", "drip_dripretry", "drip_userunsubscribedrip", "drip_userunsubscribe"]:
+            assert "SCAN {table}".format(table=table) not in plan
@@ -0,0 +1,99 @@
+from unittest.mock import patch
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+
+from drip.models import SentDrip
+from drip.ratelimit import RateLimiter, TokenBucket
+from drip.tests.test_drips import SetupDataDripMixin
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def frozen_clock():
+    """Buckets are refilled with the wall clock, keep it still so waits are exact."""
+    cache.clear()
+    with patch("drip.ratelimit.time.time", return_value=1000.0):
+        yield
+
+
+class TestTokenBucket:
+    def test_reserve_paces_tokens(self):
+        bucket = TokenBucket("test:bucket", rate=10, capacity=1)
+
+        waits = [bucket.reserve() for _ in range(3)]
+
+        assert 0 == waits[0]
+        assert waits[1:] == pytest.approx([0.1, 0.2])
+
+    def test_reserve_allows_bursts(self):
+        bucket = TokenBucket("test:bucket", rate=10, capacity=3)
+
+        waits = [bucket.reserve() for _ in range(4)]
+
+        assert [0, 0, 0] == waits[:3]
+        assert waits[3] == pytest.approx(0.1)
+
+    def test_buckets_are_shared_through_the_cache(self):
+        TokenBucket("test:bucket", rate=1, capacity=1).reserve()
+
+        assert 1 == TokenBucket("test:bucket", rate=1, capacity=1).reserve()
+
+
+class TestRateLimiter:
+    def test_from_settings_without_rates(self, settings):
+        settings.DRIP_RATE_LIMIT_SETTINGS = {}
+
+        assert RateLimiter.from_settings() is None
+
+    def test_from_settings(self, settings):
+        settings.DRIP_RATE_LIMIT_SETTINGS = {"GLOBAL": 50, "PER_DRIP": 10, "BURST": 5}
+
+        rate_limiter = RateLimiter.from_settings()
+
+        assert rate_limiter is not None
+        assert 2 == len(rate_limiter.get_buckets(1, "user@example.com"))
+
+    def test_per_domain_buckets(self):
+        rate_limiter = RateLimiter(per_domain={"slow.com": 1, "*": 100}, burst=1)
+
+        assert 0 == rate_limiter.reserve(1, "first@slow.com")
+        assert 0 == rate_limiter.reserve(1, "first@fast.com")
+        assert rate_limiter.reserve(1, "second@fast.com") == pytest.approx(0.01)
+        assert rate_limiter.reserve(1, "second@SLOW.com") == pytest.approx(1)
+        assert rate_limiter.waited == pytest.approx(1.01)
+
+    def test_unlisted_domains_are_not_limited(self):
+        rate_limiter = RateLimiter(per_domain={"slow.com": 1})
+
+        assert [] == rate_limiter.get_buckets(1, "user@fast.com")
+
+
+class TestRateLimitedSend(SetupDataDripMixin):
+    def setup_method(self, test_method):
+        self.build_user_data()
+
+    @pytest.mark.parametrize("workers", (1, 2))
+    def test_send_waits_for_tokens(self, settings, caplog, workers: int):
+        settings.DRIP_RATE_LIMIT_SETTINGS = {"PER_DRIP": 10, "BURST": 1}
+        drip = self.build_joined_date_drip().drip
+
+        with caplog.at_level("INFO"), patch("drip.ratelimit.time.sleep") as sleep:
+            count = drip.send(workers=workers)
+
+        assert 2 == count
+        assert 2 == SentDrip.objects.count()
+        assert 1 == sleep.call_count
+        assert drip.rate_limiter.waited == pytest.approx(0.1)
+        assert "waited 0.100 seconds" in caplog.text
+
+    def test_asend_waits_for_tokens(self, settings):
+        settings.DRIP_RATE_LIMIT_SETTINGS = {"GLOBAL": 20, "BURST": 1}
+        drip = self.build_joined_date_drip().drip
+
+        count = async_to_sync(drip.asend)()
+
+        assert 2 == count
+        assert drip.rate_limiter.waited == pytest.approx(0.05)
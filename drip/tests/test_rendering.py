@@ -0,0 +1,336 @@
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+from django.core import mail
+from django.template import Context, Template
+
+from drip.drips import DripMessage
+from drip.rendering import RenderMemo, SegmentedTemplate, TemplateCache, is_static_template, template_cache
+from drip.tests.test_drips import SetupDataDripMixin
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def empty_template_cache():
+    template_cache.clear()
+    yield
+    template_cache.clear()
+
+
+class TestTemplateCache:
+    def test_get_compiles_once_per_key(self):
+        cache = TemplateCache()
+
+        with patch("drip.rendering.Template", wraps=Template) as compile_template:
+            first = cache.get(("drip", 1), "Hi {{ user.username }}")
+            second = cache.get(("drip", 1), "Hi {{ user.username }}")
+
+        assert first is second
+        assert 1 == compile_template.call_count
+        assert (1, 1) == (cache.hits, cache.misses)
+
+    def test_changed_source_is_compiled_again(self):
+        cache = TemplateCache()
+        cache.get(("drip", 1), "Hi")
+
+        template = cache.get(("drip", 1), "Bye")
+
+        assert "Bye" == template.render(Context())
+        assert 1 == len(cache)
+
+    def test_least_recently_used_templates_are_evicted(self, settings):
+        settings.DRIP_TEMPLATE_CACHE_SIZE = 2
+        cache = TemplateCache()
+        first = cache.get("first", "1")
+        cache.get("second", "2")
+        cache.get("first", "1")
+
+        cache.get("third", "3")
+
+        assert 2 == len(cache)
+        misses = cache.misses
+        # "first" was used recently, so "second" was evicted
+        assert first is cache.get("first", "1")
+        assert misses == cache.misses
+        cache.get("second", "2")
+        assert misses + 1 == cache.misses
+
+    def test_without_key_templates_are_not_cached(self):
+        cache = TemplateCache()
+
+        assert cache.get(None, "Hi") is not cache.get(None, "Hi")
+        assert 0 == len(cache)
+
+
+class TestDripTemplates(SetupDataDripMixin):
+    def setup_method(self, test_method):
+        self.build_user_data()
+        self.model_drip = self.build_everyone_drip()
+
+    def test_templates_are_parsed_once_per_run(self):
+        with patch("drip.rendering.Template", wraps=Template) as compile_template:
+            assert 20 == self.model_drip.drip.send()
+
+        # subject and body
+        assert 2 == compile_template.call_count
+
+    def test_templates_are_reused_across_runs_until_the_drip_changes(self):
+        self.model_drip.drip.send()
+
+        with patch("drip.rendering.Template", wraps=Template) as compile_template:
+            self.model_drip.drip.send()
+            assert 0 == compile_template.call_count
+
+            self.model_drip.subject_template = "BYE {{ user.username }}"
+            self.model_drip.save()
+            drip = self.model_drip.drip
+            user = drip.get_queryset().first()
+            assert "BYE {username}".format(username=user.username) == DripMessage(drip, user).subject
+            assert 1 == compile_template.call_count
+
+    def test_shared_context_renders_like_a_new_context(self, settings):
+        settings.DRIP_UNSUBSCRIBE_USERS = True
+        self.model_drip.body_html_template = (
+            "<p>{{ user.username|upper }} {% cycle 'a' 'b' %}{% cycle 'a' 'b' %}</p>{{ unsubscribe_link }}"
+        )
+        self.model_drip.save()
+        drip = self.model_drip.drip
+
+        for user in drip.get_queryset():
+            message = DripMessage(drip, user)
+            expected = Template(drip.body_template).render(Context(message.build_context()))
+            assert expected == message.body
+
+        # every message popped its variables from the shared context
+        assert 1 == len(drip.get_shared_context().dicts)
+
+    def test_custom_context_is_used(self):
+        class GreetingMessage(DripMessage):
+            @property
+            def context(self):
+                return Context({"user": self.user, "greeting": "Howdy"})
+
+        self.model_drip.subject_template = "{{ greeting }} {{ user.username }}"
+        self.model_drip.save()
+        drip = self.model_drip.drip
+        user = drip.get_queryset().first()
+
+        assert "Howdy {username}".format(username=user.username) == GreetingMessage(drip, user).subject
+
+
+class TestStaticTemplates:
+    @pytest.mark.parametrize(
+        "source, static",
+        [
+            ("Our weekly news", True),
+            ("{% templatetag openbrace %} {{ site_name|default:'Drips' }}", True),
+            ("{% now 'Y' %} {{ site_name|default:'Drips' }}", False),
+            ("{% if offer %}{{ offer }}{% endif %}", True),
+            ("Hi {{ user.username }}", False),
+            ("{% if user.is_staff %}staff{% endif %}", False),
+            ("{% for item in user.items %}{{ item }}{% endfor %}", False),
+            ("{% with name=user.first_name %}{{ name }}{% endwith %}", False),
+            ("{{ 'a'|default:unsubscribe_link }}", False),
+            ("{% filter upper %}{{ user }}{% endfilter %}", False),
+            ("{{ values|random }}", False),
+            ("{% include 'drip/base.html' %}", False),
+        ],
+    )
+    def test_is_static_template(self, source, static):
+        assert static == is_static_template(Template(source), DripMessage.user_context_names)
+
+
+class TestSegmentedTemplate:
+    @pytest.mark.parametrize(
+        "source",
+        [
+            "<p>Hi {{ user.username }}</p><footer>{{ unsubscribe_link }}</footer>",
+            "<p>{% now 'Y' %}</p>{% comment %}note{% endcomment %}{{ user.username|upper }}<br>",
+            "{% if user.is_staff %}<b>staff</b>{% else %}{{ user }}{% endif %} & friends",
+            "{% for item in items %}{% cycle 'odd' 'even' %}{{ item }}{% endfor %}{% cycle 'a' 'b' %}",
+            "{% cycle 'a' 'b' as row %}{{ row }} {% firstof missing 'x' as value %}{{ value }}",
+            "{% with name=user.username %}{{ name }}{% endwith %}{{ '<i>' }}{{ markup }}",
+            "{% autoescape off %}{{ markup }}{% endautoescape %}{% spaceless %} <p> </p> {% endspaceless %}",
+            "{% load static %}<img src='{% static 'logo.png' %}'>{% include 'unsubscribe_drip_invalid.html' %}",
+        ],
+    )
+    @pytest.mark.parametrize("autoescape", [True, False])
+    def test_renders_like_the_template(self, source, autoescape):
+        template = Template(source)
+        segmented = SegmentedTemplate(template)
+        values = {"user": "<Jane>", "items": ["1", "2", "3"], "markup": "<b>", "unsubscribe_link": "/u/?t=1&d=2"}
+
+        for value in ["<Jane>", "John"]:
+            values["user"] = value
+            expected = template.render(Context(values, autoescape=autoescape))
+            assert expected == segmented.render(Context(values, autoescape=autoescape))
+
+    def test_constant_nodes_are_joined(self):
+        segmented = SegmentedTemplate(
+            Template("<p>{% templatetag openbrace %}</p><p>{{ user }}</p><hr>{% comment %}x{% endcomment %}")
+        )
+
+        segments = segmented.get_segments(Context())
+
+        assert 3 == len(segments)
+        assert "<p>{</p><p>" == segments[0]
+        assert "</p><hr>" == segments[2]
+
+    def test_now_is_rendered_every_time(self):
+        segmented = SegmentedTemplate(Template("<p>{% now 'Y' %}</p>"))
+        years = iter([datetime(2020, 1, 1), datetime(2021, 1, 1)])
+
+        with patch("django.template.defaulttags.datetime") as mock_datetime:
+            mock_datetime.now.side_effect = lambda tz=None: next(years)
+            assert "<p>2020</p>" == segmented.render(Context())
+            assert "<p>2021</p>" == segmented.render(Context())
+
+    def test_constant_segments_are_rendered_once(self):
+        segmented = SegmentedTemplate(Template("<p>{{ user }}</p>"))
+
+        with patch.object(SegmentedTemplate, "build_segments", wraps=segmented.build_segments) as build_segments:
+            for user in ["first", "second"]:
+                assert "<p>{user}</p>".format(user=user) == segmented.render(Context({"user": user}))
+
+        assert 1 == build_segments.call_count
+
+
+class TestStaticRender(SetupDataDripMixin):
+    def setup_method(self, test_method):
+        self.build_user_data()
+        self.model_drip = self.build_everyone_drip()
+        self.model_drip.subject_template = "Our weekly news"
+        self.model_drip.body_html_template = "<p>KETTEHS ROCK!</p>"
+        self.model_drip.save()
+
+    def test_static_templates_are_rendered_once_per_run(self):
+        with patch.object(Template, "render", autospec=True, side_effect=Template.render) as render:
+            assert 20 == self.model_drip.drip.send()
+
+        # subject and body
+        assert 2 == render.call_count
+        assert {"Our weekly news"} == {message.subject for message in mail.outbox}
+        assert {"KETTEHS ROCK!"} == {message.body for message in mail.outbox}
+
+    def test_static_render_skips_the_user_context(self):
+        with patch.object(DripMessage, "build_context") as build_context:
+            assert 20 == self.model_drip.drip.send()
+
+        build_context.assert_not_called()
+
+    def test_dynamic_template_is_rendered_per_user(self):
+        self.model_drip.body_html_template = "<p>{{ user.username }}</p>"
+        self.model_drip.save()
+
+        with patch.object(SegmentedTemplate, "render", autospec=True, side_effect=SegmentedTemplate.render) as render:
+            assert 20 == self.model_drip.drip.send()
+
+        # the body for every user, the subject was rendered once
+        assert 20 == render.call_count
+        usernames = set(self.model_drip.drip.get_queryset().values_list("username", flat=True))
+        assert usernames == {message.body for message in mail.outbox}
+
+    def test_custom_context_disables_static_render(self):
+        class GreetingMessage(DripMessage):
+            def build_context(self):
+                return {"user": self.user, "news": "Custom news"}
+
+        class NewsMessage(GreetingMessage):
+            user_context_names = DripMessage.user_context_names + ("news",)
+
+        self.model_drip.subject_template = "{{ news }}"
+        self.model_drip.save()
+        drip = self.model_drip.drip
+        user = drip.get_queryset().first()
+
+        assert not GreetingMessage(drip, user).supports_static_render()
+        assert "Custom news" == GreetingMessage(drip, user).subject
+        assert NewsMessage(drip, user).supports_static_render()
+        assert "Custom news" == NewsMessage(drip, user).subject
+        assert "<p>KETTEHS ROCK!</p>" == NewsMessage(drip, user).body
+
+    def test_static_render_keeps_the_shared_context(self):
+        class CompanyMessage(DripMessage):
+            user_context_names = ("user",)
+
+            def build_context(self):
+                context = super().build_context()
+                context["company"] = "ACME"
+                return context
+
+        self.model_drip.subject_template = "News from {{ company }}"
+        self.model_drip.save()
+        drip = self.model_drip.drip
+
+        subjects = {CompanyMessage(drip, user).subject for user in drip.get_queryset()}
+
+        assert {"News from ACME"} == subjects
+        assert ("subject", ("user",)) in drip._static_renders
+
+
+class StaffMessage(DripMessage):
+    def get_render_key(self):
+        return self.user.is_staff
+
+
+class TestRenderMemo(SetupDataDripMixin):
+    def setup_method(self, test_method):
+        self.build_user_data()
+        self.model_drip = self.build_everyone_drip()
+        self.model_drip.subject_template = "{% if user.is_staff %}Staff{% else %}Member{% endif %} news"
+        self.model_drip.body_html_template = (
+            "<p>{% if user.is_staff %}Staff{% else %}Member{% endif %} news</p>"
+            "<a href='{{ unsubscribe_link }}'>Unsubscribe</a> {{ unsubscribe_link_drip }}"
+        )
+        self.model_drip.save()
+        self.users = list(self.model_drip.drip.get_queryset())
+        self.users[0].is_staff = True
+
+    def assert_renders_like_every_message(self, drip):
+        for user in self.users:
+            memoized, message = StaffMessage(drip, user), DripMessage(drip, user)
+            assert (message.subject, message.body, message.plain) == (memoized.subject, memoized.body, memoized.plain)
+
+    def test_messages_are_rendered_once_per_key(self, settings):
+        settings.DRIP_UNSUBSCRIBE_USERS = True
+        drip = self.model_drip.drip
+
+        with patch.object(SegmentedTemplate, "render", autospec=True, side_effect=SegmentedTemplate.render) as render:
+            bodies = [StaffMessage(drip, user).body for user in self.users]
+
+        # the body of staff and of members
+        assert 2 == render.call_count
+        assert 2 == len(drip.render_memo)
+        assert 20 == len(set(bodies))
+        assert DripMessage(drip, self.users[1]).get_context_dict()["unsubscribe_link"] in bodies[1]
+        self.assert_renders_like_every_message(drip)
+
+    def test_spliced_variables_with_filters_are_rendered_per_user(self, settings):
+        settings.DRIP_UNSUBSCRIBE_USERS = True
+        self.model_drip.body_html_template = "<p>Hi</p>{{ unsubscribe_link|upper }}"
+        self.model_drip.save()
+        drip = self.model_drip.drip
+
+        assert not drip.can_splice("body", StaffMessage.spliced_context_names)
+        assert drip.can_splice("subject", StaffMessage.spliced_context_names)
+        self.assert_renders_like_every_message(drip)
+
+    def test_values_changed_by_escaping_are_rendered_per_user(self):
+        drip = self.model_drip.drip
+
+        with patch.object(StaffMessage, "build_context", return_value={"unsubscribe_link": "/u/?a=1&b=2"}):
+            message = StaffMessage(drip, self.users[1])
+            assert message.render_memoized("body") is None
+            assert "/u/?a=1&amp;b=2" in message.body
+
+    def test_memo_is_bounded(self, settings):
+        settings.DRIP_RENDER_MEMO_SIZE = 2
+        memo = RenderMemo()
+        for key in ["first", "second", "third"]:
+            assert key == memo.get(key, "body", lambda: key)
+
+        assert 2 == len(memo)
+        assert "third" == memo.get("third", "body", lambda: "other")
+        assert "other" == memo.get("first", "body", lambda: "other")
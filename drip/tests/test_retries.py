@@ -0,0 +1,191 @@
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import PropertyMock, patch
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.core import mail
+from django.core.management import call_command
+from django.utils import timezone
+
+from drip.models import RETRY_DEAD, RETRY_PENDING, DripRetry, SentDrip
+from drip.retries import RetryPolicy, retry_drips
+from drip.tests.test_drips import SetupDataDripMixin
+
+pytestmark = pytest.mark.django_db
+
+RETRY_SETTINGS = {"ENABLED": True, "MAX_ATTEMPTS": 3, "BACKOFF": 60, "MAX_BACKOFF": 600}
+
+
+class TestRetryPolicy:
+    def test_from_settings_disabled(self, settings):
+        settings.DRIP_RETRY_SETTINGS = {}
+
+        assert RetryPolicy.from_settings() is None
+
+    def test_from_settings(self, settings):
+        settings.DRIP_RETRY_SETTINGS = RETRY_SETTINGS
+
+        policy = RetryPolicy.from_settings()
+
+        assert 3 == policy.max_attempts
+        assert 60 == policy.backoff
+        assert 600 == policy.max_backoff
+
+    @pytest.mark.parametrize(
+        "attempts, low, high",
+        (
+            (1, 30, 60),
+            (2, 60, 120),
+            (3, 120, 240),
+            (5, 300, 600),  # capped by max_backoff
+        ),
+    )
+    def test_get_delay_is_exponential_with_jitter(self, attempts: int, low: float, high: float):
+        policy = RetryPolicy(backoff=60, max_backoff=600)
+
+        delays = [policy.get_delay(attempts) for _ in range(20)]
+
+        assert all(low <= delay <= high for delay in delays)
+
+
+class TestDripRetries(SetupDataDripMixin):
+    def setup_method(self, test_method):
+        self.build_user_data()
+
+    @pytest.fixture(autouse=True)
+    def retry_settings(self, settings):
+        settings.DRIP_RETRY_SETTINGS = RETRY_SETTINGS
+
+    def fail_one_send(self):
+        drip = self.build_joined_date_drip().drip
+        with patch("django.core.mail.EmailMessage.send", side_effect=[1, Exception("SMTP down")]):
+            count = drip.send()
+        return drip, count
+
+    def make_due(self):
+        DripRetry.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+
+    def test_failed_send_is_stored_rendered(self):
+        drip, count = self.fail_one_send()
+
+        assert 1 == count
+        retry = DripRetry.objects.get()
+        sent_drip = SentDrip.objects.get()
+        assert retry.user != sent_drip.user
+        assert RETRY_PENDING == retry.status
+        assert 1 == retry.attempts
+        assert "SMTP down" == retry.last_error
+        assert retry.next_attempt_at > timezone.now()
+        assert "HELLO {username}".format(username=retry.user.username) == retry.subject
+        assert sent_drip.body == retry.body
+
+    def test_failed_send_without_retries(self, settings):
+        settings.DRIP_RETRY_SETTINGS = {}
+
+        self.fail_one_send()
+
+        assert not DripRetry.objects.exists()
+
+    def test_render_failure_is_not_stored(self):
+        drip = self.build_joined_date_drip().drip
+
+        with patch("drip.drips.DripMessage.subject", new_callable=PropertyMock, side_effect=Exception("Bad template")):
+            count = drip.send()
+
+        assert 0 == count
+        assert not DripRetry.objects.exists()
+
+    def test_asend_failure_is_stored(self):
+        drip = self.build_joined_date_drip().drip
+
+        with patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=[Exception("SMTP down"), 1],
+        ):
+            count = async_to_sync(drip.asend)()
+
+        assert 1 == count
+        assert 1 == DripRetry.objects.count()
+
+    def test_prune_excludes_pending_retries(self):
+        drip, _ = self.fail_one_send()
+        retry = DripRetry.objects.get()
+
+        drip = drip.drip_model.drip
+        drip.prune()
+
+        assert retry.user not in drip.get_queryset()
+
+    def test_retry_not_due_is_skipped(self):
+        self.fail_one_send()
+
+        assert 0 == retry_drips()
+        assert 1 == DripRetry.objects.count()
+
+    def test_retry_delivers_without_rendering(self):
+        self.fail_one_send()
+        retry = DripRetry.objects.get()
+        self.make_due()
+        mail.outbox = []
+
+        with patch("drip.drips.DripMessage.body", new_callable=PropertyMock) as body:
+            count = retry_drips()
+
+        assert 1 == count
+        assert not body.called
+        assert not DripRetry.objects.exists()
+        assert 2 == SentDrip.objects.count()
+        sent_drip = SentDrip.objects.get(user=retry.user)
+        assert retry.subject == sent_drip.subject
+        assert retry.body == sent_drip.body
+        assert 1 == len(mail.outbox)
+        assert [retry.user.email] == mail.outbox[0].to
+        assert retry.subject == mail.outbox[0].subject
+
+    def test_retry_failure_backs_off(self):
+        self.fail_one_send()
+        self.make_due()
+
+        with patch("django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=Exception("Timeout")):
+            count = retry_drips()
+
+        assert 0 == count
+        retry = DripRetry.objects.get()
+        assert RETRY_PENDING == retry.status
+        assert 2 == retry.attempts
+        assert "Timeout" == retry.last_error
+        assert retry.next_attempt_at > timezone.now() + timedelta(seconds=59)
+
+    def test_retry_dead_letter(self, caplog):
+        self.fail_one_send()
+
+        with patch("django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=Exception("Timeout")):
+            for _ in range(3):
+                self.make_due()
+                retry_drips()
+
+        retry = DripRetry.objects.get()
+        assert RETRY_DEAD == retry.status
+        assert 3 == retry.attempts
+        assert "Giving up on drip" in caplog.text
+        self.make_due()
+        assert 0 == retry_drips()
+
+    def test_retry_claimed_by_another_worker(self):
+        self.fail_one_send()
+        self.make_due()
+        retry = DripRetry.objects.get()
+        DripRetry.objects.filter(pk=retry.pk).update(attempts=2)
+
+        assert not RetryPolicy().claim(retry, timezone.now())
+
+    def test_retry_drips_command(self):
+        self.fail_one_send()
+        self.make_due()
+        out = StringIO()
+
+        call_command("retry_drips", stdout=out)
+
+        assert "Retried: 1 sent" in out.getvalue()
+        assert not DripRetry.objects.exists()
@@ -1,14 +1,35 @@
+import functools
+import operator
+from datetime import datetime, timedelta
 from typing import Optional
+from unittest.mock import patch
 
 import pytest
+from django.contrib.auth.models import Group
+from django.core import mail
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F, Q
+from django.test.utils import CaptureQueriesContext
 from faker import Faker
 
-from drip.models import Drip, QuerySetRule
+from drip.drips import DripBase
+from drip.models import Drip, QuerySetRule, SentDrip
+from drip.rules import CompiledRuleSet, compile_rule, rules_cache
+from drip.tests.test_drips import SetupDataDripMixin
 from drip.utils import get_simple_fields, get_user_model
 
 pytestmark = pytest.mark.django_db
 
+User = get_user_model()
+
+NOW = datetime(2022, 5, 17, 13, 30)
+
+
+def count_rule_queries(queries):
+    return len([query for query in queries if QuerySetRule._meta.db_table in query["sql"]])
+
 
 class TestCaseRules:
     faker: Faker
@@ -83,3 +104,430 @@ class TestCaseRules:
                     field_value=field_value,
                 )
                 rule.clean()
+
+
+class TestCompileRule:
+    @pytest.mark.parametrize(
+        "field_name,lookup_type,field_value",
+        [
+            ("date_joined", "lt", "now-7 days"),
+            ("date_joined", "gte", "now+1 day, 2 hours"),
+            ("date_joined__date", "lt", "today-3 days"),
+            ("date_joined__date", "gte", "today+1 week"),
+            ("is_staff", "exact", "True"),
+            ("is_active", "exact", "False"),
+            ("username", "startswith", "first"),
+            ("profile__credits", "gt", "50"),
+            ("last_login", "gte", "F_date_joined"),
+            ("groups__count", "gte", "2"),
+        ],
+    )
+    def test_same_value_as_filter_kwargs(self, field_name, lookup_type, field_value):
+        rule = QuerySetRule(field_name=field_name, lookup_type=lookup_type, field_value=field_value)
+
+        compiled = compile_rule(rule)
+
+        assert rule.filter_kwargs(now=lambda: NOW) == {compiled.lookup: compiled.get_value(lambda: NOW)}
+
+    def test_time_relative_values_are_bound_on_each_evaluation(self):
+        compiled = compile_rule(QuerySetRule(field_name="date_joined", lookup_type="lt", field_value="now-7 days"))
+
+        assert NOW - timedelta(days=7) == compiled.get_value(lambda: NOW)
+        assert NOW - timedelta(days=6) == compiled.get_value(lambda: NOW + timedelta(days=1))
+
+    def test_f_expressions(self):
+        compiled = compile_rule(QuerySetRule(field_name="last_login", lookup_type="gte", field_value="F_date_joined"))
+
+        assert F("date_joined") == compiled.value
+        assert compiled.shift is None
+
+    def test_annotations(self):
+        compiled = compile_rule(QuerySetRule(field_name="groups__count", lookup_type="gte", field_value="2"))
+
+        assert ("num_groups", "groups") == compiled.annotation
+        assert "num_groups__gte" == compiled.lookup
+
+
+class TestCompiledRules(SetupDataDripMixin):
+    def setup_method(self, test_method):
+        self.build_user_data()
+        rules_cache.clear()
+
+    def test_rules_are_fetched_once(self):
+        drip = self.build_joined_date_drip().drip
+
+        with CaptureQueriesContext(connection) as queries:
+            drip.get_queryset()
+
+        assert 1 == count_rule_queries(queries.captured_queries)
+
+    def test_compiled_rules_are_shared_across_runs(self):
+        model_drip = self.build_joined_date_drip()
+
+        first = model_drip.drip.get_compiled_rules()
+        second = model_drip.drip.get_compiled_rules()
+
+        assert first is second
+        assert 1 == rules_cache.hits
+        assert 2 == model_drip.drip.get_queryset().count()
+
+    def test_changed_rules_are_compiled_again(self):
+        model_drip = self.build_joined_date_drip()
+        first = model_drip.drip.get_compiled_rules()
+
+        rule = model_drip.queryset_rules.first()
+        rule.field_value = "now-1 day"
+        rule.save()
+
+        assert first is not model_drip.drip.get_compiled_rules()
+
+    def test_rules_updated_without_saving_are_compiled_again(self):
+        model_drip = self.build_joined_date_drip(shift_one=7, shift_two=8)
+        assert 2 == model_drip.drip.get_queryset().count()
+
+        model_drip.queryset_rules.filter(lookup_type="gte").update(field_value="now-10 days")
+
+        assert 6 == model_drip.drip.get_queryset().count()
+
+    def test_deleted_rules_are_compiled_again(self):
+        model_drip = self.build_joined_date_drip()
+        model_drip.drip.get_compiled_rules()
+
+        model_drip.queryset_rules.filter(lookup_type="gte").delete()
+
+        assert 1 == len(model_drip.drip.get_compiled_rules().and_rules)
+
+    def test_walk_fetches_the_rules_once(self):
+        drip = self.build_joined_date_drip().drip
+
+        with CaptureQueriesContext(connection) as queries:
+            counts = [shifted.get_queryset().count() for shifted in drip.walk(into_past=3, into_future=3)]
+
+        assert 1 == count_rule_queries(queries.captured_queries)
+        assert 6 == len(counts)
+        assert 2 == counts[3]
+
+    def test_send_drips_prefetches_the_rules(self):
+        first = self.build_joined_date_drip()
+        first.name = "first"
+        first.enabled = True
+        first.save()
+        second = self.build_joined_date_drip(shift_one=3, shift_two=4)
+        second.enabled = True
+        second.save()
+
+        with CaptureQueriesContext(connection) as queries:
+            call_command("send_drips")
+
+        assert 1 == count_rule_queries(queries.captured_queries)
+        assert {2} == {drip.sent_drips.count() for drip in Drip.objects.all()}
+
+    def test_or_rules(self):
+        rule_set = CompiledRuleSet(
+            [
+                QuerySetRule(rule_type="or", field_name="username", lookup_type="startswith", field_value="first"),
+                QuerySetRule(rule_type="or", field_name="username", lookup_type="startswith", field_value="second"),
+            ]
+        )
+
+        qs = rule_set.apply_or(User.objects.all(), lambda: NOW)
+
+        assert 4 == qs.count()
+        assert 0 == rule_set.apply_and(User.objects.all(), lambda: NOW).count()
+
+
+class TestTypedValues(SetupDataDripMixin):
+    def setup_method(self, test_method):
+        self.build_user_data()
+        self.model_drip = Drip.objects.create(name="Typed", subject_template="Hi", body_html_template="Hi")
+
+    def build_rule(self, field_name, lookup_type, field_value):
+        return QuerySetRule.objects.create(
+            drip=self.model_drip, field_name=field_name, lookup_type=lookup_type, field_value=field_value
+        )
+
+    @pytest.mark.parametrize(
+        "field_name,lookup_type,field_value,typed_value",
+        [
+            ("profile__credits", "gt", "50", 50),
+            ("id", "exact", "3", 3),
+            ("is_staff", "exact", "1", True),
+            ("date_joined", "lt", "2022-05-17 13:30", datetime(2022, 5, 17, 13, 30)),
+            ("groups__count", "gte", "2", 2),
+            ("username", "exact", "first", "first"),
+            ("profile__credits", "contains", "5", "5"),
+            ("profile__credits", "gt", "many", "many"),
+            ("profile__credits", "gt", "", ""),
+            ("date_joined__date", "lt", "2022-05-17", "2022-05-17"),
+            ("groups__name", "exact", "staff", "staff"),
+            ("groups", "exact", "1", "1"),
+        ],
+    )
+    def test_values_are_converted_to_the_field_type(self, field_name, lookup_type, field_value, typed_value):
+        rule = QuerySetRule(field_name=field_name, lookup_type=lookup_type, field_value=field_value)
+
+        kwargs = rule.filter_kwargs(now=lambda: NOW)
+
+        assert typed_value == kwargs[rule.annotated_field_name + "__" + lookup_type]
+        assert type(typed_value) is type(compile_rule(rule).value)
+
+    def test_value_is_converted_once_until_changed(self):
+        rule = self.build_rule("profile__credits", "gte", "100")
+
+        with patch.object(rule, "convert_value", wraps=rule.convert_value) as convert_value:
+            assert 100 == rule.filter_kwargs()["profile__credits__gte"]
+            assert 100 == rule.filter_kwargs()["profile__credits__gte"]
+        assert 1 == convert_value.call_count
+
+        rule.field_value = "150"
+        assert 150 == rule.filter_kwargs()["profile__credits__gte"]
+
+    def test_queries_get_typed_parameters(self):
+        self.build_rule("profile__credits", "gte", "100")
+
+        qs = self.model_drip.drip.get_queryset()
+
+        assert 100 in qs.query.sql_with_params()[1]
+        assert 6 == qs.count()
+
+
+def legacy_queryset(model_drip, now):
+    """The audience of the drip as built before the rules were compiled in a single WHERE clause."""
+    rules = list(model_drip.queryset_rules.all())
+    qs = User.objects.all()
+    and_rules = [rule for rule in rules if rule.rule_type == "and"]
+    filters = [Q(**rule.filter_kwargs(now=now)) for rule in and_rules if rule.method_type != "exclude"]
+    excludes = [Q(**rule.filter_kwargs(now=now)) for rule in and_rules if rule.method_type == "exclude"]
+    and_qs = qs.all()
+    for rule in and_rules:
+        and_qs = rule.apply_any_annotation(and_qs)
+    if excludes:
+        and_qs = and_qs.exclude(functools.reduce(operator.or_, excludes))
+    and_qs = and_qs.filter(*filters) if and_rules else and_qs.none()
+    or_rules = [Q(**rule.filter_kwargs(now=now)) for rule in rules if rule.rule_type == "or"]
+    or_qs = qs.filter(functools.reduce(operator.or_, or_rules)) if or_rules else qs.none()
+    return (and_qs | or_qs).distinct()
+
+
+class TestSingleWhereClause(SetupDataDripMixin):
+    def setup_method(self, test_method):
+        self.build_user_data()
+        self.model_drip = Drip.objects.create(name="Rules", subject_template="Hi", body_html_template="Hi")
+        other_drip = Drip.objects.create(name="Other", subject_template="Hi", body_html_template="Hi")
+        first_group = Group.objects.create(name="first")
+        second_group = Group.objects.create(name="second")
+        for index, user in enumerate(User.objects.order_by("pk")):
+            if index % 2:
+                user.groups.add(first_group)
+            if index % 3:
+                user.groups.add(second_group)
+            for drip in [self.model_drip, other_drip][: index % 3]:
+                SentDrip.objects.create(drip=drip, user=user, subject="subject {index}".format(index=index), body="")
+
+    def build_rules(self, rules):
+        for field_name, lookup_type, field_value, rule_type, method_type in rules:
+            QuerySetRule.objects.create(
+                drip=self.model_drip,
+                field_name=field_name,
+                lookup_type=lookup_type,
+                field_value=field_value,
+                rule_type=rule_type,
+                method_type=method_type,
+            )
+
+    @pytest.mark.parametrize(
+        "rules,distinct",
+        [
+            ([], False),
+            ([("username", "contains", "credits", "and", "filter")], False),
+            (
+                [("profile__credits", "gte", "50", "and", "filter"), ("is_active", "exact", "True", "and", "filter")],
+                False,
+            ),
+            (
+                [("profile__credits", "gte", "50", "and", "filter"), ("username", "startswith", "f", "and", "exclude")],
+                False,
+            ),
+            (
+                [("username", "startswith", "f", "or", "filter"), ("profile__credits", "lt", "50", "or", "filter")],
+                False,
+            ),
+            (
+                [
+                    ("profile__credits", "gte", "100", "and", "filter"),
+                    ("username", "endswith", "day", "and", "filter"),
+                    ("username", "startswith", "s", "or", "filter"),
+                ],
+                False,
+            ),
+            ([("groups__name", "exact", "first", "and", "filter")], True),
+            ([("groups__name", "startswith", "s", "and", "exclude")], False),
+            (
+                [
+                    ("groups__name", "exact", "first", "or", "filter"),
+                    ("groups__name", "exact", "second", "or", "filter"),
+                ],
+                True,
+            ),
+            (
+                [
+                    ("groups__name", "exact", "first", "and", "filter"),
+                    ("sent_drips__subject", "contains", "1", "and", "filter"),
+                    ("username", "startswith", "t", "or", "filter"),
+                ],
+                True,
+            ),
+            ([("sent_drips__drip__name", "exact", "Rules", "and", "filter")], True),
+            ([("sent_drips__drip__name", "exact", "Other", "and", "exclude")], False),
+            ([("groups__count", "gte", "2", "and", "filter")], False),
+            ([("groups__count", "gt", "0", "and", "filter")], False),
+            ([("sent_drips__count", "lt", "1", "and", "filter")], False),
+            (
+                [("groups__count", "exact", "1", "and", "filter"), ("sent_drips__count", "gte", "2", "and", "filter")],
+                False,
+            ),
+            (
+                [("groups__count", "gte", "1", "and", "filter"), ("sent_drips__count", "lte", "0", "and", "filter")],
+                False,
+            ),
+            (
+                [("sent_drips__count", "gt", "0", "and", "exclude"), ("groups__count", "lt", "2", "and", "filter")],
+                False,
+            ),
+            (
+                [
+                    ("groups__count", "exact", "2", "and", "filter"),
+                    ("groups__name", "exact", "first", "and", "filter"),
+                    ("username", "startswith", "t", "or", "filter"),
+                ],
+                True,
+            ),
+            (
+                [
+                    ("groups__count", "exact", "0", "and", "filter"),
+                    ("date_joined", "lt", "now-3 days", "and", "filter"),
+                ],
+                False,
+            ),
+            (
+                [
+                    ("date_joined", "gte", "now-4 days", "and", "filter"),
+                    ("date_joined__date", "lt", "today-6 days", "or", "filter"),
+                ],
+                False,
+            ),
+        ],
+    )
+    def test_same_audience_as_before(self, rules, distinct):
+        self.build_rules(rules)
+        drip = self.model_drip.drip
+
+        queryset = drip.get_queryset()
+
+        expected = legacy_queryset(self.model_drip, drip.now)
+        assert sorted(expected.values_list("pk", flat=True)) == sorted(queryset.values_list("pk", flat=True))
+        assert distinct == queryset.query.distinct
+
+    def test_rules_are_a_single_where_clause(self):
+        self.build_rules(
+            [
+                ("profile__credits", "gte", "50", "and", "filter"),
+                ("username", "startswith", "f", "and", "exclude"),
+                ("username", "startswith", "s", "or", "filter"),
+            ]
+        )
+
+        sql = str(self.model_drip.drip.get_queryset().query)
+
+        assert 1 == sql.count("WHERE")
+        assert "DISTINCT" not in sql
+
+    @pytest.mark.parametrize(
+        "base_queryset, distinct",
+        [
+            (lambda: User.objects.filter(groups__name__in=["first", "second"]), True),
+            (lambda: User.objects.filter(is_active=True).distinct(), True),
+            (lambda: User.objects.filter(is_active=True), False),
+        ],
+    )
+    def test_custom_queryset_repeating_users_is_distinct(self, base_queryset, distinct):
+        self.build_rules([("username", "contains", "credits", "and", "filter")])
+
+        class GroupsDrip(DripBase):
+            def queryset(self):
+                return base_queryset()
+
+        drip = GroupsDrip(drip_model=self.model_drip, name=self.model_drip.name)
+        pks = list(drip.get_queryset().values_list("pk", flat=True))
+
+        assert len(set(pks)) == len(pks)
+        assert distinct == drip.get_queryset().query.distinct
+
+    def test_custom_queryset_sends_once_per_user(self):
+        self.build_rules([("username", "contains", "credits", "and", "filter")])
+        self.model_drip.enabled = True
+        self.model_drip.save()
+
+        class GroupsDrip(DripBase):
+            def queryset(self):
+                return User.objects.filter(groups__name__in=["first", "second"])
+
+        drip = GroupsDrip(drip_model=self.model_drip, name=self.model_drip.name, subject_template="Hi")
+
+        sent_before = SentDrip.objects.filter(drip=self.model_drip).count()
+
+        count = drip.run()
+
+        user_ids = list(SentDrip.objects.filter(drip=self.model_drip).values_list("user_id", flat=True))
+        assert 0 < count == len(mail.outbox) == len(user_ids) - sent_before
+        assert len(set(user_ids)) == len(user_ids)
+
+
+class TestCountRules(SetupDataDripMixin):
+    def setup_method(self, test_method):
+        self.build_user_data()
+        self.model_drip = Drip.objects.create(name="Counts", subject_template="Hi", body_html_template="Hi")
+        group = Group.objects.create(name="first")
+        for user in User.objects.order_by("pk")[:5]:
+            user.groups.add(group)
+            SentDrip.objects.create(drip=self.model_drip, user=user, subject="", body="")
+            SentDrip.objects.create(drip=self.model_drip, user=user, subject="", body="")
+
+    def build_rule(self, field_name, lookup_type, field_value, rule_type="and"):
+        QuerySetRule.objects.create(
+            drip=self.model_drip,
+            field_name=field_name,
+            lookup_type=lookup_type,
+            field_value=field_value,
+            rule_type=rule_type,
+        )
+
+    @pytest.mark.parametrize(
+        "lookup_type,field_value,count",
+        [("gt", "0", 5), ("gte", "1", 5), ("exact", "0", 15), ("lt", "1", 15), ("lte", "0", 15)],
+    )
+    def test_comparisons_with_zero_are_exists(self, lookup_type, field_value, count):
+        self.build_rule("sent_drips__count", lookup_type, field_value)
+
+        queryset = self.model_drip.drip.get_queryset()
+
+        sql = str(queryset.query)
+        assert "EXISTS" in sql
+        assert "COUNT" not in sql
+        assert count == queryset.count()
+
+    def test_counts_are_correlated_subqueries(self):
+        self.build_rule("sent_drips__count", "gte", "2")
+        self.build_rule("groups__count", "exact", "1")
+
+        queryset = self.model_drip.drip.get_queryset()
+
+        assert queryset.query.group_by is None
+        assert 2 == str(queryset.query).count("COUNT(DISTINCT")
+        assert 5 == queryset.count()
+
+    def test_or_counts(self):
+        self.build_rule("sent_drips__count", "gte", "2", rule_type="or")
+        self.build_rule("username", "startswith", "tenth", rule_type="or")
+
+        assert 7 == self.model_drip.drip.get_queryset().count()
@@ -0,0 +1,66 @@
+import pytest
+
+from drip.models import Drip, SentDrip
+from drip.tasks import app, dispatch_drip_chunks, send_drip_chunk
+from drip.tests.test_drips import SetupDataDripMixin
+from drip.utils import get_user_model
+
+pytestmark = pytest.mark.django_db
+User = get_user_model()
+
+
+class TestDripChunkTasks(SetupDataDripMixin):
+    def setup_method(self, test_method):
+        self.build_user_data()
+        self.model_drip = self.build_everyone_drip(enabled=True)
+        # the tests build the drip of build_joined_date_drip too
+        self.model_drip.name = "Everyone"
+        self.model_drip.save()
+
+    @pytest.fixture(autouse=True)
+    def eager_celery(self, monkeypatch):
+        monkeypatch.setitem(app.conf, "task_always_eager", True)
+
+    def test_get_pk_ranges(self):
+        user_ids = list(User.objects.order_by("id").values_list("id", flat=True))
+
+        pk_ranges = self.model_drip.drip.get_pk_ranges(6)
+
+        assert [
+            (user_ids[0], user_ids[5]),
+            (user_ids[6], user_ids[11]),
+            (user_ids[12], user_ids[17]),
+            (user_ids[18], user_ids[19]),
+        ] == pk_ranges
+
+    @pytest.mark.parametrize("chunk_size", (1, 7, 20, 100))
+    def test_dispatch_drip_chunks(self, settings, chunk_size: int):
+        settings.DRIP_CELERY_CHUNK_SIZE = chunk_size
+        week_ago_drip = self.build_joined_date_drip()
+        week_ago_drip.enabled = True
+        week_ago_drip.save()
+
+        result = dispatch_drip_chunks()
+
+        # 20 users for the first drip, 2 for the second one
+        assert 22 == result.get()
+        assert 22 == SentDrip.objects.count()
+
+    def test_dispatch_without_enabled_drips(self):
+        Drip.objects.update(enabled=False)
+
+        assert dispatch_drip_chunks() is None
+
+    def test_send_drip_chunk_limits_audience(self):
+        user_ids = list(User.objects.order_by("id").values_list("id", flat=True))
+
+        count = send_drip_chunk.delay(self.model_drip.id, user_ids[2], user_ids[4]).get()
+
+        assert 3 == count
+        assert set(user_ids[2:5]) == set(SentDrip.objects.values_list("user_id", flat=True))
+
+    def test_send_drip_chunk_disabled_drip(self):
+        user_ids = list(User.objects.order_by("id").values_list("id", flat=True))
+        Drip.objects.update(enabled=False)
+
+        assert 0 == send_drip_chunk.delay(self.model_drip.id, user_ids[0], user_ids[-1]).get()
@@ -0,0 +1,131 @@
+from unittest.mock import patch
+
+import pytest
+from django.core import mail
+from django.urls import reverse
+
+from drip.drips import DripMessage
+from drip.models import Campaign
+from drip.tests.test_drips import SetupDataDripMixin
+from drip.tokens import EmailToken, UnsubscribeLinks, custom_token_generator
+from drip.utils import LinkTemplate, get_user_model, validate_path_existence
+
+pytestmark = pytest.mark.django_db
+
+User = get_user_model()
+
+LINKS_BODY = "<p>{{ unsubscribe_link_drip }} {{ unsubscribe_link_campaign }} {{ unsubscribe_link }}</p>"
+
+
+class TestLinkTemplate:
+    def test_builds_the_reversed_link(self):
+        url_args = {"uidb64": "MTI", "token": "bg9sxk-32b5a0cfa55b8e1b3ec4f2d0a4a7c0b1"}
+
+        assert validate_path_existence("unsubscribe_app", url_args) == LinkTemplate(
+            "unsubscribe_app", ("uidb64", "token")
+        ).build(url_args)
+
+    def test_arguments_not_matching_the_pattern(self):
+        link = LinkTemplate("unsubscribe_app", ("uidb64", "token"))
+
+        with patch("drip.utils.validate_path_existence", wraps=validate_path_existence) as validate:
+            # uidb64 only accepts word characters
+            assert link.build({"uidb64": "MT-I", "token": "abc-123"}) is None
+            assert link.build({"uidb64": "MTI", "token": "a/b"}) is None
+
+        assert 2 == validate.call_count
+
+    def test_missing_url(self):
+        link = LinkTemplate("missing_unsubscribe", ("uidb64", "token"))
+
+        assert link.build({"uidb64": "MTI", "token": "abc-123"}) is None
+
+
+class TestUnsubscribeLinks(SetupDataDripMixin):
+    @pytest.fixture(autouse=True)
+    def unsubscribe_users(self, settings):
+        settings.DRIP_UNSUBSCRIBE_USERS = True
+
+    def setup_method(self, test_method):
+        self.build_user_data()
+        self.model_drip = self.build_everyone_drip()
+        self.model_drip.campaign = Campaign.objects.create(name="Campaign")
+        self.model_drip.body_html_template = LINKS_BODY
+        self.model_drip.save()
+
+    def reverse_links(self, user):
+        """Links built like before they were built from link templates."""
+        email_token = EmailToken(user)
+        drip_uidb64, uidb64, token = email_token.get_uidb64_token(self.model_drip.pk)
+        campaign_uidb64, uidb64, token = email_token.get_uidb64_token(self.model_drip.campaign.pk)
+        return {
+            "unsubscribe_link_drip": validate_path_existence(
+                "unsubscribe_drip", {"drip_uidb64": drip_uidb64, "uidb64": uidb64, "token": token}
+            ),
+            "unsubscribe_link_campaign": validate_path_existence(
+                "unsubscribe_campaign", {"campaign_uidb64": campaign_uidb64, "uidb64": uidb64, "token": token}
+            ),
+            "unsubscribe_link": validate_path_existence("unsubscribe_app", {"uidb64": uidb64, "token": token}),
+        }
+
+    def test_links_match_the_reversed_urls(self):
+        drip = self.model_drip.drip
+        # tokens embed the current second, both sides must build them in the same one
+        now = custom_token_generator._now()
+
+        with patch.object(custom_token_generator, "_now", return_value=now):
+            self.assert_links_match_the_reversed_urls(drip)
+
+    def assert_links_match_the_reversed_urls(self, drip):
+        for user in drip.get_queryset():
+            message = DripMessage(drip, user)
+            links = self.reverse_links(user)
+            assert all(links.values())
+            assert links == {name: message.get_unsubscribe_link(name) for name in links}
+            assert links == {name: message.build_context()[name] for name in links}
+            assert "<p>{unsubscribe_link_drip} {unsubscribe_link_campaign} {unsubscribe_link}</p>".format(
+                **links
+            ) == str(message.body)
+
+    def test_one_token_per_message_and_urls_reversed_once(self):
+        with patch.object(
+            custom_token_generator, "make_token", wraps=custom_token_generator.make_token
+        ) as make_token, patch("drip.utils.reverse", wraps=reverse) as reverse_url:
+            assert 20 == self.model_drip.drip.send()
+
+        assert 20 == make_token.call_count
+        assert 3 == reverse_url.call_count
+
+    def test_unused_links_are_not_built(self):
+        self.model_drip.body_html_template = "<p>{{ unsubscribe_link }}</p>"
+        self.model_drip.save()
+
+        with patch.object(UnsubscribeLinks, "build", autospec=True, side_effect=UnsubscribeLinks.build) as build:
+            assert 20 == self.model_drip.drip.send()
+
+        assert {"unsubscribe_link"} == {call.args[1] for call in build.call_args_list}
+        assert 20 == build.call_count
+
+    def test_templates_without_links_compute_no_token(self):
+        self.model_drip.body_html_template = "<p>Hi {{ user.username }}</p>"
+        self.model_drip.save()
+
+        with patch.object(custom_token_generator, "make_token") as make_token:
+            assert 20 == self.model_drip.drip.send()
+
+        make_token.assert_not_called()
+        assert 20 == len(mail.outbox)
+
+    def test_custom_context_gets_the_links(self):
+        class FooterMessage(DripMessage):
+            def build_context(self):
+                context = super().build_context()
+                context["footer"] = "Unsubscribe at {link}".format(link=context["unsubscribe_link"])
+                return context
+
+        drip = self.model_drip.drip
+        user = drip.get_queryset().first()
+
+        context = FooterMessage(drip, user).build_context()
+
+        assert "Unsubscribe at {link}".format(link=self.reverse_links(user)["unsubscribe_link"]) == context["footer"]
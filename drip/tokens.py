@@ -1,4 +1,4 @@
-from typing import Optional, Tuple
+from typing import Dict, Optional, Tuple
 
 from django.contrib.auth.models import AbstractBaseUser
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
@@ -7,7 +7,7 @@ from django.utils.encoding import force_bytes, force_str
 from django.utils.http import base36_to_int, urlsafe_base64_decode, urlsafe_base64_encode
 
 from drip.models import Campaign, Drip
-from drip.utils import get_user_model
+from drip.utils import LinkTemplate, get_user_model
 
 User = get_user_model()
 
@@ -136,3 +136,28 @@ class EmailToken:
         except (TypeError, ValueError, OverflowError, Campaign.DoesNotExist):
             campaign = None
         return campaign
+
+
+class UnsubscribeLinks:
+    """
+    Builds the unsubscribe links of the users of a drip run. The URL patterns are reversed once per run,
+    and the token of each user is computed once for all of its links.
+    """
+
+    def __init__(self, drip: Drip):
+        self.drip_uidb64 = urlsafe_base64_encode(force_bytes(drip.pk))
+        self.campaign_uidb64 = urlsafe_base64_encode(force_bytes(drip.campaign_id)) if drip.campaign_id else None
+        self.drip_link = LinkTemplate("unsubscribe_drip", ("drip_uidb64", "uidb64", "token"))
+        self.campaign_link = LinkTemplate("unsubscribe_campaign", ("campaign_uidb64", "uidb64", "token"))
+        self.app_link = LinkTemplate("unsubscribe_app", ("uidb64", "token"))
+
+    def build(self, name: str, uidb64: str, token: str) -> Optional[str]:
+        """Returns the "unsubscribe_link_drip", "unsubscribe_link_campaign" or "unsubscribe_link" of a user."""
+        url_args: Dict[str, str] = {"uidb64": uidb64, "token": token}
+        if name == "unsubscribe_link_drip":
+            return self.drip_link.build(dict(url_args, drip_uidb64=self.drip_uidb64))
+        if name == "unsubscribe_link_campaign":
+            if self.campaign_uidb64 is None:
+                return None
+            return self.campaign_link.build(dict(url_args, campaign_uidb64=self.campaign_uidb64))
+        return self.app_link.build(url_args)
@@ -1,12 +1,17 @@
+import re
 from datetime import datetime, timedelta
-from typing import Any, Callable, Dict, List, Optional, Type
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Optional, Pattern, Sequence, Type
 
 import six
 from django.contrib.auth.models import User
+from django.core.exceptions import FieldDoesNotExist
 from django.db import models
 from django.db.models import ForeignKey, ManyToManyField, OneToOneField
+from django.db.models.constants import LOOKUP_SEP
 from django.db.models.fields.related import ForeignObjectRel as RelatedObject
-from django.urls import NoReverseMatch, reverse
+from django.db.models.query import QuerySet
+from django.urls import NoReverseMatch, get_resolver, get_script_prefix, reverse
 
 from drip.scheduler.constants import VALID_SCHEDULERS, get_drip_scheduler_settings
 from drip.types import FieldType
@@ -176,6 +181,69 @@ def give_model_field(full_field: str, Model: Type[models.Model]) -> tuple:
     raise Exception(message_exception)
 
 
+@lru_cache(maxsize=None)
+def get_model_field(Model: Type[models.Model], full_field: str) -> Optional[models.Field]:
+    """Given a field_name and Model, returns the field holding the values of that field_name,
+    found with the metadata of ``get_fields``. Relations and unknown fields return None.
+
+    :param Model: models.Model
+    :type Model: models.Model
+    :param full_field: full field name, like "profile__credits"
+    :type full_field: str
+    :return: The model field, or None
+    :rtype: Optional[models.Field]
+    """
+    try:
+        _, name, FieldModel, FieldClass = give_model_field(full_field, Model)
+    except Exception:
+        return None
+    if issubclass(FieldClass, RelatedObject):
+        return None
+    field = FieldModel._meta.get_field(name)
+    if field.is_relation:
+        return None
+    return field
+
+
+def is_multi_valued(Model: Type[models.Model], full_field: str) -> bool:
+    """Given a Model and a field_name like "groups__name", returns whether the
+    field_name crosses a relation to many objects, like a ManyToManyField or a reverse ForeignKey.
+    Filtering over those fields can return the same object more than once.
+
+    :param Model: models.Model
+    :type Model: models.Model
+    :param full_field: full field name
+    :type full_field: str
+    :return: Whether the field_name crosses a multi-valued relation
+    :rtype: bool
+    """
+    for field_name in full_field.split(LOOKUP_SEP):
+        try:
+            field = Model._meta.get_field(field_name)
+        except FieldDoesNotExist:
+            # transforms and lookups, like "date_joined__date"
+            return False
+        if field.many_to_many or field.one_to_many:
+            return True
+        if not field.is_relation:
+            return False
+        Model = field.related_model
+    return False
+
+
+def may_repeat_rows(queryset: QuerySet) -> bool:
+    """Given a queryset, returns whether it may return the same object more than once,
+    because it joins other tables, which may be relations to many objects, or it is distinct.
+    Distinct querysets stay distinct.
+
+    :param queryset: Queryset to check
+    :type queryset: QuerySet
+    :return: Whether the queryset must be made distinct
+    :rtype: bool
+    """
+    return queryset.query.distinct or len(queryset.query.alias_map) > 1
+
+
 def get_simple_fields(Model: Type[models.Model], **kwargs) -> List:
     ret_list: List = []
     for f in get_fields(Model, **kwargs):
@@ -232,3 +300,67 @@ def validate_path_existence(path: str, url_args: Dict[str, Any]) -> Optional[str
     except NoReverseMatch:
         return None
     return unsubscribe_link
+
+
+# Characters that reverse() never quotes in the arguments of a URL.
+UNRESERVED_RE = re.compile(r"^[A-Za-z0-9_.~-]*$")
+LINK_MARKER_RE = re.compile(r"(dripmarker\d+x)")
+
+
+class LinkTemplate(object):
+    """
+    URL pattern reversed once into the strings around its arguments, so building the link of each
+    user only joins strings. Like ``reverse``, links are checked against the URL pattern, and built
+    with ``validate_path_existence`` when they do not match it.
+
+    :param path: Name of the URL pattern
+    :type path: str
+    :param arg_names: Names of the keyword arguments of the URL pattern
+    :type arg_names: Sequence[str]
+    """
+
+    def __init__(self, path: str, arg_names: Sequence[str]):
+        self.path = path
+        self.parts: Optional[List[str]] = None
+        self.patterns: List[Pattern] = []
+        markers = {name: "dripmarker{index}x".format(index=index) for index, name in enumerate(arg_names)}
+        sample_link = validate_path_existence(path, markers)
+        if sample_link is None:
+            return
+        names = {marker: name for name, marker in markers.items()}
+        # literal strings at even positions, argument names at odd ones
+        self.parts = [
+            names.get(part, part) if index % 2 else part for index, part in enumerate(LINK_MARKER_RE.split(sample_link))
+        ]
+        prefix = re.escape(get_script_prefix())
+        self.patterns = [
+            re.compile("^{prefix}{pattern}".format(prefix=prefix, pattern=pattern))
+            for possibilities, pattern, defaults, converters in get_resolver().reverse_dict.getlist(path)
+        ]
+
+    def build(self, url_args: Dict[str, str]) -> Optional[str]:
+        if self.parts is None or not all(UNRESERVED_RE.match(value) for value in url_args.values()):
+            return validate_path_existence(self.path, url_args)
+        link = "".join(url_args[part] if index % 2 else part for index, part in enumerate(self.parts))
+        if not any(pattern.search(link) for pattern in self.patterns):
+            return validate_path_existence(self.path, url_args)
+        return link
+
+
+def queryset_chunks(queryset: QuerySet, chunk_size: int) -> Iterator[List[Any]]:
+    """
+    Yields the objects of the queryset in lists of up to ``chunk_size`` objects,
+    paginating on the primary key (keyset pagination). Only one chunk is kept
+    in memory at once and the queryset result cache is never filled.
+    """
+    queryset = queryset.order_by("pk")
+    last_pk = None
+    while True:
+        chunk_queryset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk_queryset[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1].pk